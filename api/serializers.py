@@ -4,7 +4,9 @@ from core.models import Pais, Moneda, MonedaPais, Mercado, Fuente
 from usuarios.models import Persona, Usuario, Rol, UsuarioRol, Colaborador
 from corredoras.models import Corredora, CorredoraIdentificador, UsuarioCorredora
 from instrumentos.models import Instrumento, EventoCapital
-from calificaciones.models import FactorDef, Calificacion, CalificacionMontoDetalle, CalificacionFactorDetalle
+from calificaciones.models import (
+    FactorDef, Calificacion, CalificacionMontoDetalle, CalificacionFactorDetalle, RecalculoFactores
+)
 from cargas.models import Carga, CargaDetalle
 from auditoria.models import Auditoria
 
@@ -425,6 +427,25 @@ class CalificacionSerializer(serializers.ModelSerializer):
         read_only_fields = ['creado_por', 'actualizado_por', 'creado_en', 'actualizado_en']
 
 
+class RecalculoFactoresSerializer(serializers.ModelSerializer):
+    creado_por_username = serializers.CharField(source='creado_por.username', read_only=True)
+    filtros = serializers.SerializerMethodField()
+    porcentaje = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = RecalculoFactores
+        fields = '__all__'
+    
+    def get_filtros(self, obj):
+        """Parámetros de búsqueda del recálculo (las corredoras permitidas no se exponen)"""
+        return json.loads(obj.filtros or '{}').get('parametros', {})
+    
+    def get_porcentaje(self, obj):
+        if not obj.total:
+            return 100 if obj.estado == 'done' else 0
+        return round(obj.procesadas * 100 / obj.total, 1)
+
+
 # ========= SERIALIZERS CARGAS =========
 
 class CargaDetalleSerializer(serializers.ModelSerializer):
@@ -442,7 +463,10 @@ class CargaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Carga
         fields = '__all__'
-        read_only_fields = ['filas_total', 'insertados', 'actualizados', 'rechazados']
+        read_only_fields = [
+            'filas_total', 'insertados', 'actualizados', 'rechazados', 'omitidos', 'hash_archivo',
+            'staging_validado_en', 'reconciliacion', 'tiempos',
+        ]
 
 
 # ========= SERIALIZERS AUDITORIA =========
@@ -1,3 +1,155 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from calificaciones.models import Calificacion, CalificacionFactorDetalle
+from calificaciones.tests import crear_calificacion
+from cargas.models import Carga, CargaDetalle
+from cargas.tests import (
+    COLUMNAS_FACTORES, COLUMNAS_MONTOS, LINEAS_FACTORES, LINEAS_MONTOS, CargaWorkerTestCase, archivo_csv, archivo_zip,
+)
+
+
+class CargaViewSetTests(CargaWorkerTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin'))
+
+    def _subir(self, accion, nombre, contenido, **datos):
+        return self.client.post(
+            f'/api/cargas/{accion}/', {'file': SimpleUploadedFile(nombre, contenido), **datos}, format='multipart'
+        )
+
+    def test_upload_factores_se_procesa_en_el_worker(self):
+        respuesta = self._subir('upload_factores', 'factores.csv', archivo_csv(COLUMNAS_FACTORES, LINEAS_FACTORES))
+
+        self.assertEqual(respuesta.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(respuesta.json()['estado'], 'validando')
+        self._procesar()
+        resultado = self.client.get(f"/api/cargas/{respuesta.json()['carga_id']}/resultado/").json()
+        self.assertEqual(
+            [resultado[campo] for campo in ('estado', 'filas_total', 'insertados', 'actualizados', 'rechazados')],
+            ['done', 14, 2, 0, 12]
+        )
+        self.assertEqual(len(resultado['errores']), 10)
+
+    def test_zip_crea_una_carga_por_csv(self):
+        contenido = archivo_csv(COLUMNAS_MONTOS, LINEAS_MONTOS)
+
+        respuesta = self._subir(
+            'upload_montos', 'montos.zip', archivo_zip({'uno.csv': contenido, 'leeme.txt': b'x', 'dos.csv': contenido})
+        )
+
+        self.assertEqual(respuesta.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual([carga['archivo'] for carga in respuesta.json()['cargas']], ['uno.csv', 'dos.csv'])
+        self._procesar()
+        self.assertEqual(
+            list(Carga.objects.order_by('id_carga').values_list('nombre_archivo', 'estado')),
+            [('montos.zip/uno.csv', 'done'), ('montos.zip/dos.csv', 'done')]
+        )
+
+    def test_zip_sin_csv(self):
+        respuesta = self._subir('upload_montos', 'montos.zip', archivo_zip({'leeme.txt': b'x'}))
+
+        self.assertEqual(respuesta.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Carga.objects.exists())
+
+    def test_parquet_sin_pyarrow(self):
+        with mock.patch('api.views.PYARROW_AVAILABLE', False):
+            respuesta = self._subir('upload_montos', 'montos.parquet', b'PAR1')
+
+        self.assertEqual(respuesta.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pyarrow', respuesta.json()['error'])
+        self.assertFalse(Carga.objects.exists())
+
+    def test_reanudar_solo_cargas_fallidas_o_pausadas(self):
+        respuesta = self._subir('upload_factores', 'factores.csv', archivo_csv(COLUMNAS_FACTORES, LINEAS_FACTORES))
+        carga = Carga.objects.get(pk=respuesta.json()['carga_id'])
+        Carga.objects.filter(pk=carga.pk).update(estado='failed', iniciado_en=timezone.now(), mensaje_error='caída')
+
+        respuesta = self.client.post(f'/api/cargas/{carga.pk}/reanudar/')
+
+        self.assertEqual(respuesta.status_code, status.HTTP_202_ACCEPTED)
+        self._procesar()
+        carga.refresh_from_db()
+        self.assertEqual((carga.estado, carga.mensaje_error), ('done', None))
+        self.assertEqual(
+            self.client.post(f'/api/cargas/{carga.pk}/reanudar/').status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_calculate_factores(self):
+        respuesta = self._subir('calculate_factores', 'montos.csv', archivo_csv(COLUMNAS_MONTOS, LINEAS_MONTOS))
+
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        datos = respuesta.json()
+        self.assertEqual((datos['total_filas'], datos['validas'], datos['rechazadas']), (9, 8, 1))
+        self.assertFalse(datos['preview_truncado'])
+        self.assertEqual(datos['errores'], [
+            {'linea': 3, 'error': 'Monto M08 no es un número válido (línea 2)'}
+        ])
+        primera = datos['preview'][0]
+        suma = Decimal('4500.00')
+        self.assertEqual(primera['suma_montos'], str(suma))
+        self.assertEqual(primera['factores'], {
+            codigo: str((Decimal(monto) / suma).quantize(Decimal('1e-8'), ROUND_HALF_UP))
+            for codigo, monto in (('F08', '1000.00'), ('F09', '2000.00'), ('F10', '1500.00'))
+        })
+
+    @override_settings(CARGA_PREVIEW_MAX_FILAS=3, CARGA_BATCH_SIZE=4)
+    def test_calculate_factores_limita_filas_y_errores(self):
+        lineas = [{'Secuencia Evento': str(numero), 'M08': 'x' if numero % 2 else '1', 'M09': '2'} for numero in range(30)]
+        contenido = archivo_csv(COLUMNAS_MONTOS, lineas)
+
+        respuesta = self._subir('calculate_factores', 'montos.zip', archivo_zip({'a.csv': contenido, 'b.csv': contenido}))
+
+        datos = respuesta.json()
+        self.assertEqual((datos['total_filas'], datos['validas'], datos['rechazadas']), (60, 30, 30))
+        self.assertTrue(datos['preview_truncado'])
+        self.assertEqual([(fila['archivo'], fila['linea']) for fila in datos['preview']], [('a.csv', '1'), ('a.csv', '3'), ('a.csv', '5')])
+        self.assertEqual([error['linea'] for error in datos['errores']], list(range(3, 23, 2)))
+
+
+class DetalleCalificacionViewSetTests(CargaWorkerTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin'))
+        self.calificacion = crear_calificacion(self.catalogos, '0001')
+        self.detalle = CalificacionFactorDetalle.objects.create(
+            id_calificacion=self.calificacion, id_factor=self.catalogos.factores['F08'], valor_factor=Decimal('0.1')
+        )
+        self.antes = timezone.now() - timedelta(days=1)
+        Calificacion.objects.update(actualizado_en=self.antes)
+
+    def _modificada(self):
+        self.calificacion.refresh_from_db()
+        return self.calificacion.actualizado_en > self.antes
+
+    def test_editar_un_factor_actualiza_la_calificacion(self):
+        respuesta = self.client.patch(
+            f'/api/calificacion-factor-detalle/{self.detalle.pk}/', {'valor_factor': '0.2'}, format='json'
+        )
+
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        self.assertTrue(self._modificada())
+
+    def test_borrar_un_factor_actualiza_la_calificacion(self):
+        respuesta = self.client.delete(f'/api/calificacion-factor-detalle/{self.detalle.pk}/')
+
+        self.assertEqual(respuesta.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(self._modificada())
+
+    def test_omitir_duplicadas_vuelve_a_cargar_la_calificacion_editada(self):
+        contenido = archivo_csv(COLUMNAS_FACTORES, LINEAS_FACTORES[:1])
+        self._cargar(contenido)
+        self.client.patch(f'/api/calificacion-factor-detalle/{self.detalle.pk}/', {'valor_factor': '0.3'}, format='json')
+
+        carga = self._cargar(contenido, omitir_duplicadas=True)
+
+        self.assertEqual(list(CargaDetalle.objects.filter(id_carga=carga).values_list('estado_linea', flat=True)), ['ok'])
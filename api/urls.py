@@ -11,7 +11,7 @@ from .views import (
     InstrumentoViewSet, EventoCapitalViewSet,
     # Calificaciones
     FactorDefViewSet, CalificacionViewSet,
-    CalificacionMontoDetalleViewSet, CalificacionFactorDetalleViewSet,
+    CalificacionMontoDetalleViewSet, CalificacionFactorDetalleViewSet, RecalculoFactoresViewSet,
     # Cargas
     CargaViewSet, CargaDetalleViewSet,
     # Auditoria
@@ -52,6 +52,7 @@ router.register(r'factores', FactorDefViewSet, basename='factor')
 router.register(r'calificaciones', CalificacionViewSet, basename='calificacion')
 router.register(r'calificacion-monto-detalle', CalificacionMontoDetalleViewSet, basename='calificacionmontodetalle')
 router.register(r'calificacion-factor-detalle', CalificacionFactorDetalleViewSet, basename='calificacionfactordetalle')
+router.register(r'recalculos', RecalculoFactoresViewSet, basename='recalculofactores')
 
 # Cargas
 router.register(r'cargas', CargaViewSet, basename='carga')
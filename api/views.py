@@ -1,22 +1,24 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.renderers import BaseRenderer
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from django.db.models import Q
 from django.db import transaction
 from django.http import HttpResponse, StreamingHttpResponse
 import csv
+import json
 import io
-import hashlib
-import unicodedata
 from datetime import datetime, timedelta
+from itertools import chain
+from contextlib import nullcontext
 from decimal import Decimal, InvalidOperation
 from django.utils import timezone
+from django.conf import settings
 from django.db.models import Avg, Count, Q, F, Sum
 from django.db.models.functions import Extract
 import statistics
 try:
-    from openpyxl import Workbook, load_workbook
+    from openpyxl import Workbook
     OPENPYXL_AVAILABLE = True
 except ImportError:
     OPENPYXL_AVAILABLE = False
@@ -42,6 +44,23 @@ class BinaryFileRenderer(BaseRenderer):
             return data.content
         return data
 
+class EventStreamRenderer(BaseRenderer):
+    """Acepta 'Accept: text/event-stream' (EventSource) en las acciones que responden SSE"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Solo se usa para respuestas de error (la acción retorna un StreamingHttpResponse)
+        return f'event: error\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+
+class _LineaCSV:
+    """Destino de csv.writer que retorna la línea escrita (para StreamingHttpResponse)"""
+    
+    def write(self, valor):
+        return valor
+
+
 # Core
 from core.models import Pais, Moneda, MonedaPais, Mercado, Fuente
 from .serializers import (
@@ -70,14 +89,32 @@ from .serializers import (
 )
 
 # Calificaciones
-from calificaciones.models import FactorDef, Calificacion, CalificacionMontoDetalle, CalificacionFactorDetalle
+from calificaciones.models import (
+    FactorDef, Calificacion, CalificacionMontoDetalle, CalificacionFactorDetalle, RecalculoFactores
+)
+from calificaciones.detalles import marcar_calificaciones_modificadas, sincronizar_detalles
+from calificaciones.filtros import PARAMETROS_FILTRO, filtrar_calificaciones
+from calificaciones.recalculo import serializar_filtros
 from .serializers import (
     FactorDefSerializer, CalificacionSerializer,
-    CalificacionMontoDetalleSerializer, CalificacionFactorDetalleSerializer
+    CalificacionMontoDetalleSerializer, CalificacionFactorDetalleSerializer, RecalculoFactoresSerializer
 )
 
 # Cargas
-from cargas.models import Carga, CargaDetalle
+from cargas.importers import interrumpir_carga
+from cargas.models import Carga, CargaDetalle, CargaLineaPreparada
+from cargas.motor_factores import CODIGOS_FACTOR, CODIGOS_MONTO, MotorFactores
+from cargas.perfiles import obtener_perfil
+from cargas.progreso import eventos_progreso, leer_progreso, limpiar_solicitud
+from cargas.validacion import (
+    TIPO_ERROR_OTRO, TIPOS_ERROR, CargaError, MapeoColumnas, aplicar_perfil, decimal_de_celda,
+    parse_bool, registro_desde_json, tipo_error
+)
+from cargas.readers import (
+    ERRORES_LECTURA, PYARROW_AVAILABLE, abrir_lector, cerrar_lector, es_comprimido, es_csv, es_excel, es_parquet,
+    es_zip, miembros_zip
+)
+from cargas.uploads import sha256_archivo
 from .serializers import (
     CargaSerializer, CargaDetalleSerializer
 )
@@ -553,30 +590,7 @@ class CalificacionViewSet(viewsets.ModelViewSet):
                     queryset = queryset.none()
         
         # Filtros de búsqueda (se aplican después del filtro de seguridad)
-        estado = self.request.query_params.get('estado')
-        corredora_id = self.request.query_params.get('corredora')
-        mercado_id = self.request.query_params.get('mercado')
-        fuente_id = self.request.query_params.get('origen') or self.request.query_params.get('fuente')
-        ejercicio = self.request.query_params.get('ejercicio') or self.request.query_params.get('periodo')
-        pendiente = self.request.query_params.get('pendiente')
-        
-        if estado:
-            queryset = queryset.filter(estado=estado)
-        if corredora_id:
-            queryset = queryset.filter(id_corredora_id=corredora_id)
-        if mercado_id:
-            # Filtrar por mercado a través del instrumento
-            queryset = queryset.filter(id_instrumento__id_mercado_id=mercado_id)
-        if fuente_id:
-            queryset = queryset.filter(id_fuente_id=fuente_id)
-        if ejercicio:
-            queryset = queryset.filter(ejercicio=ejercicio)
-        if pendiente is not None:
-            # Si pendiente=True, filtrar por estado='pendiente'
-            if pendiente.lower() == 'true':
-                queryset = queryset.filter(estado='pendiente')
-        
-        return queryset
+        return filtrar_calificaciones(queryset, self.request.query_params)
     
     def perform_create(self, serializer):
         """
@@ -736,61 +750,36 @@ class CalificacionViewSet(viewsets.ModelViewSet):
         Helper para calcular factores desde montos (reutilizable para preview y grabado)
         Retorna: (factores_calculados, suma_montos, suma_factores, montos_dict, factor_map, errores)
         """
-        # Obtener montos de la calificación
-        montos_detalle = CalificacionMontoDetalle.objects.filter(id_calificacion=calificacion)
+        # Obtener montos de la calificación (con el código del factor en la misma consulta)
+        montos_detalle = list(
+            CalificacionMontoDetalle.objects.filter(id_calificacion=calificacion)
+            .values_list('id_factor__codigo_factor', 'valor_monto')
+        )
         
-        if not montos_detalle.exists():
+        if not montos_detalle:
             return None, None, None, None, None, 'La calificación no tiene montos para calcular factores'
         
-        # Obtener códigos de factores F08-F37
-        factor_codigos = [f'F{i:02d}' for i in range(8, 38)]
-        factor_map = {}
-        for factor in FactorDef.objects.filter(codigo_factor__in=factor_codigos):
-            factor_map[factor.codigo_factor] = factor
+        # Obtener factores F08-F37
+        factor_map = {
+            factor.codigo_factor: factor
+            for factor in FactorDef.objects.filter(codigo_factor__in=CODIGOS_FACTOR)
+        }
         
-        # Convertir montos a diccionario
+        # Convertir montos a diccionario (M08-M37)
         montos_dict = {}
-        for monto_detalle in montos_detalle:
-            codigo_factor = monto_detalle.id_factor.codigo_factor
-            monto_key = codigo_factor.replace('F', 'M')  # F08 -> M08
-            if monto_detalle.valor_monto and monto_detalle.valor_monto > 0:
-                montos_dict[monto_key] = monto_detalle.valor_monto
+        for codigo_factor, valor_monto in montos_detalle:
+            if codigo_factor in CODIGOS_FACTOR and valor_monto and valor_monto > 0:
+                montos_dict[CODIGOS_MONTO[CODIGOS_FACTOR.index(codigo_factor)]] = valor_monto
         
         if not montos_dict:
             return None, None, None, None, None, 'No hay montos válidos para calcular factores'
         
-        # Calcular factores usando la lógica existente (misma que en CargaViewSet)
-        factores_calculados = {}
-        suma_montos = Decimal('0')
-        
-        # Calcular suma total de montos
-        for codigo in factor_codigos:
-            monto_key = codigo.replace('F', 'M')  # M08-M37 para montos
-            if monto_key in montos_dict:
-                monto = montos_dict[monto_key]
-                if monto and monto > 0:
-                    suma_montos += monto
-        
-        # Si no hay montos, retornar factores vacíos
-        if suma_montos == 0:
-            return None, None, None, None, None, 'No hay montos válidos para calcular factores'
-        
-        # Calcular factores proporcionales
-        suma_factores_aplicados = Decimal('0')
-        for codigo in factor_codigos:
-            monto_key = codigo.replace('F', 'M')  # M08-M37 para montos
-            if monto_key in montos_dict and codigo in factor_map:
-                monto = montos_dict[monto_key]
-                if monto and monto > 0:
-                    # Calcular factor proporcional
-                    factor = monto / suma_montos
-                    factores_calculados[codigo] = factor
-                    
-                    # Si el factor aplica en suma, agregarlo a la suma
-                    if factor_map[codigo].aplica_en_suma:
-                        suma_factores_aplicados += factor
-        
-        suma_factores = suma_factores_aplicados
+        # Calcular factores con el mismo motor que usan las cargas masivas
+        fila = [montos_dict.get(monto_key) for monto_key in CODIGOS_MONTO]
+        factores, suma_montos, suma_factores = MotorFactores(factor_map).calcular([fila])[0]
+        factores_calculados = {
+            codigo: factor for codigo, factor in zip(CODIGOS_FACTOR, factores) if factor is not None
+        }
         
         # Validar suma de factores
         if suma_factores > Decimal('1'):
@@ -864,19 +853,18 @@ class CalificacionViewSet(viewsets.ModelViewSet):
         
         # Guardar factores en calificacion_factor_detalle
         with transaction.atomic():
-            # Eliminar factores antiguos
-            CalificacionFactorDetalle.objects.filter(id_calificacion=calificacion).delete()
-            
-            # Guardar factores calculados
+            # Sincronizar factores: solo se escriben los que cambiaron (el resto se conserva)
             factores_guardados = {}
+            valores_factores = {}
             for codigo, factor in factores_calculados.items():
                 if codigo in factor_map:
-                    detalle = CalificacionFactorDetalle.objects.create(
-                        id_calificacion=calificacion,
-                        id_factor=factor_map[codigo],
-                        valor_factor=factor
-                    )
+                    valores_factores[factor_map[codigo].id_factor] = factor
                     factores_guardados[codigo] = str(factor)
+            # calificacion.save() de abajo actualiza actualizado_en
+            sincronizar_detalles(
+                CalificacionFactorDetalle, 'valor_factor',
+                {calificacion.id_calificacion: valores_factores}, actualizar_calificacion=False
+            )
             
             # Actualizar calificación
             calificacion.ingreso_por_montos = True
@@ -908,6 +896,56 @@ class CalificacionViewSet(viewsets.ModelViewSet):
             'total_factores': len(factores_guardados)
         }, status=status.HTTP_200_OK)
     
+    @action(detail=False, methods=['post'])
+    def recalcular_factores(self, request):
+        """
+        Recalcular en segundo plano los factores desde montos de todas las calificaciones
+        que cumplen los filtros de búsqueda (corredora, ejercicio, estado, mercado, ...).
+        Los filtros se reciben en el cuerpo o en la URL. El avance se consulta en
+        /api/recalculos/{id}/.
+        """
+        from usuarios.models import Usuario
+        
+        user_roles = self._get_user_rol_names(request.user)
+        if 'consultor' in user_roles or 'auditor' in user_roles:
+            raise permissions.PermissionDenied(
+                "No tienes permiso para recalcular factores. Tu rol es de solo lectura."
+            )
+        try:
+            usuario = Usuario.objects.get(username=request.user.username)
+        except Usuario.DoesNotExist:
+            return Response(
+                {'error': 'El usuario no existe en el sistema. Contacta al administrador.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Mismo filtro de seguridad que get_queryset: solo las corredoras del usuario
+        corredoras = None
+        if not self._is_admin_or_superuser(request.user):
+            corredoras = self._get_user_corredoras(request.user)
+            if not corredoras:
+                raise permissions.PermissionDenied(
+                    "No tienes corredoras asignadas. No puedes recalcular factores."
+                )
+        
+        parametros = {}
+        for nombre in PARAMETROS_FILTRO:
+            valor = request.data.get(nombre) or request.query_params.get(nombre)
+            if valor not in (None, ''):
+                parametros[nombre] = str(valor)
+        
+        recalculo = RecalculoFactores.objects.create(
+            creado_por=usuario,
+            filtros=serializar_filtros(parametros, corredoras),
+            estado='pendiente'
+        )
+        return Response({
+            'recalculo_id': recalculo.id_recalculo,
+            'estado': recalculo.estado,
+            'filtros': parametros,
+            'mensaje': 'Recálculo encolado. Se procesará en segundo plano.'
+        }, status=status.HTTP_202_ACCEPTED)
+    
     @action(detail=False, methods=['get'])
     def export_excel(self, request):
         """Exportar calificaciones a Excel (.xlsx)"""
@@ -1068,13 +1106,35 @@ class CalificacionViewSet(viewsets.ModelViewSet):
         return response
 
 
-class CalificacionMontoDetalleViewSet(viewsets.ModelViewSet):
+class DetalleCalificacionMixin:
+    """
+    Crear, editar o borrar un detalle de factor/monto modifica la calificación:
+    se actualiza su actualizado_en (las cargas masivas comparan contra esa fecha
+    para omitir líneas ya cargadas y para la reconciliación).
+    """
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        marcar_calificaciones_modificadas([serializer.instance.id_calificacion_id])
+
+    def perform_update(self, serializer):
+        id_anterior = serializer.instance.id_calificacion_id
+        super().perform_update(serializer)
+        marcar_calificaciones_modificadas({id_anterior, serializer.instance.id_calificacion_id})
+
+    def perform_destroy(self, instance):
+        id_calificacion = instance.id_calificacion_id
+        super().perform_destroy(instance)
+        marcar_calificaciones_modificadas([id_calificacion])
+
+
+class CalificacionMontoDetalleViewSet(DetalleCalificacionMixin, viewsets.ModelViewSet):
     queryset = CalificacionMontoDetalle.objects.all()
     serializer_class = CalificacionMontoDetalleSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class CalificacionFactorDetalleViewSet(viewsets.ModelViewSet):
+class CalificacionFactorDetalleViewSet(DetalleCalificacionMixin, viewsets.ModelViewSet):
     queryset = CalificacionFactorDetalle.objects.all()
     serializer_class = CalificacionFactorDetalleSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -1087,8 +1147,26 @@ class CalificacionFactorDetalleViewSet(viewsets.ModelViewSet):
         return queryset
 
 
+class RecalculoFactoresViewSet(viewsets.ReadOnlyModelViewSet):
+    """Avance y totales de los recálculos masivos de factores (CalificacionViewSet.recalcular_factores)"""
+    queryset = RecalculoFactores.objects.select_related('creado_por').order_by('-creado_en', '-id_recalculo')
+    serializer_class = RecalculoFactoresSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        estado = self.request.query_params.get('estado')
+        if estado:
+            queryset = queryset.filter(estado=estado)
+        return queryset
+
+
 # ========= VIEWSETS CARGAS =========
 
+# Errores que devuelve calculate_factores (el resto solo se cuenta en 'rechazadas')
+MAX_ERRORES_PREVIEW = 10
+
+
 class CargaViewSet(viewsets.ModelViewSet):
     queryset = Carga.objects.all()
     serializer_class = CargaSerializer
@@ -1146,25 +1224,14 @@ class CargaViewSet(viewsets.ModelViewSet):
         response['Content-Disposition'] = 'attachment; filename="formato_carga_factor.xlsx"'
         return response
     
-    @action(detail=False, methods=['post'])
-    def upload_factores(self, request):
-        """Carga masiva de calificaciones con factores ya calculados"""
-        
-        # Obtener archivo CSV o Excel
-        if 'file' not in request.FILES:
-            return Response({'error': 'No se proporcionó archivo'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        file = request.FILES['file']
-        is_excel = file.name.endswith('.xlsx') or file.name.endswith('.xls')
-        is_csv = file.name.endswith('.csv')
-        
-        if not (is_csv or is_excel):
-            return Response({'error': 'El archivo debe ser CSV o Excel (.xlsx, .xls)'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Obtener usuario actual
+    def _obtener_usuario_carga(self, request):
+        """
+        Obtener el Usuario NUAM del request (creándolo si solo existe en auth.User)
+        Retorna (usuario, None) o (None, Response de error)
+        """
+        from usuarios.models import Usuario, Persona
         try:
-            from usuarios.models import Usuario, Persona, Rol
-            usuario = Usuario.objects.get(username=request.user.username)
+            return Usuario.objects.get(username=request.user.username), None
         except Usuario.DoesNotExist:
             # Si no existe en Usuario, crear automáticamente sincronizado con auth.User
             try:
@@ -1181,1029 +1248,566 @@ class CargaViewSet(viewsets.ModelViewSet):
                     estado='activo',
                     hash_password=request.user.password  # Ya está hasheado en auth.User
                 )
+                return usuario, None
             except Exception as e:
-                return Response({'error': f'Error al crear usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return None, Response({'error': f'Error al crear usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except Exception as e:
-            return Response({'error': f'Error al obtener usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return None, Response({'error': f'Error al obtener usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def _encolar_carga(self, request, formato, preparar=False):
+        """
+        Guarda el archivo y crea la Carga en estado 'validando'.
+        El procesamiento lo realiza el worker: python manage.py procesar_cargas
+        Con preparar=True el worker solo valida y deja la carga en vista previa.
+        """
+        # Obtener archivo CSV o Excel
+        if 'file' not in request.FILES:
+            return Response({'error': 'No se proporcionó archivo'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Leer archivo (CSV o Excel)
-        raw_headers = []
-        rows_data = []
+        file = request.FILES['file']
+        error_response = self._validar_extension(file)
+        if error_response:
+            return error_response
+        # Un .zip puede traer varios CSV: se crea una carga por cada uno
+        miembros = [None]
+        if es_zip(file.name):
+            try:
+                miembros = miembros_zip(file)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if not miembros:
+                return Response({'error': 'El archivo zip no contiene archivos CSV'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Perfil de homologación opcional (HomologacionCampo) para archivos de otro formato
+        perfil_origen = (request.data.get('perfil_origen') or '').strip() or None
+        perfil_certificado = (request.data.get('perfil_certificado') or '').strip() or None
+        if perfil_origen:
+            try:
+                obtener_perfil(perfil_origen, perfil_certificado)
+            except CargaError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        usuario, error_response = self._obtener_usuario_carga(request)
+        if error_response:
+            return error_response
+        
+        # Omitir líneas sin cambios respecto de cargas anteriores (parámetro opcional)
+        omitir_duplicadas = parse_bool(
+            request.data.get('omitir_duplicadas'),
+            default=getattr(settings, 'CARGA_OMITIR_DUPLICADAS', False)
+        )
+        # El archivo trae todas las calificaciones de sus corredoras/ejercicios (reconciliación de faltantes)
+        snapshot_completo = parse_bool(request.data.get('snapshot_completo'), default=False)
+        # Validación por conjunto en la BD (carga_staging) en lugar de línea a línea
+        validacion_sql = parse_bool(
+            request.data.get('validacion_sql'),
+            default=getattr(settings, 'CARGA_VALIDACION_SQL', False)
+        )
         
-        try:
-            if is_excel:
-                # Leer Excel
-                if not OPENPYXL_AVAILABLE:
-                    return Response(
-                        {'error': 'openpyxl no está instalado. Ejecuta: pip install openpyxl'},
-                        status=status.HTTP_503_SERVICE_UNAVAILABLE
-                    )
-                
-                # Leer archivo Excel
-                file.seek(0)  # Resetear posición del archivo
-                wb = load_workbook(file, data_only=True)
-                ws = wb.active
-                
-                # Leer headers (primera fila)
-                raw_headers = [str(cell.value) if cell.value else '' for cell in ws[1]]
-                
-                # Leer datos (desde la segunda fila)
-                for row in ws.iter_rows(min_row=2, values_only=False):
-                    row_dict = {}
-                    for idx, cell in enumerate(row):
-                        if idx < len(raw_headers):
-                            header = raw_headers[idx]
-                            value = cell.value
-                            # Convertir a string, manejando None, fechas, números, etc.
-                            if value is None:
-                                row_dict[header] = ''
-                            elif isinstance(value, datetime):
-                                # Formatear fecha como YYYY-MM-DD
-                                row_dict[header] = value.strftime('%Y-%m-%d')
-                            elif hasattr(value, 'date') and hasattr(value.date(), 'strftime'):
-                                # Para objetos date de Python
-                                row_dict[header] = value.date().strftime('%Y-%m-%d')
-                            elif isinstance(value, (int, float)) and header.lower() in ['ejercicio', 'linea']:
-                                # Mantener números para ejercicio y linea
-                                row_dict[header] = str(int(value))
-                            else:
-                                # Convertir a string y limpiar
-                                row_dict[header] = str(value).strip() if value else ''
-                    if any(row_dict.values()):  # Solo agregar si la fila tiene datos
-                        rows_data.append(row_dict)
-                
-                # Crear un reader-like object para compatibilidad con el código existente
-                class ExcelDictReader:
-                    def __init__(self, headers, rows):
-                        self.fieldnames = headers
-                        self.rows = rows
-                        self.index = 0
-                    
-                    def __iter__(self):
-                        return self
-                    
-                    def __next__(self):
-                        if self.index >= len(self.rows):
-                            raise StopIteration
-                        row = self.rows[self.index]
-                        self.index += 1
-                        return row
-                
-                reader = ExcelDictReader(raw_headers, rows_data)
-            else:
-                # Leer CSV
-                file_content = file.read().decode('utf-8-sig')
-                if file_content.lower().startswith('sep='):
-                    file_lines = file_content.splitlines()
-                    file_content = '\n'.join(file_lines[1:]) if len(file_lines) > 1 else ''
-                sample = file_content.splitlines()[0] if file_content else ''
-                delimiter = ';' if sample.count(';') >= sample.count(',') else ','
-                try:
-                    dialect = csv.Sniffer().sniff(sample, delimiters=',;')
-                    delimiter = dialect.delimiter
-                except Exception:
-                    pass
-                reader = csv.DictReader(io.StringIO(file_content), delimiter=delimiter)
-                raw_headers = reader.fieldnames or []
-        except Exception as e:
-            return Response({'error': f'Error al leer archivo: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        def normalize_header(header):
-            header = unicodedata.normalize('NFKD', header or '')
-            header = ''.join(ch for ch in header if not unicodedata.combining(ch))
-            return ''.join(ch for ch in header.lower() if ch.isalnum())
-        
-        header_map = {normalize_header(h): h for h in raw_headers}
-        
-        def get_cell(row, *aliases, default=''):
-            for alias in aliases:
-                normalized = normalize_header(alias)
-                original = header_map.get(normalized)
-                if original and original in row:
-                    value = row[original]
-                    if value is None:
-                        continue
-                    return str(value).strip()
-            return default
-        
-        required_alias_groups = [
-            ('corredora',),
-            ('instrumento', 'instrumento_codigo'),
-            ('fuente', 'fuente_codigo'),
-            ('moneda', 'moneda_codigo'),
-            ('ejercicio',),
-            ('fecha_pago', 'fecha'),
-            ('secuencia_evento', 'secuencia')
+        hash_archivo = sha256_archivo(file)
+        cargas = []
+        # Las cargas de un zip se crean todas o ninguna
+        with transaction.atomic() if len(miembros) > 1 else nullcontext():
+            for miembro in miembros:
+                cargas.append(Carga.objects.create(
+                    id_corredora_id=1,  # TODO: obtener de request
+                    creado_por=usuario,
+                    id_fuente_id=1,  # TODO: obtener de request
+                    tipo='masiva',
+                    nombre_archivo=f'{file.name}/{miembro}' if miembro else file.name,
+                    # Las cargas de un mismo zip comparten el archivo guardado por la primera
+                    archivo=cargas[0].archivo.name if cargas else file,
+                    hash_archivo=hash_archivo,
+                    miembro_zip=miembro,
+                    formato=formato,
+                    omitir_duplicadas=omitir_duplicadas,
+                    validacion_sql=validacion_sql,
+                    snapshot_completo=snapshot_completo,
+                    perfil_origen=perfil_origen,
+                    perfil_certificado=perfil_certificado,
+                    preparar=preparar,
+                    filas_total=0,
+                    estado='validando'
+                ))
+        
+        respuesta = {
+            'carga_id': cargas[0].id_carga,
+            'estado': cargas[0].estado,
+            'mensaje': (
+                'Carga recibida. La vista previa se preparará en segundo plano.' if preparar
+                else 'Carga recibida. Se procesará en segundo plano.'
+            )
+        }
+        if es_zip(file.name):
+            respuesta['cargas'] = [
+                {'carga_id': carga.id_carga, 'archivo': carga.miembro_zip} for carga in cargas
+            ]
+        return Response(respuesta, status=status.HTTP_202_ACCEPTED)
+    
+    def _validar_extension(self, file):
+        """Response de error si el archivo no es CSV, Excel, Parquet o CSV comprimido (None si es válido)"""
+        if not (es_csv(file.name) or es_excel(file.name) or es_parquet(file.name) or es_comprimido(file.name)):
+            return Response(
+                {'error': 'El archivo debe ser CSV, Excel (.xlsx, .xls), Parquet o CSV comprimido (.csv.gz, .zip)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if es_excel(file.name) and not OPENPYXL_AVAILABLE:
+            return Response(
+                {'error': 'openpyxl no está instalado. Ejecuta: pip install openpyxl'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        if es_parquet(file.name) and not PYARROW_AVAILABLE:
+            # Se rechaza al subir: sin pyarrow el worker no podría leer el archivo
+            return Response(
+                {'error': 'Este servidor no acepta archivos Parquet (pyarrow no está instalado: pip install pyarrow)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
+    
+    @action(detail=True, methods=['get'])
+    def resultado(self, request, pk=None):
+        """
+        Estado y resultado de una carga masiva (para consultar mientras el worker la procesa).
+        Mismo formato que entregaba la carga síncrona, más estado y mensaje_error.
+        """
+        carga = self.get_object()
+        errores = [
+            {'linea': linea, 'error': mensaje}
+            for linea, mensaje in CargaDetalle.objects.filter(id_carga=carga, estado_linea='rechazo')
+            .order_by('linea').values_list('linea', 'mensaje_error')[:10]
         ]
-        
-        missing_headers = []
-        for group in required_alias_groups:
-            if not any(normalize_header(alias) in header_map for alias in group):
-                missing_headers.append(group[0])
-        if missing_headers:
-            return Response({'error': f'Encabezados faltantes: {", ".join(missing_headers)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Obtener códigos de factores F08-F37
-        # Nota: F19 se llama 'F19A' en la base de datos según create_data_initial.py
-        factor_codigos = [f'F{i:02d}' if i != 19 else 'F19A' for i in range(8, 38)]
-        # También incluimos 'F19' para compatibilidad con archivos CSV/Excel que lo usen
-        factor_codigos_search = factor_codigos + ['F19'] if 'F19A' in factor_codigos else factor_codigos
-        
-        # Mapear todos los factores disponibles desde la BD
-        factor_map = {}
-        for factor in FactorDef.objects.filter(codigo_factor__in=factor_codigos_search):
-            factor_map[factor.codigo_factor] = factor
-            # Si es F19A, también mapearlo como F19 para compatibilidad
-            if factor.codigo_factor == 'F19A':
-                factor_map['F19'] = factor
-        
-        # Procesar filas
-        insertados = 0
-        rechazados = 0
-        errores = []
-        
-        with transaction.atomic():
-            # Crear registro de Carga
-            carga = Carga.objects.create(
-                id_corredora_id=1,  # TODO: obtener de request
-                creado_por=usuario,
-                id_fuente_id=1,  # TODO: obtener de request
-                tipo='masiva',
-                nombre_archivo=file.name,
-                filas_total=0,
-                estado='importando'
+        return Response({
+            'carga_id': carga.id_carga,
+            'estado': carga.estado,
+            'mensaje_error': carga.mensaje_error,
+            'filas_total': carga.filas_total,
+            'insertados': carga.insertados,
+            'actualizados': carga.actualizados,
+            'rechazados': carga.rechazados,
+            'omitidos': carga.omitidos,
+            'errores': errores,  # Limitar a 10 errores para no saturar respuesta
+            'reconciliacion': carga.reconciliacion,
+            'tiempos': carga.tiempos
+        })
+    
+    @action(detail=True, methods=['get'])
+    def progreso(self, request, pk=None):
+        """
+        Avance en vivo de una carga: etapa (estado), líneas procesadas, insertadas,
+        actualizadas, rechazadas, omitidas y líneas por segundo.
+        Mientras el worker procesa la carga se lee del caché (sin consultar la BD).
+        """
+        carga = self.get_object()
+        return Response(leer_progreso(carga))
+    
+    @action(detail=True, methods=['get'], url_path='progreso/stream',
+            renderer_classes=[JSONRenderer, EventStreamRenderer])
+    def progreso_stream(self, request, pk=None):
+        """
+        Variante server-sent events de progreso (para EventSource): envía un evento
+        'progreso' cada ?cada=N líneas (por defecto CARGA_PROGRESO_CADA) o al cambiar
+        de etapa, y cierra la conexión cuando la carga termina.
+        """
+        carga = self.get_object()
+        try:
+            cada = int(request.query_params.get('cada') or 0) or None
+        except ValueError:
+            return Response({'error': 'cada debe ser un número entero'}, status=status.HTTP_400_BAD_REQUEST)
+        if cada is not None and cada < 1:
+            return Response({'error': 'cada debe ser mayor que 0'}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(eventos_progreso(carga, cada=cada), content_type='text/event-stream; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        # Evita que nginx acumule los eventos antes de enviarlos
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def errores(self, request, pk=None):
+        """
+        Reporte completo de las líneas rechazadas de una carga, enviado en streaming
+        desde carga_detalle (no se arma en memoria).
+        ?formato=csv (por defecto) o ndjson
+        ?tipo=duplicada|catalogo|obligatorio|suma|formato|otro para filtrar por tipo de error
+        """
+        carga = self.get_object()
+        formato = (request.query_params.get('formato') or 'csv').strip().lower()
+        if formato not in ('csv', 'ndjson'):
+            return Response({'error': 'formato debe ser "csv" o "ndjson"'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        detalles = CargaDetalle.objects.filter(id_carga=carga, estado_linea='rechazo')
+        tipo = (request.query_params.get('tipo') or '').strip().lower()
+        if tipo:
+            filtro = self._filtro_tipo_error(tipo)
+            if filtro is None:
+                tipos = ', '.join([t for t, _ in TIPOS_ERROR] + [TIPO_ERROR_OTRO])
+                return Response({'error': f'tipo debe ser uno de: {tipos}'}, status=status.HTTP_400_BAD_REQUEST)
+            detalles = detalles.filter(filtro)
+        
+        # Lectura por bloques desde la BD
+        filas = (
+            (linea, tipo_error(mensaje), mensaje)
+            for linea, mensaje in detalles.order_by('linea').values_list('linea', 'mensaje_error').iterator(chunk_size=2000)
+        )
+        if formato == 'ndjson':
+            contenido = (
+                json.dumps({'linea': linea, 'tipo': tipo_linea, 'error': mensaje}, ensure_ascii=False) + '\n'
+                for linea, tipo_linea, mensaje in filas
+            )
+            response = StreamingHttpResponse(contenido, content_type='application/x-ndjson; charset=utf-8')
+        else:
+            # Mismo formato que las plantillas de carga: BOM UTF-8, "sep=;" y ';' como separador (Excel)
+            escritor = csv.writer(_LineaCSV(), delimiter=';')
+            contenido = chain(
+                ['\ufeffsep=;\r\n', escritor.writerow(['Linea', 'Tipo', 'Error'])],
+                (escritor.writerow(fila) for fila in filas)
+            )
+            response = StreamingHttpResponse(contenido, content_type='text/csv; charset=utf-8')
+        extension = 'ndjson' if formato == 'ndjson' else 'csv'
+        response['Content-Disposition'] = f'attachment; filename="carga_{carga.id_carga}_errores.{extension}"'
+        return response
+    
+    def _filtro_tipo_error(self, tipo):
+        """
+        Q equivalente a cargas.validacion.tipo_error() para filtrar en la BD: el mensaje
+        contiene un fragmento del tipo y ninguno de los tipos anteriores (o de todos, para 'otro').
+        Retorna None si el tipo no existe.
+        """
+        anteriores = Q()
+        for nombre, fragmentos in TIPOS_ERROR:
+            coincide = Q()
+            for fragmento in fragmentos:
+                coincide |= Q(mensaje_error__contains=fragmento)
+            if nombre == tipo:
+                return coincide & ~anteriores if anteriores else coincide
+            anteriores |= coincide
+        if tipo == TIPO_ERROR_OTRO:
+            return Q(mensaje_error__isnull=True) | ~anteriores
+        return None
+    
+    @action(detail=True, methods=['post'])
+    def reanudar(self, request, pk=None):
+        """
+        Reanudar una carga fallida o pausada desde su último punto confirmado (ultima_linea_confirmada).
+        El worker vuelve a tomarla y salta las líneas que ya tienen CargaDetalle.
+        """
+        carga = self.get_object()
+        if carga.estado not in ('failed', 'pausada'):
+            return Response(
+                {'error': f'Solo se pueden reanudar cargas fallidas o pausadas (estado actual: {carga.estado})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not carga.archivo:
+            return Response(
+                {'error': 'La carga no tiene archivo asociado para reanudar'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            for linea, row in enumerate(reader, start=2):  # linea 1 = encabezados
-                try:
-                    linea_referencia = get_cell(row, 'linea', 'fila', default=str(linea))
 
-                    # Resolver corredora
-                    corredora = None
-                    corredor_raw_id = get_cell(row, 'id_corredora')
-                    if corredor_raw_id:
-                        try:
-                            corredora = Corredora.objects.get(id_corredora=int(corredor_raw_id))
-                        except (ValueError, Corredora.DoesNotExist):
-                            raise ValueError(f'Corredora con ID {corredor_raw_id} no existe (línea {linea_referencia})')
-                    if not corredora:
-                        corredora_nombre = get_cell(row, 'corredora')
-                        if not corredora_nombre:
-                            raise ValueError(f'Corredora es obligatoria (línea {linea_referencia})')
-                        try:
-                            corredora = Corredora.objects.get(nombre__iexact=corredora_nombre.strip())
-                        except Corredora.DoesNotExist:
-                            raise ValueError(f'Corredora "{corredora_nombre}" no existe (línea {linea_referencia})')
-                        except Corredora.MultipleObjectsReturned:
-                            raise ValueError(f'Corredora "{corredora_nombre}" no es única (línea {linea_referencia})')
-
-                    # Resolver instrumento
-                    instrumento = None
-                    instrumento_id_raw = get_cell(row, 'id_instrumento')
-                    if instrumento_id_raw:
-                        try:
-                            instrumento = Instrumento.objects.get(id_instrumento=int(instrumento_id_raw))
-                        except (ValueError, Instrumento.DoesNotExist):
-                            raise ValueError(f'Instrumento con ID {instrumento_id_raw} no existe (línea {linea_referencia})')
-                    if not instrumento:
-                        instrumento_codigo = get_cell(row, 'instrumento_codigo')
-                        if instrumento_codigo:
-                            instrumento = Instrumento.objects.filter(codigo__iexact=instrumento_codigo).first()
-                            if not instrumento:
-                                raise ValueError(f'Instrumento con código "{instrumento_codigo}" no existe (línea {linea_referencia})')
-                        else:
-                            instrumento_nombre = get_cell(row, 'instrumento')
-                            if not instrumento_nombre:
-                                raise ValueError(f'Instrumento es obligatorio (línea {linea_referencia})')
-                            instrumentos_qs = Instrumento.objects.filter(nombre__iexact=instrumento_nombre.strip())
-                            if not instrumentos_qs.exists():
-                                raise ValueError(f'Instrumento "{instrumento_nombre}" no existe (línea {linea_referencia})')
-                            if instrumentos_qs.count() > 1:
-                                raise ValueError(f'Instrumento "{instrumento_nombre}" no es único, especifique el código (línea {linea_referencia})')
-                            instrumento = instrumentos_qs.first()
-
-                    # Resolver fuente
-                    fuente = None
-                    fuente_id_raw = get_cell(row, 'id_fuente')
-                    if fuente_id_raw:
-                        try:
-                            fuente = Fuente.objects.get(id_fuente=int(fuente_id_raw))
-                        except (ValueError, Fuente.DoesNotExist):
-                            raise ValueError(f'Fuente con ID {fuente_id_raw} no existe (línea {linea_referencia})')
-                    if not fuente:
-                        fuente_codigo = get_cell(row, 'fuente_codigo')
-                        if fuente_codigo:
-                            fuente = Fuente.objects.filter(codigo__iexact=fuente_codigo).first()
-                            if not fuente:
-                                raise ValueError(f'Fuente con código "{fuente_codigo}" no existe (línea {linea_referencia})')
-                        else:
-                            fuente_nombre = get_cell(row, 'fuente')
-                            if not fuente_nombre:
-                                raise ValueError(f'Fuente es obligatoria (línea {linea_referencia})')
-                            fuente = Fuente.objects.filter(nombre__iexact=fuente_nombre.strip()).first()
-                            if not fuente:
-                                raise ValueError(f'Fuente "{fuente_nombre}" no existe (línea {linea_referencia})')
-
-                    # Resolver moneda
-                    moneda = None
-                    moneda_id_raw = get_cell(row, 'id_moneda')
-                    if moneda_id_raw:
-                        try:
-                            moneda = Moneda.objects.get(id_moneda=int(moneda_id_raw))
-                        except (ValueError, Moneda.DoesNotExist):
-                            raise ValueError(f'Moneda con ID {moneda_id_raw} no existe (línea {linea_referencia})')
-                    if not moneda:
-                        moneda_codigo = get_cell(row, 'moneda_codigo', 'moneda')
-                        if not moneda_codigo:
-                            raise ValueError(f'Moneda es obligatoria (línea {linea_referencia})')
-                        moneda = Moneda.objects.filter(codigo__iexact=moneda_codigo.strip()).first()
-                        if not moneda:
-                            raise ValueError(f'Moneda "{moneda_codigo}" no existe (línea {linea_referencia})')
-
-                    # Validar ejercicio y fecha
-                    ejercicio_raw = get_cell(row, 'ejercicio')
-                    try:
-                        ejercicio = int(ejercicio_raw)
-                    except (TypeError, ValueError):
-                        raise ValueError(f'Ejercicio inválido "{ejercicio_raw}" (línea {linea_referencia})')
-
-                    fecha_pago_raw = get_cell(row, 'fecha_pago', 'fecha')
-                    fecha_pago = None
-                    parsed = False
-                    for fmt in ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y'):
-                        try:
-                            fecha_pago = datetime.strptime(fecha_pago_raw, fmt).date()
-                            parsed = True
-                            break
-                        except ValueError:
-                            continue
-                    if not parsed:
-                        raise ValueError(f'Fecha de pago inválida "{fecha_pago_raw}" (línea {linea_referencia})')
-
-                    def parse_bool(value, default=False):
-                        if value is None or value == '':
-                            return default
-                        value = str(value).strip().lower()
-                        if value in ['true', '1', 'si', 'sí', 'yes', 'y']:
-                            return True
-                        if value in ['false', '0', 'no', 'n']:
-                            return False
-                        return default
-
-                    ingreso_por_montos = parse_bool(get_cell(row, 'ingreso_por_montos', 'ingreso'), default=False)
-                    if ingreso_por_montos:
-                        raise ValueError(f'Ingreso por montos debe ser "No" para cargas por factor (línea {linea_referencia})')
-
-                    acogido_sfut = parse_bool(get_cell(row, 'acogido_sfut', 'sfut'))
-
-                    descripcion_val = get_cell(row, 'descripcion')
-                    estado_val = get_cell(row, 'estado').lower() or 'borrador'
-                    if estado_val not in ['borrador', 'validada', 'publicada', 'pendiente']:
-                        raise ValueError(f'Estado "{estado_val}" inválido (línea {linea_referencia})')
-
-                    valor_historico_val = get_cell(row, 'valor_historico')
-                    valor_historico = None
-                    if valor_historico_val:
-                        try:
-                            valor_historico = Decimal(valor_historico_val)
-                        except InvalidOperation:
-                            raise ValueError(f'Valor histórico inválido "{valor_historico_val}" (línea {linea_referencia})')
-
-                    # Calcular suma de factores que aplican en suma
-                    suma_factores = Decimal('0')
-                    factores_detalle = {}
-                    for codigo in factor_codigos:
-                        # Buscar el valor: primero con el código exacto, luego 'F19' si estamos en F19A
-                        valor_str = get_cell(row, codigo)
-                        if not valor_str and codigo == 'F19A':
-                            # Si no encontramos con F19A, intentar con F19
-                            valor_str = get_cell(row, 'F19')
-                        
-                        if valor_str:
-                            try:
-                                valor = Decimal(valor_str)
-                                if valor > 0:
-                                    # Usar el código del factor_map (puede ser F19A o F19)
-                                    factor_key = codigo
-                                    if codigo == 'F19A' and 'F19' in factor_map:
-                                        factor_key = 'F19'  # Usar F19 para el mapeo interno
-                                    factores_detalle[factor_key] = valor
-                                    if factor_key in factor_map and factor_map[factor_key].aplica_en_suma:
-                                        suma_factores += valor
-                            except InvalidOperation:
-                                raise ValueError(f'Factor {codigo} no es un número válido (línea {linea_referencia})')
-
-                    if suma_factores > Decimal('1'):
-                        raise ValueError(f'Suma de factores excede 1: {suma_factores} (línea {linea_referencia})')
-
-                    calificacion, created = Calificacion.objects.get_or_create(
-                        id_corredora=corredora,
-                        id_instrumento=instrumento,
-                        ejercicio=ejercicio,
-                        secuencia_evento=get_cell(row, 'secuencia_evento', 'secuencia'),
-                        defaults={
-                            'id_fuente': fuente,
-                            'id_moneda': moneda,
-                            'fecha_pago': fecha_pago,
-                            'descripcion': descripcion_val,
-                            'ingreso_por_montos': False,
-                            'acogido_sfut': acogido_sfut,
-                            'factor_actualizacion': suma_factores,
-                            'valor_historico': valor_historico,
-                            'estado': estado_val,
-                            'observaciones': 'Carga masiva',
-                            'creado_por': usuario,
-                            'actualizado_por': usuario
-                        }
-                    )
+        limpiar_solicitud(carga.pk)
+        Carga.objects.filter(pk=carga.pk, estado__in=('failed', 'pausada')).update(
+            estado='validando',
+            iniciado_en=None,
+            finalizado_en=None,
+            mensaje_error=None,
+            actualizado_en=timezone.now()
+        )
+        return Response({
+            'carga_id': carga.id_carga,
+            'estado': 'validando',
+            'ultima_linea_confirmada': carga.ultima_linea_confirmada,
+            'mensaje': 'Carga reanudada. Se procesará en segundo plano.'
+        }, status=status.HTTP_202_ACCEPTED)
 
-                    if not created:
-                        calificacion.id_fuente = fuente
-                        calificacion.id_moneda = moneda
-                        calificacion.fecha_pago = fecha_pago
-                        calificacion.descripcion = descripcion_val
-                        calificacion.acogido_sfut = acogido_sfut
-                        calificacion.factor_actualizacion = suma_factores
-                        calificacion.valor_historico = valor_historico
-                        calificacion.actualizado_por = usuario
-                        calificacion.estado = estado_val
-                        calificacion.ingreso_por_montos = False  # IMPORTANTE: Marcar que viene de factores
-                        calificacion.observaciones = 'Carga masiva por factores'
-                        calificacion.save()
-
-                    # IMPORTANTE: Al cargar factores, eliminamos montos si existían
-                    # porque ahora la calificación se alimenta solo de factores
-                    CalificacionMontoDetalle.objects.filter(id_calificacion=calificacion).delete()
-                    CalificacionFactorDetalle.objects.filter(id_calificacion=calificacion).delete()
-                    for codigo, valor in factores_detalle.items():
-                        # Buscar el factor en el mapa (puede ser F19 o F19A)
-                        factor_obj = factor_map.get(codigo)
-                        if not factor_obj and codigo == 'F19':
-                            # Si no encontramos F19, buscar F19A
-                            factor_obj = factor_map.get('F19A')
-                        if not factor_obj:
-                            raise ValueError(f'Factor {codigo} no encontrado en la base de datos (línea {linea_referencia})')
-                        CalificacionFactorDetalle.objects.create(
-                            id_calificacion=calificacion,
-                            id_factor=factor_obj,
-                            valor_factor=valor
-                        )
-
-                    hash_value = hashlib.md5(str(row).encode('utf-8')).hexdigest()
-                    CargaDetalle.objects.create(
-                        id_carga=carga,
-                        linea=linea,
-                        estado_linea='ok',
-                        id_calificacion=calificacion,
-                        hash_linea=hash_value
-                    )
+    @action(detail=True, methods=['post'])
+    def pausar(self, request, pk=None):
+        """
+        Pausar una carga en cola o en proceso. El worker se detiene al terminar el
+        bloque en curso y la deja en 'pausada'; se retoma con /reanudar/.
+        """
+        return self._interrumpir(self.get_object(), 'pausar', 'pausada')
 
-                    insertados += 1
+    @action(detail=True, methods=['post'])
+    def cancelar(self, request, pk=None):
+        """
+        Cancelar una carga en cola, en proceso, pausada, preparada o fallida. En
+        proceso, el worker se detiene al terminar el bloque en curso: con
+        CARGA_COMMIT_CADA = 0 se revierte toda la carga; con bloques, los ya
+        confirmados se conservan. La carga queda en 'cancelada'.
+        """
+        return self._interrumpir(self.get_object(), 'cancelar', 'cancelada')
 
-                except Exception as e:
-                    rechazados += 1
-                    errores.append({
-                        'linea': linea,
-                        'error': str(e)
-                    })
-                    
-                    # Calcular hash único de la línea para errores también
-                    hash_value = hashlib.md5(str(row).encode('utf-8')).hexdigest()
-                    
-                    CargaDetalle.objects.create(
-                        id_carga=carga,
-                        linea=linea,
-                        estado_linea='rechazo',
-                        mensaje_error=str(e),
-                        hash_linea=hash_value
-                    )
-            
-            # Actualizar resumen de Carga
-            carga.filas_total = insertados + rechazados
-            carga.insertados = insertados
-            carga.rechazados = rechazados
-            carga.estado = 'done' if rechazados == 0 else 'done'
-            carga.save()
-        
+    def _interrumpir(self, carga, solicitud, estado_final):
+        estado = interrumpir_carga(carga, solicitud)
+        if estado is None:
+            return Response(
+                {'error': f'No se puede {solicitud} la carga (estado actual: {carga.estado})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if estado == estado_final:
+            return Response({
+                'carga_id': carga.id_carga,
+                'estado': estado,
+                'ultima_linea_confirmada': carga.ultima_linea_confirmada,
+                'mensaje': f'Carga {estado}.'
+            })
         return Response({
             'carga_id': carga.id_carga,
-            'filas_total': carga.filas_total,
-            'insertados': insertados,
-            'rechazados': rechazados,
-            'errores': errores[:10]  # Limitar a 10 errores para no saturar respuesta
-        }, status=status.HTTP_201_CREATED)
+            'estado': estado,
+            'solicitud': solicitud,
+            'mensaje': 'Solicitud registrada. El worker la atenderá al terminar el bloque en curso.'
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'])
+    def preparar(self, request):
+        """
+        Primera fase de la carga en dos pasos: el worker lee y valida el archivo una
+        sola vez y deja la carga en 'preparada'. Las páginas de la vista previa se
+        consultan en /vista_previa/ y la carga se graba con /confirmar/.
+        """
+        formato = (request.data.get('formato') or 'montos').strip().lower()
+        if formato not in ('factores', 'montos'):
+            return Response({'error': 'formato debe ser "factores" o "montos"'}, status=status.HTTP_400_BAD_REQUEST)
+        return self._encolar_carga(request, formato, preparar=True)
     
-    def calcular_factores_desde_montos(self, montos_dict, factor_map):
+    @action(detail=True, methods=['get'])
+    def vista_previa(self, request, pk=None):
         """
-        Calcular factores (F08-F37) desde montos (M08-M37)
-        Fórmula: Factor = Monto / Suma Total de Montos (proporcional)
-        Solo considera factores que tienen aplica_en_suma = True para validar suma <= 1
+        Vista previa paginada de una carga preparada.
+        ?validas=true solo líneas válidas (montos, factores y sumas); ?validas=false solo errores.
         """
-        factores_calculados = {}
-        suma_montos = Decimal('0')
-        
-        # Obtener códigos de factores F08-F37
-        factor_codigos = [f'F{i:02d}' for i in range(8, 38)]
+        carga = self.get_object()
+        if carga.estado != 'preparada':
+            return Response(
+                {'error': f'La carga no está preparada (estado actual: {carga.estado})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Calcular suma total de montos
-        for codigo in factor_codigos:
-            monto_key = codigo.replace('F', 'M')  # M08-M37 para montos
-            if monto_key in montos_dict:
-                monto = montos_dict[monto_key]
-                if monto and monto > 0:
-                    suma_montos += monto
-        
-        # Si no hay montos, retornar factores vacíos
-        if suma_montos == 0:
-            return factores_calculados, Decimal('0')
-        
-        # Calcular factores proporcionales
-        suma_factores_aplicados = Decimal('0')
-        for codigo in factor_codigos:
-            monto_key = codigo.replace('F', 'M')  # M08-M37 para montos
-            if monto_key in montos_dict and codigo in factor_map:
-                monto = montos_dict[monto_key]
-                if monto and monto > 0:
-                    # Calcular factor proporcional
-                    factor = monto / suma_montos
-                    factores_calculados[codigo] = factor
-                    
-                    # Si el factor aplica en suma, agregarlo a la suma
-                    if factor_map[codigo].aplica_en_suma:
-                        suma_factores_aplicados += factor
+        lineas = CargaLineaPreparada.objects.filter(id_carga=carga).order_by('linea')
+        validas = request.query_params.get('validas')
+        if validas:
+            lineas = lineas.filter(valida=parse_bool(validas))
         
-        return factores_calculados, suma_factores_aplicados
+        pagina = self.paginate_queryset(lineas)
+        filas = [self._fila_vista_previa(linea) for linea in (pagina if pagina is not None else lineas)]
+        if pagina is not None:
+            return self.get_paginated_response(filas)
+        return Response(filas)
+    
+    def _fila_vista_previa(self, linea):
+        """Mismo formato de fila que entrega calculate_factores"""
+        if not linea.valida:
+            return {'linea': linea.linea, 'error': linea.mensaje_error}
+        registro = registro_desde_json(linea.registro, linea.linea, linea.linea_referencia, linea.hash_linea)
+        montos = {codigo.replace('F', 'M'): monto for codigo, monto in registro['montos']}
+        return {
+            'linea': linea.linea_referencia,
+            'montos': {k: str(v) for k, v in montos.items()},
+            'factores': {k: str(v) for k, v in registro['factores']},
+            'suma_montos': str(sum(montos.values())),
+            'suma_factores': str(registro['suma_factores'])
+        }
+    
+    @action(detail=True, methods=['post'])
+    def confirmar(self, request, pk=None):
+        """
+        Segunda fase de la carga en dos pasos: graba una carga preparada. El worker
+        importa desde las líneas ya validadas, sin volver a leer el archivo.
+        """
+        carga = self.get_object()
+        confirmada = Carga.objects.filter(pk=carga.pk, estado='preparada').update(
+            estado='validando',
+            preparar=False,
+            iniciado_en=None,
+            finalizado_en=None,
+            actualizado_en=timezone.now()
+        )
+        if not confirmada:
+            return Response(
+                {'error': f'Solo se pueden confirmar cargas preparadas (estado actual: {carga.estado})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'carga_id': carga.id_carga,
+            'estado': 'validando',
+            'mensaje': 'Carga confirmada. Se grabará en segundo plano.'
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['post'])
+    def upload_factores(self, request):
+        """Carga masiva de calificaciones con factores ya calculados (procesamiento asíncrono)"""
+        return self._encolar_carga(request, 'factores')
     
     @action(detail=False, methods=['post'])
     def calculate_factores(self, request):
         """
         Calcular factores desde montos y devolver preview (sin grabar)
+        Con un .zip se calculan todos sus CSV; cada fila y error indica su 'archivo'.
+        Se devuelven las primeras CARGA_PREVIEW_MAX_FILAS filas válidas y los primeros
+        10 errores; total_filas/validas/rechazadas cuentan el archivo completo.
+        Para revisar todas las filas está /preparar/ + /vista_previa/ (paginada).
         """
-        # Obtener archivo CSV o Excel
+        # Obtener archivo CSV, Excel o CSV comprimido
         if 'file' not in request.FILES:
             return Response({'error': 'No se proporcionó archivo'}, status=status.HTTP_400_BAD_REQUEST)
         
         file = request.FILES['file']
-        is_excel = file.name.endswith('.xlsx') or file.name.endswith('.xls')
-        is_csv = file.name.endswith('.csv')
-        
-        if not (is_csv or is_excel):
-            return Response({'error': 'El archivo debe ser CSV o Excel (.xlsx, .xls)'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Leer archivo (CSV o Excel) - reutilizar lógica de upload_factores
-        raw_headers = []
-        rows_data = []
+        error_response = self._validar_extension(file)
+        if error_response:
+            return error_response
+        miembros = [None]
+        if es_zip(file.name):
+            try:
+                miembros = miembros_zip(file)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if not miembros:
+                return Response({'error': 'El archivo zip no contiene archivos CSV'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Perfil de homologación opcional: traduce los encabezados del corredor al formato NUAM
+        perfil = None
+        perfil_origen = (request.data.get('perfil_origen') or '').strip()
+        if perfil_origen:
+            try:
+                perfil = obtener_perfil(perfil_origen, (request.data.get('perfil_certificado') or '').strip() or None)
+            except CargaError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Obtener factores F08-F37 (el motor calcula todas las filas de un bloque en una pasada)
+        factor_map = {
+            factor.codigo_factor: factor
+            for factor in FactorDef.objects.filter(codigo_factor__in=CODIGOS_FACTOR)
+        }
+        motor = MotorFactores(factor_map)
+        max_filas = getattr(settings, 'CARGA_PREVIEW_MAX_FILAS', 100)
         
-        try:
-            if is_excel:
-                if not OPENPYXL_AVAILABLE:
-                    return Response(
-                        {'error': 'openpyxl no está instalado. Ejecuta: pip install openpyxl'},
-                        status=status.HTTP_503_SERVICE_UNAVAILABLE
-                    )
-                file.seek(0)
-                wb = load_workbook(file, data_only=True)
-                ws = wb.active
-                raw_headers = [str(cell.value) if cell.value else '' for cell in ws[1]]
-                for row in ws.iter_rows(min_row=2, values_only=False):
-                    row_dict = {}
-                    for idx, cell in enumerate(row):
-                        if idx < len(raw_headers):
-                            header = raw_headers[idx]
-                            value = cell.value
-                            if value is None:
-                                row_dict[header] = ''
-                            elif isinstance(value, datetime):
-                                row_dict[header] = value.strftime('%Y-%m-%d')
-                            elif hasattr(value, 'date') and hasattr(value.date(), 'strftime'):
-                                row_dict[header] = value.date().strftime('%Y-%m-%d')
-                            elif isinstance(value, (int, float)) and header.lower() in ['ejercicio', 'linea']:
-                                row_dict[header] = str(int(value))
-                            else:
-                                row_dict[header] = str(value).strip() if value else ''
-                    if any(row_dict.values()):
-                        rows_data.append(row_dict)
-                
-                class ExcelDictReader:
-                    def __init__(self, headers, rows):
-                        self.fieldnames = headers
-                        self.rows = rows
-                        self.index = 0
-                    def __iter__(self):
-                        return self
-                    def __next__(self):
-                        if self.index >= len(self.rows):
-                            raise StopIteration
-                        row = self.rows[self.index]
-                        self.index += 1
-                        return row
-                reader = ExcelDictReader(raw_headers, rows_data)
-            else:
-                file_content = file.read().decode('utf-8-sig')
-                if file_content.lower().startswith('sep='):
-                    file_lines = file_content.splitlines()
-                    file_content = '\n'.join(file_lines[1:]) if len(file_lines) > 1 else ''
-                sample = file_content.splitlines()[0] if file_content else ''
-                delimiter = ';' if sample.count(';') >= sample.count(',') else ','
-                try:
-                    dialect = csv.Sniffer().sniff(sample, delimiters=',;')
-                    delimiter = dialect.delimiter
-                except Exception:
-                    pass
-                reader = csv.DictReader(io.StringIO(file_content), delimiter=delimiter)
+        preview_data = []
+        errores = []
+        validas = rechazadas = 0
+        for miembro in miembros:
+            # Leer archivo (CSV o Excel, descomprimido mientras se lee) - mismo lector que usa el worker de cargas
+            try:
+                reader = abrir_lector(file, file.name, miembro=miembro)
                 raw_headers = reader.fieldnames or []
-        except Exception as e:
-            return Response({'error': f'Error al leer archivo: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        def normalize_header(header):
-            header = unicodedata.normalize('NFKD', header or '')
-            header = ''.join(ch for ch in header if not unicodedata.combining(ch))
-            return ''.join(ch for ch in header.lower() if ch.isalnum())
-        
-        header_map = {normalize_header(h): h for h in raw_headers}
-        
-        def get_cell(row, *aliases, default=''):
-            for alias in aliases:
-                normalized = normalize_header(alias)
-                original = header_map.get(normalized)
-                if original and original in row:
-                    value = row[original]
-                    if value is None:
-                        continue
-                    return str(value).strip()
-            return default
+            except Exception as e:
+                return Response({'error': f'Error al leer archivo: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                columnas_perfil = []
+                if perfil is not None:
+                    try:
+                        raw_headers, columnas_perfil = perfil.resolver(raw_headers)
+                    except CargaError as e:
+                        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                try:
+                    preview_archivo, errores_archivo, validas_archivo, rechazadas_archivo = self._calcular_preview(
+                        reader, raw_headers, columnas_perfil, motor,
+                        max_filas - len(preview_data), MAX_ERRORES_PREVIEW - len(errores)
+                    )
+                except ERRORES_LECTURA as e:
+                    return Response({'error': f'Error al leer archivo: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+            finally:
+                # Libera el mmap del CSV antes de que Django borre el archivo temporal del upload
+                cerrar_lector(reader)
+            if miembro is not None:
+                for fila in chain(preview_archivo, errores_archivo):
+                    fila['archivo'] = miembro
+            preview_data.extend(preview_archivo)
+            errores.extend(errores_archivo)
+            validas += validas_archivo
+            rechazadas += rechazadas_archivo
         
-        # Obtener códigos de factores F08-F37
-        factor_codigos = [f'F{i:02d}' for i in range(8, 38)]
-        factor_map = {}
-        for factor in FactorDef.objects.filter(codigo_factor__in=factor_codigos):
-            factor_map[factor.codigo_factor] = factor
+        return Response({
+            'preview': preview_data,
+            'errores': errores,
+            'total_filas': validas + rechazadas,
+            'validas': validas,
+            'rechazadas': rechazadas,
+            'preview_truncado': validas > len(preview_data)
+        }, status=status.HTTP_200_OK)
+    
+    def _calcular_preview(self, reader, raw_headers, columnas_perfil, motor, max_filas, max_errores):
+        """
+        Factores calculados de las filas de un archivo: retorna (preview, errores, validas, rechazadas).
+        Solo se guardan las primeras max_filas filas válidas y los primeros max_errores
+        errores (por línea); del resto solo se cuentan validas y rechazadas.
+        El archivo se lee a medida que se recorre: los errores de lectura se propagan.
+        """
+        # Columnas resueltas una vez por archivo (mismo mapeo que usa el worker de cargas)
+        mapeo = MapeoColumnas(raw_headers)
+        columnas_linea = mapeo.columnas('linea', 'fila')
+        # Columnas de montos presentes en el archivo (M08-M37, se permite también el nombre del factor)
+        columnas_montos = [
+            mapeo.columnas(monto_key, codigo) for codigo, monto_key in zip(CODIGOS_FACTOR, CODIGOS_MONTO)
+        ]
+        tamano_bloque = getattr(settings, 'CARGA_BATCH_SIZE', 500)
         
         # Procesar filas y calcular factores
         preview_data = []
         errores = []
+        totales = {'validas': 0, 'rechazadas': 0}
+        bloque = []  # (linea, linea_referencia, vector de montos)
+        
+        def calcular_bloque():
+            for (linea, linea_referencia, vector), calculo in zip(bloque, motor.calcular([fila[2] for fila in bloque])):
+                factores, suma_montos, suma_factores = calculo
+                # Validar suma de factores
+                if suma_factores > Decimal('1'):
+                    totales['rechazadas'] += 1
+                    errores.append({
+                        'linea': linea,
+                        'error': f'Suma de factores calculados excede 1: {suma_factores} (línea {linea_referencia})'
+                    })
+                    continue
+                totales['validas'] += 1
+                if len(preview_data) >= max_filas:
+                    continue
+                preview_data.append({
+                    'linea': linea_referencia,
+                    'montos': {k: str(v) for k, v in zip(CODIGOS_MONTO, vector) if v is not None},
+                    'factores': {k: str(v) for k, v in zip(CODIGOS_FACTOR, factores) if v is not None},
+                    'suma_montos': str(suma_montos),
+                    'suma_factores': str(suma_factores)
+                })
+            bloque.clear()
+            # Los errores de suma se agregan al calcular el bloque: se ordenan por línea y se
+            # conservan los primeros (las líneas de los bloques siguientes son todas posteriores)
+            errores.sort(key=lambda error: error['linea'])
+            del errores[max_errores:]
         
         for linea, row in enumerate(reader, start=2):
             try:
-                linea_referencia = get_cell(row, 'linea', 'fila', default=str(linea))
-                
+                if columnas_perfil:
+                    row = aplicar_perfil(columnas_perfil, row, linea)
+                linea_referencia = mapeo.valor(row, columnas_linea, default=str(linea))
+            
                 # Leer montos M08-M37
-                montos_dict = {}
-                for codigo in factor_codigos:
-                    monto_key = codigo.replace('F', 'M')  # M08-M37
-                    valor_str = get_cell(row, monto_key, codigo)  # Permitir ambos nombres
+                vector = [None] * len(CODIGOS_MONTO)
+                for posicion, columnas in enumerate(columnas_montos):
+                    valor_str = mapeo.dato(row, columnas)  # Permitir ambos nombres
                     if valor_str:
                         try:
-                            monto = Decimal(valor_str)
-                            if monto > 0:
-                                montos_dict[monto_key] = monto
+                            monto = decimal_de_celda(valor_str)
+                            if not monto.is_finite():
+                                raise InvalidOperation(valor_str)
                         except InvalidOperation:
-                            raise ValueError(f'Monto {monto_key} no es un número válido (línea {linea_referencia})')
-                
-                # Calcular factores
-                factores_calculados, suma_factores = self.calcular_factores_desde_montos(montos_dict, factor_map)
-                
-                # Validar suma de factores
-                if suma_factores > Decimal('1'):
-                    raise ValueError(f'Suma de factores calculados excede 1: {suma_factores} (línea {linea_referencia})')
-                
-                # Preparar preview
-                preview_row = {
-                    'linea': linea_referencia,
-                    'montos': {k: str(v) for k, v in montos_dict.items()},
-                    'factores': {k: str(v) for k, v in factores_calculados.items()},
-                    'suma_montos': str(sum(montos_dict.values())),
-                    'suma_factores': str(suma_factores)
-                }
-                preview_data.append(preview_row)
-                
+                            raise ValueError(f'Monto {CODIGOS_MONTO[posicion]} no es un número válido (línea {linea_referencia})')
+                        if monto > 0:
+                            vector[posicion] = monto
+                bloque.append((linea, linea_referencia, vector))
+            
             except Exception as e:
+                totales['rechazadas'] += 1
                 errores.append({
                     'linea': linea,
                     'error': str(e)
                 })
-        
-        return Response({
-            'preview': preview_data,
-            'errores': errores[:10],
-            'total_filas': len(preview_data) + len(errores),
-            'validas': len(preview_data),
-            'rechazadas': len(errores)
-        }, status=status.HTTP_200_OK)
+            if len(bloque) >= tamano_bloque:
+                calcular_bloque()
+        calcular_bloque()
+        return preview_data, errores, totales['validas'], totales['rechazadas']
     
     @action(detail=False, methods=['post'])
     def upload_montos(self, request):
-        """Carga masiva de calificaciones con montos (los factores se calculan automáticamente)"""
-        
-        # Obtener archivo CSV o Excel
-        if 'file' not in request.FILES:
-            return Response({'error': 'No se proporcionó archivo'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        file = request.FILES['file']
-        is_excel = file.name.endswith('.xlsx') or file.name.endswith('.xls')
-        is_csv = file.name.endswith('.csv')
-        
-        if not (is_csv or is_excel):
-            return Response({'error': 'El archivo debe ser CSV o Excel (.xlsx, .xls)'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Obtener usuario actual
-        try:
-            from usuarios.models import Usuario, Persona, Rol
-            from corredoras.models import Corredora
-            usuario = Usuario.objects.get(username=request.user.username)
-        except Usuario.DoesNotExist:
-            try:
-                persona = Persona.objects.create(
-                    primer_nombre=request.user.username,
-                    apellido_paterno='Usuario',
-                    fecha_nacimiento='1990-01-01'
-                )
-                usuario = Usuario.objects.create(
-                    id_persona=persona,
-                    username=request.user.username,
-                    estado='activo',
-                    hash_password=request.user.password
-                )
-            except Exception as e:
-                return Response({'error': f'Error al crear usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        except Exception as e:
-            return Response({'error': f'Error al obtener usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        # Leer archivo (CSV o Excel) - reutilizar lógica de upload_factores
-        raw_headers = []
-        rows_data = []
-        
-        try:
-            if is_excel:
-                if not OPENPYXL_AVAILABLE:
-                    return Response(
-                        {'error': 'openpyxl no está instalado. Ejecuta: pip install openpyxl'},
-                        status=status.HTTP_503_SERVICE_UNAVAILABLE
-                    )
-                file.seek(0)
-                wb = load_workbook(file, data_only=True)
-                ws = wb.active
-                raw_headers = [str(cell.value) if cell.value else '' for cell in ws[1]]
-                for row in ws.iter_rows(min_row=2, values_only=False):
-                    row_dict = {}
-                    for idx, cell in enumerate(row):
-                        if idx < len(raw_headers):
-                            header = raw_headers[idx]
-                            value = cell.value
-                            if value is None:
-                                row_dict[header] = ''
-                            elif isinstance(value, datetime):
-                                row_dict[header] = value.strftime('%Y-%m-%d')
-                            elif hasattr(value, 'date') and hasattr(value.date(), 'strftime'):
-                                row_dict[header] = value.date().strftime('%Y-%m-%d')
-                            elif isinstance(value, (int, float)) and header.lower() in ['ejercicio', 'linea']:
-                                row_dict[header] = str(int(value))
-                            else:
-                                row_dict[header] = str(value).strip() if value else ''
-                    if any(row_dict.values()):
-                        rows_data.append(row_dict)
-                
-                class ExcelDictReader:
-                    def __init__(self, headers, rows):
-                        self.fieldnames = headers
-                        self.rows = rows
-                        self.index = 0
-                    def __iter__(self):
-                        return self
-                    def __next__(self):
-                        if self.index >= len(self.rows):
-                            raise StopIteration
-                        row = self.rows[self.index]
-                        self.index += 1
-                        return row
-                reader = ExcelDictReader(raw_headers, rows_data)
-            else:
-                file_content = file.read().decode('utf-8-sig')
-                if file_content.lower().startswith('sep='):
-                    file_lines = file_content.splitlines()
-                    file_content = '\n'.join(file_lines[1:]) if len(file_lines) > 1 else ''
-                sample = file_content.splitlines()[0] if file_content else ''
-                delimiter = ';' if sample.count(';') >= sample.count(',') else ','
-                try:
-                    dialect = csv.Sniffer().sniff(sample, delimiters=',;')
-                    delimiter = dialect.delimiter
-                except Exception:
-                    pass
-                reader = csv.DictReader(io.StringIO(file_content), delimiter=delimiter)
-                raw_headers = reader.fieldnames or []
-        except Exception as e:
-            return Response({'error': f'Error al leer archivo: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        def normalize_header(header):
-            header = unicodedata.normalize('NFKD', header or '')
-            header = ''.join(ch for ch in header if not unicodedata.combining(ch))
-            return ''.join(ch for ch in header.lower() if ch.isalnum())
-        
-        header_map = {normalize_header(h): h for h in raw_headers}
-        
-        def get_cell(row, *aliases, default=''):
-            for alias in aliases:
-                normalized = normalize_header(alias)
-                original = header_map.get(normalized)
-                if original and original in row:
-                    value = row[original]
-                    if value is None:
-                        continue
-                    return str(value).strip()
-            return default
-        
-        # Validar encabezados requeridos
-        required_alias_groups = [
-            ('corredora',),
-            ('instrumento', 'instrumento_codigo'),
-            ('fuente', 'fuente_codigo'),
-            ('moneda', 'moneda_codigo'),
-            ('ejercicio',),
-            ('fecha_pago', 'fecha'),
-            ('secuencia_evento', 'secuencia')
-        ]
-        
-        missing_headers = []
-        for group in required_alias_groups:
-            if not any(normalize_header(alias) in header_map for alias in group):
-                missing_headers.append(group[0])
-        if missing_headers:
-            return Response({'error': f'Encabezados faltantes: {", ".join(missing_headers)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Obtener códigos de factores F08-F37
-        factor_codigos = [f'F{i:02d}' for i in range(8, 38)]
-        factor_map = {}
-        for factor in FactorDef.objects.filter(codigo_factor__in=factor_codigos):
-            factor_map[factor.codigo_factor] = factor
-        
-        # Procesar filas
-        insertados = 0
-        rechazados = 0
-        errores = []
-        
-        with transaction.atomic():
-            # Crear registro de Carga
-            carga = Carga.objects.create(
-                id_corredora_id=1,  # TODO: obtener de request
-                creado_por=usuario,
-                id_fuente_id=1,  # TODO: obtener de request
-                tipo='masiva',
-                nombre_archivo=file.name,
-                filas_total=0,
-                estado='importando'
-            )
-            
-            for linea, row in enumerate(reader, start=2):
-                try:
-                    linea_referencia = get_cell(row, 'linea', 'fila', default=str(linea))
-                    
-                    # Resolver corredora (reutilizar lógica de upload_factores)
-                    corredora = None
-                    corredor_raw_id = get_cell(row, 'id_corredora')
-                    if corredor_raw_id:
-                        try:
-                            corredora = Corredora.objects.get(id_corredora=int(corredor_raw_id))
-                        except (ValueError, Corredora.DoesNotExist):
-                            raise ValueError(f'Corredora con ID {corredor_raw_id} no existe (línea {linea_referencia})')
-                    if not corredora:
-                        corredora_nombre = get_cell(row, 'corredora')
-                        if not corredora_nombre:
-                            raise ValueError(f'Corredora es obligatoria (línea {linea_referencia})')
-                        try:
-                            corredora = Corredora.objects.get(nombre__iexact=corredora_nombre.strip())
-                        except Corredora.DoesNotExist:
-                            raise ValueError(f'Corredora "{corredora_nombre}" no existe (línea {linea_referencia})')
-                        except Corredora.MultipleObjectsReturned:
-                            raise ValueError(f'Corredora "{corredora_nombre}" no es única (línea {linea_referencia})')
-                    
-                    # Resolver instrumento (reutilizar lógica de upload_factores)
-                    instrumento = None
-                    instrumento_id_raw = get_cell(row, 'id_instrumento')
-                    if instrumento_id_raw:
-                        try:
-                            instrumento = Instrumento.objects.get(id_instrumento=int(instrumento_id_raw))
-                        except (ValueError, Instrumento.DoesNotExist):
-                            raise ValueError(f'Instrumento con ID {instrumento_id_raw} no existe (línea {linea_referencia})')
-                    if not instrumento:
-                        instrumento_codigo = get_cell(row, 'instrumento_codigo')
-                        if instrumento_codigo:
-                            instrumento = Instrumento.objects.filter(codigo__iexact=instrumento_codigo).first()
-                            if not instrumento:
-                                raise ValueError(f'Instrumento con código "{instrumento_codigo}" no existe (línea {linea_referencia})')
-                        else:
-                            instrumento_nombre = get_cell(row, 'instrumento')
-                            if not instrumento_nombre:
-                                raise ValueError(f'Instrumento es obligatorio (línea {linea_referencia})')
-                            instrumentos_qs = Instrumento.objects.filter(nombre__iexact=instrumento_nombre.strip())
-                            if not instrumentos_qs.exists():
-                                raise ValueError(f'Instrumento "{instrumento_nombre}" no existe (línea {linea_referencia})')
-                            if instrumentos_qs.count() > 1:
-                                raise ValueError(f'Instrumento "{instrumento_nombre}" no es único, especifique el código (línea {linea_referencia})')
-                            instrumento = instrumentos_qs.first()
-                    
-                    # Resolver fuente (reutilizar lógica de upload_factores)
-                    fuente = None
-                    fuente_id_raw = get_cell(row, 'id_fuente')
-                    if fuente_id_raw:
-                        try:
-                            fuente = Fuente.objects.get(id_fuente=int(fuente_id_raw))
-                        except (ValueError, Fuente.DoesNotExist):
-                            raise ValueError(f'Fuente con ID {fuente_id_raw} no existe (línea {linea_referencia})')
-                    if not fuente:
-                        fuente_codigo = get_cell(row, 'fuente_codigo')
-                        if fuente_codigo:
-                            fuente = Fuente.objects.filter(codigo__iexact=fuente_codigo).first()
-                            if not fuente:
-                                raise ValueError(f'Fuente con código "{fuente_codigo}" no existe (línea {linea_referencia})')
-                        else:
-                            fuente_nombre = get_cell(row, 'fuente')
-                            if not fuente_nombre:
-                                raise ValueError(f'Fuente es obligatoria (línea {linea_referencia})')
-                            fuente = Fuente.objects.filter(nombre__iexact=fuente_nombre.strip()).first()
-                            if not fuente:
-                                raise ValueError(f'Fuente "{fuente_nombre}" no existe (línea {linea_referencia})')
-                    
-                    # Resolver moneda (reutilizar lógica de upload_factores)
-                    moneda = None
-                    moneda_id_raw = get_cell(row, 'id_moneda')
-                    if moneda_id_raw:
-                        try:
-                            moneda = Moneda.objects.get(id_moneda=int(moneda_id_raw))
-                        except (ValueError, Moneda.DoesNotExist):
-                            raise ValueError(f'Moneda con ID {moneda_id_raw} no existe (línea {linea_referencia})')
-                    if not moneda:
-                        moneda_codigo = get_cell(row, 'moneda_codigo', 'moneda')
-                        if not moneda_codigo:
-                            raise ValueError(f'Moneda es obligatoria (línea {linea_referencia})')
-                        moneda = Moneda.objects.filter(codigo__iexact=moneda_codigo.strip()).first()
-                        if not moneda:
-                            raise ValueError(f'Moneda "{moneda_codigo}" no existe (línea {linea_referencia})')
-                    
-                    # Validar ejercicio y fecha
-                    ejercicio_raw = get_cell(row, 'ejercicio')
-                    try:
-                        ejercicio = int(ejercicio_raw)
-                    except (TypeError, ValueError):
-                        raise ValueError(f'Ejercicio inválido "{ejercicio_raw}" (línea {linea_referencia})')
-                    
-                    fecha_pago_raw = get_cell(row, 'fecha_pago', 'fecha')
-                    fecha_pago = None
-                    parsed = False
-                    for fmt in ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y'):
-                        try:
-                            fecha_pago = datetime.strptime(fecha_pago_raw, fmt).date()
-                            parsed = True
-                            break
-                        except ValueError:
-                            continue
-                    if not parsed:
-                        raise ValueError(f'Fecha de pago inválida "{fecha_pago_raw}" (línea {linea_referencia})')
-                    
-                    def parse_bool(value, default=False):
-                        if value is None or value == '':
-                            return default
-                        value = str(value).strip().lower()
-                        if value in ['true', '1', 'si', 'sí', 'yes', 'y']:
-                            return True
-                        if value in ['false', '0', 'no', 'n']:
-                            return False
-                        return default
-                    
-                    acogido_sfut = parse_bool(get_cell(row, 'acogido_sfut', 'sfut'))
-                    descripcion_val = get_cell(row, 'descripcion')
-                    estado_val = get_cell(row, 'estado').lower() or 'borrador'
-                    if estado_val not in ['borrador', 'validada', 'publicada', 'pendiente']:
-                        raise ValueError(f'Estado "{estado_val}" inválido (línea {linea_referencia})')
-                    
-                    valor_historico_val = get_cell(row, 'valor_historico')
-                    valor_historico = None
-                    if valor_historico_val:
-                        try:
-                            valor_historico = Decimal(valor_historico_val)
-                        except InvalidOperation:
-                            raise ValueError(f'Valor histórico inválido "{valor_historico_val}" (línea {linea_referencia})')
-                    
-                    # Leer montos M08-M37
-                    montos_dict = {}
-                    for codigo in factor_codigos:
-                        monto_key = codigo.replace('F', 'M')  # M08-M37
-                        valor_str = get_cell(row, monto_key, codigo)  # Permitir ambos nombres
-                        if valor_str:
-                            try:
-                                monto = Decimal(valor_str)
-                                if monto > 0:
-                                    montos_dict[monto_key] = monto
-                            except InvalidOperation:
-                                raise ValueError(f'Monto {monto_key} no es un número válido (línea {linea_referencia})')
-                    
-                    # Calcular factores desde montos
-                    factores_calculados, suma_factores = self.calcular_factores_desde_montos(montos_dict, factor_map)
-                    
-                    # Validar suma de factores
-                    if suma_factores > Decimal('1'):
-                        raise ValueError(f'Suma de factores calculados excede 1: {suma_factores} (línea {linea_referencia})')
-                    
-                    # Buscar o crear calificación
-                    calificacion, created = Calificacion.objects.get_or_create(
-                        id_corredora=corredora,
-                        id_instrumento=instrumento,
-                        ejercicio=ejercicio,
-                        secuencia_evento=get_cell(row, 'secuencia_evento', 'secuencia'),
-                        defaults={
-                            'id_fuente': fuente,
-                            'id_moneda': moneda,
-                            'fecha_pago': fecha_pago,
-                            'descripcion': descripcion_val,
-                            'ingreso_por_montos': True,  # IMPORTANTE: Marcar que viene de montos
-                            'acogido_sfut': acogido_sfut,
-                            'factor_actualizacion': suma_factores,
-                            'valor_historico': valor_historico,
-                            'estado': estado_val,
-                            'observaciones': 'Carga masiva por montos',
-                            'creado_por': usuario,
-                            'actualizado_por': usuario
-                        }
-                    )
-                    
-                    if not created:
-                        calificacion.id_fuente = fuente
-                        calificacion.id_moneda = moneda
-                        calificacion.fecha_pago = fecha_pago
-                        calificacion.descripcion = descripcion_val
-                        calificacion.acogido_sfut = acogido_sfut
-                        calificacion.factor_actualizacion = suma_factores
-                        calificacion.valor_historico = valor_historico
-                        calificacion.actualizado_por = usuario
-                        calificacion.estado = estado_val
-                        calificacion.ingreso_por_montos = True  # IMPORTANTE: Marcar que viene de montos
-                        calificacion.observaciones = 'Carga masiva por montos'
-                        calificacion.save()
-                    
-                    # Eliminar montos y factores antiguos
-                    CalificacionMontoDetalle.objects.filter(id_calificacion=calificacion).delete()
-                    CalificacionFactorDetalle.objects.filter(id_calificacion=calificacion).delete()
-                    
-                    # Guardar montos en calificacion_monto_detalle
-                    for codigo, monto in montos_dict.items():
-                        factor_code = codigo.replace('M', 'F')  # M08 -> F08
-                        if factor_code in factor_map:
-                            CalificacionMontoDetalle.objects.create(
-                                id_calificacion=calificacion,
-                                id_factor=factor_map[factor_code],
-                                valor_monto=monto
-                            )
-                    
-                    # Guardar factores calculados en calificacion_factor_detalle
-                    for codigo, factor in factores_calculados.items():
-                        if codigo in factor_map:
-                            CalificacionFactorDetalle.objects.create(
-                                id_calificacion=calificacion,
-                                id_factor=factor_map[codigo],
-                                valor_factor=factor
-                            )
-                    
-                    # Registrar en carga_detalle
-                    hash_value = hashlib.md5(str(row).encode('utf-8')).hexdigest()
-                    CargaDetalle.objects.create(
-                        id_carga=carga,
-                        linea=linea,
-                        estado_linea='ok',
-                        id_calificacion=calificacion,
-                        hash_linea=hash_value
-                    )
-                    
-                    insertados += 1
-                    
-                except Exception as e:
-                    rechazados += 1
-                    errores.append({
-                        'linea': linea,
-                        'error': str(e)
-                    })
-                    
-                    hash_value = hashlib.md5(str(row).encode('utf-8')).hexdigest()
-                    CargaDetalle.objects.create(
-                        id_carga=carga,
-                        linea=linea,
-                        estado_linea='rechazo',
-                        mensaje_error=str(e),
-                        hash_linea=hash_value
-                    )
-            
-            # Actualizar resumen de Carga
-            carga.filas_total = insertados + rechazados
-            carga.insertados = insertados
-            carga.rechazados = rechazados
-            carga.estado = 'done' if rechazados == 0 else 'done'
-            carga.save()
-        
-        return Response({
-            'carga_id': carga.id_carga,
-            'filas_total': carga.filas_total,
-            'insertados': insertados,
-            'rechazados': rechazados,
-            'errores': errores[:10]
-        }, status=status.HTTP_201_CREATED)
+        """Carga masiva de calificaciones con montos (los factores se calculan automáticamente, procesamiento asíncrono)"""
+        return self._encolar_carga(request, 'montos')
     
     @action(detail=False, methods=['get'])
     def download_template_montos(self, request):
@@ -2256,6 +1860,16 @@ class CargaDetalleViewSet(viewsets.ModelViewSet):
     serializer_class = CargaDetalleSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        id_carga = self.request.query_params.get('id_carga')
+        if id_carga:
+            queryset = queryset.filter(id_carga_id=id_carga)
+        estado_linea = self.request.query_params.get('estado_linea')
+        if estado_linea:
+            queryset = queryset.filter(estado_linea=estado_linea)
+        return queryset.order_by('id_carga_id', 'linea')
+
 
 # ========= VIEWSETS AUDITORIA =========
 
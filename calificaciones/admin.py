@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib import messages
 from django.utils.html import format_html
-from .models import FactorDef, Calificacion, CalificacionMontoDetalle, CalificacionFactorDetalle
+from .detalles import marcar_calificaciones_modificadas
+from .models import FactorDef, Calificacion, CalificacionMontoDetalle, CalificacionFactorDetalle, RecalculoFactores
 
 
 @admin.register(FactorDef)
@@ -79,8 +80,29 @@ class CalificacionAdmin(admin.ModelAdmin):
         self.message_user(request, f'{updated} calificacion(es) validada(s).', messages.SUCCESS)
 
 
+class DetalleCalificacionAdminMixin:
+    """Editar o borrar un detalle desde el admin actualiza actualizado_en de su calificación"""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        ids = {obj.id_calificacion_id}
+        if change and 'id_calificacion' in form.changed_data:
+            ids.add(form.initial.get('id_calificacion'))
+        marcar_calificaciones_modificadas(ids - {None})
+
+    def delete_model(self, request, obj):
+        id_calificacion = obj.id_calificacion_id
+        super().delete_model(request, obj)
+        marcar_calificaciones_modificadas([id_calificacion])
+
+    def delete_queryset(self, request, queryset):
+        ids = set(queryset.values_list('id_calificacion_id', flat=True))
+        super().delete_queryset(request, queryset)
+        marcar_calificaciones_modificadas(ids)
+
+
 @admin.register(CalificacionMontoDetalle)
-class CalificacionMontoDetalleAdmin(admin.ModelAdmin):
+class CalificacionMontoDetalleAdmin(DetalleCalificacionAdminMixin, admin.ModelAdmin):
     list_display = ('id_calificacion', 'id_factor', 'valor_monto', 'creado_en', 'actualizado_en', 'editar')
     search_fields = ('id_calificacion__id_calificacion', 'id_factor__codigo_factor')
     list_filter = ('id_factor',)
@@ -97,7 +119,7 @@ class CalificacionMontoDetalleAdmin(admin.ModelAdmin):
 
 
 @admin.register(CalificacionFactorDetalle)
-class CalificacionFactorDetalleAdmin(admin.ModelAdmin):
+class CalificacionFactorDetalleAdmin(DetalleCalificacionAdminMixin, admin.ModelAdmin):
     list_display = ('id_calificacion', 'id_factor', 'valor_factor', 'creado_en', 'actualizado_en', 'editar')
     search_fields = ('id_calificacion__id_calificacion', 'id_factor__codigo_factor')
     list_filter = ('id_factor',)
@@ -110,4 +132,14 @@ class CalificacionFactorDetalleAdmin(admin.ModelAdmin):
         if obj.pk:
             return format_html('<a href="/admin/calificaciones/calificacionfactordetalle/{}/change/">✏️</a>', obj.pk)
         return '-'
-    editar.short_description = ''
\ No newline at end of file
+    editar.short_description = ''
+
+
+@admin.register(RecalculoFactores)
+class RecalculoFactoresAdmin(admin.ModelAdmin):
+    list_display = ('id_recalculo', 'estado', 'creado_por', 'total', 'procesadas', 'actualizadas', 'sin_cambios', 'rechazadas', 'creado_en', 'finalizado_en')
+    list_filter = ('estado', 'creado_en')
+    raw_id_fields = ('creado_por',)
+    readonly_fields = ('total', 'procesadas', 'actualizadas', 'sin_cambios', 'rechazadas', 'ultimo_id_calificacion', 'iniciado_en', 'finalizado_en', 'creado_en', 'actualizado_en')
+    ordering = ('-creado_en',)
+    date_hierarchy = 'creado_en'
@@ -0,0 +1,96 @@
+"""
+Sincronización de los detalles de una calificación (CalificacionFactorDetalle y
+CalificacionMontoDetalle).
+
+En vez de borrar y recrear todos los detalles, sincronizar_detalles() compara el
+vector de valores que debe quedar con el guardado y ejecuta solo los INSERT,
+UPDATE y DELETE necesarios, en bloque. Las filas que no cambian no se tocan
+(conservan su creado_en/actualizado_en).
+
+Un cambio en los detalles también actualiza Calificacion.actualizado_en
+(marcar_calificaciones_modificadas): las cargas masivas comparan contra esa
+fecha para omitir líneas sin cambios y para la reconciliación.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.utils import timezone
+
+from .models import Calificacion
+
+
+# Escala de valor_factor / valor_monto (DecimalField decimal_places=8)
+ESCALA_DETALLE = Decimal('0.00000001')
+
+
+def _valor_guardado(valor):
+    """Valor tal como queda en la columna (redondeado a 8 decimales)"""
+    if valor is None:
+        return None
+    return Decimal(valor).quantize(ESCALA_DETALLE, rounding=ROUND_HALF_UP)
+
+
+def marcar_calificaciones_modificadas(ids, ahora=None, batch_size=500):
+    """Deja Calificacion.actualizado_en en `ahora` para las calificaciones cuyos detalles cambiaron"""
+    ids = list(ids)
+    ahora = ahora or timezone.now()
+    for inicio in range(0, len(ids), batch_size):
+        Calificacion.objects.filter(pk__in=ids[inicio:inicio + batch_size]).update(actualizado_en=ahora)
+
+
+def sincronizar_detalles(modelo, campo_valor, deseados, batch_size=500, cambiadas=None, actualizar_calificacion=True):
+    """
+    Deja las calificaciones de `deseados` exactamente con esos detalles.
+
+    modelo: CalificacionFactorDetalle o CalificacionMontoDetalle
+    campo_valor: 'valor_factor' o 'valor_monto'
+    deseados: id_calificacion -> {id_factor: valor}; un dict vacío elimina todos
+        los detalles de esa calificación.
+
+    cambiadas: set opcional donde se agregan los id_calificacion con algún cambio.
+    actualizar_calificacion: actualizar Calificacion.actualizado_en de las que
+        cambiaron; False si quien llama ya la actualiza en la misma operación.
+
+    Una consulta para leer los detalles actuales y a lo más un DELETE, un
+    bulk_update, un bulk_create y un UPDATE de calificacion (en lotes de batch_size).
+    Retorna (insertados, actualizados, eliminados).
+    """
+    if not deseados:
+        return 0, 0, 0
+
+    if cambiadas is None:
+        cambiadas = set()
+    ya_cambiadas = set(cambiadas)
+    pendientes = {id_calificacion: dict(valores) for id_calificacion, valores in deseados.items()}
+    por_eliminar = []
+    por_actualizar = []
+    ahora = timezone.now()
+    actuales = modelo.objects.filter(id_calificacion_id__in=list(pendientes)).values_list(
+        'pk', 'id_calificacion_id', 'id_factor_id', campo_valor
+    )
+    for pk, id_calificacion, id_factor, valor_actual in actuales.iterator():
+        valores = pendientes[id_calificacion]
+        if id_factor not in valores:
+            por_eliminar.append(pk)
+        else:
+            valor = valores.pop(id_factor)
+            if _valor_guardado(valor) == _valor_guardado(valor_actual):
+                continue
+            por_actualizar.append(modelo(pk=pk, **{campo_valor: valor, 'actualizado_en': ahora}))
+        cambiadas.add(id_calificacion)
+
+    por_insertar = [
+        modelo(id_calificacion_id=id_calificacion, id_factor_id=id_factor, **{campo_valor: valor})
+        for id_calificacion, valores in pendientes.items()
+        for id_factor, valor in valores.items()
+    ]
+    cambiadas.update(id_calificacion for id_calificacion, valores in pendientes.items() if valores)
+
+    for inicio in range(0, len(por_eliminar), batch_size):
+        modelo.objects.filter(pk__in=por_eliminar[inicio:inicio + batch_size]).delete()
+    if por_actualizar:
+        modelo.objects.bulk_update(por_actualizar, [campo_valor, 'actualizado_en'], batch_size=batch_size)
+    if por_insertar:
+        modelo.objects.bulk_create(por_insertar, batch_size=batch_size)
+    if actualizar_calificacion:
+        marcar_calificaciones_modificadas(cambiadas - ya_cambiadas, ahora, batch_size=batch_size)
+    return len(por_insertar), len(por_actualizar), len(por_eliminar)
@@ -0,0 +1,41 @@
+"""
+Filtros de búsqueda de calificaciones.
+
+Los usa CalificacionViewSet.get_queryset (parámetros de la URL) y el recálculo
+masivo de factores (filtros guardados en RecalculoFactores), para que ambos
+seleccionen exactamente las mismas calificaciones.
+"""
+
+# Parámetros aceptados (el recálculo guarda solo estos)
+PARAMETROS_FILTRO = ('estado', 'corredora', 'mercado', 'origen', 'fuente', 'ejercicio', 'periodo', 'pendiente')
+
+
+def filtrar_calificaciones(queryset, parametros):
+    """
+    Aplica los filtros de búsqueda a un queryset de Calificacion.
+    `parametros` es un dict (o QueryDict) con las claves de PARAMETROS_FILTRO.
+    """
+    estado = parametros.get('estado')
+    corredora_id = parametros.get('corredora')
+    mercado_id = parametros.get('mercado')
+    fuente_id = parametros.get('origen') or parametros.get('fuente')
+    ejercicio = parametros.get('ejercicio') or parametros.get('periodo')
+    pendiente = parametros.get('pendiente')
+
+    if estado:
+        queryset = queryset.filter(estado=estado)
+    if corredora_id:
+        queryset = queryset.filter(id_corredora_id=corredora_id)
+    if mercado_id:
+        # Filtrar por mercado a través del instrumento
+        queryset = queryset.filter(id_instrumento__id_mercado_id=mercado_id)
+    if fuente_id:
+        queryset = queryset.filter(id_fuente_id=fuente_id)
+    if ejercicio:
+        queryset = queryset.filter(ejercicio=ejercicio)
+    if pendiente is not None:
+        # Si pendiente=True, filtrar por estado='pendiente'
+        if str(pendiente).lower() == 'true':
+            queryset = queryset.filter(estado='pendiente')
+
+    return queryset
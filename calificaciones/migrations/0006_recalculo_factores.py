@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0005_calificacion_ix_calif_corr_and_more'),
+        ('usuarios', '0005_usuariorol_ix_usuario_rol_rol'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecalculoFactores',
+            fields=[
+                ('id_recalculo', models.BigAutoField(primary_key=True, serialize=False)),
+                ('filtros', models.TextField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('done', 'Completado'), ('failed', 'Fallido')], default='pendiente', max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('procesadas', models.IntegerField(default=0)),
+                ('actualizadas', models.IntegerField(default=0)),
+                ('sin_cambios', models.IntegerField(default=0)),
+                ('rechazadas', models.IntegerField(default=0)),
+                ('ultimo_id_calificacion', models.BigIntegerField(default=0)),
+                ('mensaje_error', models.TextField(blank=True, null=True)),
+                ('iniciado_en', models.DateTimeField(blank=True, null=True)),
+                ('finalizado_en', models.DateTimeField(blank=True, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+                ('creado_por', models.ForeignKey(db_column='creado_por', on_delete=django.db.models.deletion.RESTRICT, related_name='recalculos_factores', to='usuarios.usuario')),
+            ],
+            options={
+                'verbose_name': 'Recálculo de Factores',
+                'verbose_name_plural': 'Recálculos de Factores',
+                'db_table': 'recalculo_factores',
+                'indexes': [models.Index(fields=['estado'], name='recalculo_f_estado_3c60b3_idx')],
+            },
+        ),
+    ]
@@ -167,4 +167,54 @@ class CalificacionFactorDetalle(models.Model):
         ]
 
     def __str__(self):
-        return f"Detalle Factor {self.id_factor.codigo_factor} - {self.id_calificacion.id_calificacion}"
\ No newline at end of file
+        return f"Detalle Factor {self.id_factor.codigo_factor} - {self.id_calificacion.id_calificacion}"
+
+class RecalculoFactores(models.Model):
+    """
+    Recálculo masivo de factores desde montos sobre un conjunto filtrado de
+    calificaciones (ver calificaciones.recalculo). Lo procesa en segundo plano
+    el worker procesar_cargas.
+    """
+    id_recalculo = models.BigAutoField(primary_key=True)
+    creado_por = models.ForeignKey(
+        'usuarios.Usuario',
+        on_delete=models.RESTRICT,
+        db_column='creado_por',
+        related_name='recalculos_factores'
+    )
+    # Filtros de búsqueda (calificaciones.filtros) y corredoras permitidas al usuario, en JSON
+    filtros = models.TextField(null=True, blank=True)
+    estado = models.CharField(
+        max_length=20,
+        choices=[
+            ('pendiente', 'Pendiente'),
+            ('procesando', 'Procesando'),
+            ('done', 'Completado'),
+            ('failed', 'Fallido'),
+        ],
+        default='pendiente'
+    )
+    total = models.IntegerField(default=0)
+    procesadas = models.IntegerField(default=0)
+    actualizadas = models.IntegerField(default=0)
+    sin_cambios = models.IntegerField(default=0)
+    # Sin montos o con suma de factores mayor a 1 (no se modifican)
+    rechazadas = models.IntegerField(default=0)
+    # Último id_calificacion confirmado (los bloques se recorren por id ascendente)
+    ultimo_id_calificacion = models.BigIntegerField(default=0)
+    mensaje_error = models.TextField(null=True, blank=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    finalizado_en = models.DateTimeField(null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'recalculo_factores'
+        verbose_name = 'Recálculo de Factores'
+        verbose_name_plural = 'Recálculos de Factores'
+        indexes = [
+            models.Index(fields=['estado']),
+        ]
+
+    def __str__(self):
+        return f"Recálculo #{self.id_recalculo} - {self.estado}"
@@ -0,0 +1,210 @@
+"""
+Recálculo masivo de factores desde montos (CalificacionViewSet.recalcular_factores).
+
+Cada solicitud queda como un RecalculoFactores que procesa el worker
+procesar_cargas, en bloques de RECALCULO_BLOQUE calificaciones recorridas por
+id_calificacion ascendente. Por bloque:
+
+- una consulta para los ids (y valores actuales) y otra para todos sus montos,
+- MotorFactores calcula los factores del bloque en una sola pasada,
+- sincronizar_detalles escribe solo los factores que cambian,
+- un bulk_update de las calificaciones modificadas y un bulk_create de su auditoría,
+
+todo en una transacción junto con el avance del recálculo.
+"""
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from auditoria.models import Auditoria
+from cargas.motor_factores import CODIGOS_FACTOR, MotorFactores
+
+from .detalles import sincronizar_detalles
+from .filtros import filtrar_calificaciones
+from .models import Calificacion, CalificacionFactorDetalle, CalificacionMontoDetalle, FactorDef, RecalculoFactores
+
+
+logger = logging.getLogger(__name__)
+
+# Columna de cada factor F08-F37 en los vectores de MotorFactores
+_POSICION_FACTOR = {codigo: posicion for posicion, codigo in enumerate(CODIGOS_FACTOR)}
+
+
+def serializar_filtros(parametros, corredoras):
+    """
+    Filtros a guardar en RecalculoFactores.filtros: los parámetros de búsqueda y,
+    si el usuario no es administrador, las corredoras que puede ver (None = todas).
+    """
+    return json.dumps({'parametros': parametros, 'corredoras': corredoras}, ensure_ascii=False)
+
+
+def calificaciones_del_recalculo(recalculo):
+    """Queryset de las calificaciones que abarca el recálculo"""
+    filtros = json.loads(recalculo.filtros or '{}')
+    queryset = Calificacion.objects.all()
+    corredoras = filtros.get('corredoras')
+    if corredoras is not None:
+        queryset = queryset.filter(id_corredora_id__in=corredoras)
+    return filtrar_calificaciones(queryset, filtros.get('parametros') or {})
+
+
+def tomar_siguiente_recalculo():
+    """
+    Reserva el recálculo pendiente más antiguo para este worker (UPDATE
+    condicional sobre iniciado_en, igual que tomar_siguiente_carga).
+    """
+    pendientes = (
+        RecalculoFactores.objects.filter(estado='pendiente', iniciado_en__isnull=True)
+        .order_by('creado_en', 'id_recalculo')
+        .values_list('id_recalculo', flat=True)[:20]
+    )
+    for id_recalculo in pendientes:
+        reservado = RecalculoFactores.objects.filter(
+            pk=id_recalculo, estado='pendiente', iniciado_en__isnull=True
+        ).update(iniciado_en=timezone.now(), estado='procesando')
+        if reservado:
+            return RecalculoFactores.objects.select_related('creado_por').get(pk=id_recalculo)
+    return None
+
+
+def procesar_recalculo(recalculo, tamano_bloque=None):
+    """
+    Recalcula los factores de las calificaciones del recálculo y lo deja en
+    'done' o 'failed'. Cada bloque se confirma por separado, con el avance
+    (procesadas, actualizadas, sin_cambios, rechazadas) en la misma transacción.
+    """
+    tamano_bloque = tamano_bloque or getattr(settings, 'RECALCULO_BLOQUE', 500)
+    try:
+        calificaciones = calificaciones_del_recalculo(recalculo)
+        recalculo.total = calificaciones.count()
+        RecalculoFactores.objects.filter(pk=recalculo.pk).update(total=recalculo.total, actualizado_en=timezone.now())
+
+        factor_map = {
+            factor.codigo_factor: factor
+            for factor in FactorDef.objects.filter(codigo_factor__in=CODIGOS_FACTOR)
+        }
+        motor = MotorFactores(factor_map)
+        while True:
+            bloque = list(
+                calificaciones.filter(id_calificacion__gt=recalculo.ultimo_id_calificacion)
+                .order_by('id_calificacion')
+                .values_list('id_calificacion', 'factor_actualizacion', 'ingreso_por_montos')[:tamano_bloque]
+            )
+            if not bloque:
+                break
+            with transaction.atomic():
+                _recalcular_bloque(recalculo, bloque, motor, factor_map)
+                _guardar_avance(recalculo)
+
+        recalculo.estado = 'done'
+        recalculo.finalizado_en = timezone.now()
+        RecalculoFactores.objects.filter(pk=recalculo.pk).update(
+            estado='done', finalizado_en=recalculo.finalizado_en, actualizado_en=timezone.now()
+        )
+    except Exception as e:
+        logger.exception('Error en recálculo de factores #%s', recalculo.pk)
+        recalculo.estado = 'failed'
+        recalculo.mensaje_error = str(e)
+        recalculo.finalizado_en = timezone.now()
+        RecalculoFactores.objects.filter(pk=recalculo.pk).update(
+            estado='failed', mensaje_error=str(e), finalizado_en=recalculo.finalizado_en,
+            actualizado_en=timezone.now()
+        )
+    return recalculo
+
+
+def _recalcular_bloque(recalculo, bloque, motor, factor_map):
+    """Recalcula un bloque [(id_calificacion, factor_actualizacion, ingreso_por_montos), ...]"""
+    ids = [id_calificacion for id_calificacion, _, _ in bloque]
+
+    # Montos de todo el bloque en una consulta
+    vectores = {id_calificacion: [None] * len(CODIGOS_FACTOR) for id_calificacion in ids}
+    montos = CalificacionMontoDetalle.objects.filter(id_calificacion_id__in=ids).values_list(
+        'id_calificacion_id', 'id_factor__codigo_factor', 'valor_monto'
+    )
+    for id_calificacion, codigo_factor, valor_monto in montos.iterator():
+        posicion = _POSICION_FACTOR.get(codigo_factor)
+        if posicion is not None and valor_monto and valor_monto > 0:
+            vectores[id_calificacion][posicion] = valor_monto
+
+    calculos = dict(zip(ids, motor.calcular([vectores[id_calificacion] for id_calificacion in ids])))
+
+    deseados = {}
+    sumas = {}
+    for id_calificacion, factor_actual, ingreso_por_montos in bloque:
+        factores, suma_montos, suma_factores = calculos[id_calificacion]
+        # Sin montos o suma de factores mayor a 1: la calificación no se modifica
+        if not suma_montos or suma_factores > Decimal('1'):
+            recalculo.rechazadas += 1
+            continue
+        deseados[id_calificacion] = {
+            factor_map[codigo].id_factor: factor
+            for codigo, factor in zip(CODIGOS_FACTOR, factores)
+            if factor is not None
+        }
+        sumas[id_calificacion] = (suma_factores, factor_actual, ingreso_por_montos, factores)
+
+    cambiadas = set()
+    # actualizado_en de las cambiadas se escribe en el bulk_update de abajo
+    sincronizar_detalles(
+        CalificacionFactorDetalle, 'valor_factor', deseados, cambiadas=cambiadas, actualizar_calificacion=False
+    )
+    for id_calificacion, (suma_factores, factor_actual, ingreso_por_montos, _) in sumas.items():
+        if ingreso_por_montos is not True or factor_actual != suma_factores:
+            cambiadas.add(id_calificacion)
+
+    ahora = timezone.now()
+    observaciones = f'Factores recalculados desde montos el {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
+    actualizar = []
+    auditorias = []
+    for id_calificacion in ids:
+        if id_calificacion not in cambiadas:
+            continue
+        suma_factores, factor_actual, _, factores = sumas[id_calificacion]
+        actualizar.append(Calificacion(
+            id_calificacion=id_calificacion, ingreso_por_montos=True, factor_actualizacion=suma_factores,
+            observaciones=observaciones, actualizado_por_id=recalculo.creado_por_id, actualizado_en=ahora
+        ))
+        auditorias.append(Auditoria(
+            actor_id_id=recalculo.creado_por_id,
+            entidad='CALIFICACION',
+            entidad_id=id_calificacion,
+            accion='UPDATE',
+            fuente='API',
+            valores_antes={'suma_factores': str(factor_actual) if factor_actual is not None else None},
+            valores_despues={
+                'factores_calculados': {
+                    codigo: str(factor) for codigo, factor in zip(CODIGOS_FACTOR, factores) if factor is not None
+                },
+                'suma_factores': str(suma_factores),
+                'id_recalculo': recalculo.id_recalculo,
+            }
+        ))
+    if actualizar:
+        Calificacion.objects.bulk_update(
+            actualizar,
+            ['ingreso_por_montos', 'factor_actualizacion', 'observaciones', 'actualizado_por', 'actualizado_en'],
+            batch_size=500
+        )
+        Auditoria.objects.bulk_create(auditorias, batch_size=500)
+
+    recalculo.procesadas += len(ids)
+    recalculo.actualizadas += len(actualizar)
+    recalculo.sin_cambios += len(sumas) - len(actualizar)
+    recalculo.ultimo_id_calificacion = ids[-1]
+
+
+def _guardar_avance(recalculo):
+    RecalculoFactores.objects.filter(pk=recalculo.pk).update(
+        procesadas=recalculo.procesadas,
+        actualizadas=recalculo.actualizadas,
+        sin_cambios=recalculo.sin_cambios,
+        rechazadas=recalculo.rechazadas,
+        ultimo_id_calificacion=recalculo.ultimo_id_calificacion,
+        actualizado_en=timezone.now(),
+    )
@@ -1,3 +1,123 @@
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
 from django.test import TestCase
+from django.utils import timezone
+
+from cargas.motor_factores import CODIGOS_FACTOR
+from core.models import Fuente, Mercado, Moneda, Pais
+from corredoras.models import Corredora
+from instrumentos.models import Instrumento
+from usuarios.models import Persona, Usuario
+
+from .detalles import sincronizar_detalles
+from .models import Calificacion, CalificacionFactorDetalle, FactorDef
+
+
+# Factores que suman en la validación (suma de factores <= 1)
+FACTORES_EN_SUMA = ('F08', 'F09', 'F10')
+
+
+def crear_catalogos():
+    """
+    Catálogos mínimos para calificaciones y cargas (los mismos nombres que usan
+    los archivos de ejemplo): Banco de Chile, ADP Bolsa (CL0001234567), SVS, CLP
+    y los factores F08-F37. Retorna un SimpleNamespace con los objetos creados.
+    """
+    pais = Pais.objects.create(codigo='CHL', nombre='Chile')
+    clp = Moneda.objects.create(codigo='CLP', nombre='Peso chileno')
+    mercado = Mercado.objects.create(codigo='BCS', nombre='Bolsa de Comercio de Santiago', id_pais=pais)
+    persona = Persona.objects.create(primer_nombre='admin', apellido_paterno='Usuario', fecha_nacimiento='1990-01-01')
+    return SimpleNamespace(
+        pais=pais,
+        moneda=clp,
+        fuente=Fuente.objects.create(pk=1, codigo='SVS', nombre='Superintendencia de Valores y Seguros'),
+        corredora=Corredora.objects.create(pk=1, nombre='Banco de Chile', id_pais=pais),
+        instrumento=Instrumento.objects.create(
+            codigo='CL0001234567', nombre='ADP Bolsa', id_mercado=mercado, id_moneda=clp
+        ),
+        usuario=Usuario.objects.create(id_persona=persona, username='admin'),
+        factores={
+            codigo: FactorDef.objects.create(
+                codigo_factor=codigo, nombre_corto=codigo, orden_visual=orden,
+                aplica_en_suma=codigo in FACTORES_EN_SUMA
+            )
+            for orden, codigo in enumerate(CODIGOS_FACTOR, start=1)
+        },
+    )
+
+
+def crear_calificacion(catalogos, secuencia_evento, **campos):
+    return Calificacion.objects.create(
+        id_corredora=catalogos.corredora, id_instrumento=catalogos.instrumento, id_fuente=catalogos.fuente,
+        id_moneda=catalogos.moneda, ejercicio=2024, secuencia_evento=secuencia_evento,
+        creado_por=catalogos.usuario, actualizado_por=catalogos.usuario, **campos
+    )
+
+
+class SincronizarDetallesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogos = crear_catalogos()
+        cls.f08 = cls.catalogos.factores['F08'].id_factor
+        cls.f09 = cls.catalogos.factores['F09'].id_factor
+        cls.f10 = cls.catalogos.factores['F10'].id_factor
+
+    def setUp(self):
+        self.calificacion = crear_calificacion(self.catalogos, '0001')
+        self.otra = crear_calificacion(self.catalogos, '0002')
+        sincronizar_detalles(CalificacionFactorDetalle, 'valor_factor', {
+            self.calificacion.pk: {self.f08: Decimal('0.1'), self.f09: Decimal('0.2')},
+            self.otra.pk: {self.f08: Decimal('0.5')},
+        })
+        # Fecha conocida para ver qué calificaciones se marcan como modificadas
+        self.antes = timezone.now() - timedelta(days=1)
+        Calificacion.objects.update(actualizado_en=self.antes)
+
+    def _detalles(self, calificacion):
+        return dict(
+            CalificacionFactorDetalle.objects.filter(id_calificacion=calificacion)
+            .values_list('id_factor_id', 'valor_factor')
+        )
+
+    def test_escribe_solo_las_diferencias(self):
+        sin_cambio = CalificacionFactorDetalle.objects.get(id_calificacion=self.calificacion, id_factor=self.f08)
+
+        resultado = sincronizar_detalles(CalificacionFactorDetalle, 'valor_factor', {
+            self.calificacion.pk: {self.f08: Decimal('0.100000001'), self.f10: Decimal('0.3')},
+        })
+
+        # F08 redondea al mismo valor guardado, F09 se elimina y F10 se inserta
+        self.assertEqual(resultado, (1, 0, 1))
+        self.assertEqual(self._detalles(self.calificacion), {self.f08: Decimal('0.1'), self.f10: Decimal('0.3')})
+        fila = CalificacionFactorDetalle.objects.get(pk=sin_cambio.pk)
+        self.assertEqual(fila.actualizado_en, sin_cambio.actualizado_en)
+
+    def test_dict_vacio_elimina_todos_los_detalles(self):
+        cambiadas = set()
+        sincronizar_detalles(CalificacionFactorDetalle, 'valor_factor', {self.otra.pk: {}}, cambiadas=cambiadas)
+
+        self.assertEqual(self._detalles(self.otra), {})
+        self.assertEqual(cambiadas, {self.otra.pk})
+
+    def test_actualiza_la_calificacion_modificada(self):
+        sincronizar_detalles(CalificacionFactorDetalle, 'valor_factor', {
+            self.calificacion.pk: {self.f08: Decimal('0.15'), self.f09: Decimal('0.2')},
+            self.otra.pk: {self.f08: Decimal('0.5')},
+        })
+
+        self.calificacion.refresh_from_db()
+        self.otra.refresh_from_db()
+        self.assertGreater(self.calificacion.actualizado_en, self.antes)
+        # Sin cambios en sus detalles: conserva su fecha
+        self.assertEqual(self.otra.actualizado_en, self.antes)
+
+    def test_sin_actualizar_calificacion(self):
+        sincronizar_detalles(
+            CalificacionFactorDetalle, 'valor_factor', {self.calificacion.pk: {self.f08: Decimal('0.15')}},
+            actualizar_calificacion=False
+        )
 
-# Create your tests here.
+        self.calificacion.refresh_from_db()
+        self.assertEqual(self.calificacion.actualizado_en, self.antes)
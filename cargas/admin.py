@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib import messages
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from .models import Carga, CargaDetalle, HomologacionCampo
 
 
@@ -16,10 +16,10 @@ class CargaDetalleInline(admin.TabularInline):
 @admin.register(Carga)
 class CargaAdmin(admin.ModelAdmin):
     list_display = ('id_carga', 'tipo', 'nombre_archivo', 'id_corredora', 'estado', 'resumen_carga', 'porcentaje_exito', 'creado_en', 'actualizado_en', 'editar')
-    search_fields = ('nombre_archivo',)
+    search_fields = ('nombre_archivo', 'hash_archivo')
     list_filter = ('tipo', 'estado', 'id_corredora', 'id_fuente', 'creado_en')
     raw_id_fields = ('id_corredora', 'creado_por', 'id_fuente')
-    readonly_fields = ('filas_total', 'insertados', 'actualizados', 'rechazados', 'porcentaje_exito')
+    readonly_fields = ('filas_total', 'insertados', 'actualizados', 'rechazados', 'omitidos', 'porcentaje_exito', 'hash_archivo', 'staging_validado_en', 'reconciliacion', 'tiempos_por_etapa')
     inlines = [CargaDetalleInline]
     ordering = ('-creado_en',)
     date_hierarchy = 'creado_en'
@@ -28,19 +28,33 @@ class CargaAdmin(admin.ModelAdmin):
     def resumen_carga(self, obj):
         """Muestra resumen de la carga"""
         if obj.filas_total:
-            return f"{obj.insertados or 0}/{obj.filas_total}"
+            return f"{(obj.insertados or 0) + (obj.actualizados or 0)}/{obj.filas_total}"
         return '-'
     resumen_carga.short_description = 'Exitosas'
     
     def porcentaje_exito(self, obj):
         """Calcula porcentaje de éxito de la carga"""
         if obj.filas_total and obj.filas_total > 0:
-            exitosos = obj.insertados or 0
+            exitosos = (obj.insertados or 0) + (obj.actualizados or 0)
             porcentaje = (exitosos / obj.filas_total) * 100
             return f"{porcentaje:.1f}%"
         return '-'
     porcentaje_exito.short_description = '% Éxito'
     
+    def tiempos_por_etapa(self, obj):
+        """Tabla de tiempos por etapa del procesamiento (Carga.tiempos)"""
+        if not obj.tiempos:
+            return '-'
+        filas = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+            ((etapa, medidas.get('segundos'), medidas.get('cpu_segundos'), medidas.get('consultas'))
+             for etapa, medidas in obj.tiempos.items())
+        )
+        return format_html(
+            '<table><tr><th>Etapa</th><th>Segundos</th><th>CPU (s)</th><th>Consultas</th></tr>{}</table>', filas
+        )
+    tiempos_por_etapa.short_description = 'Tiempos por etapa'
+    
     def editar(self, obj):
         if obj.pk:
             return format_html('<a href="/admin/cargas/carga/{}/change/">✏️</a>', obj.pk)
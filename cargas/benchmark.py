@@ -0,0 +1,361 @@
+"""
+Benchmark de cargas masivas (python manage.py benchmark_cargas).
+
+Genera archivos CSV y XLSX reproducibles (semilla fija) con el formato de las
+plantillas de carga (templates/static/files/formato_carga_factor.csv y
+formato_carga_monto.csv), los sube por las mismas acciones de la API
+(CargaViewSet.upload_factores / upload_montos) y los procesa con el worker
+(procesar_carga) contra la BD configurada. No se usa test_carga_factores.csv
+(raíz del repo): sus columnas id_corredora / id_instrumento / id_fuente /
+id_moneda no pasan validar_encabezados (exige corredora, instrumento, fuente y
+moneda), por lo que upload_factores lo rechaza completo.
+
+Por cada caso mide el tiempo y las consultas de cada etapa (subida, validando,
+importando, reconciliando), las filas por segundo, las consultas por línea y
+el RSS máximo del caso: cada caso corre en un proceso nuevo (ejecutar_caso_aislado),
+porque ru_maxrss es el máximo de toda la vida del proceso. El resultado es un dict serializable a JSON para
+comparar versiones.
+
+Los catálogos (corredora, instrumento, fuente, moneda) se toman de la BD, por
+lo que deben existir registros. Cada línea usa una secuencia de evento nueva
+(prefijo BENCH-), así que todas las líneas son inserciones.
+"""
+import csv
+import os
+import platform
+import random
+import shutil
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import force_authenticate
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    # Windows: no hay getrusage, el RSS máximo se informa como None
+    RESOURCE_AVAILABLE = False
+
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+from calificaciones.models import Calificacion, CalificacionFactorDetalle, CalificacionMontoDetalle
+from core.models import Fuente, Moneda
+from corredoras.models import Corredora
+from instrumentos.models import Instrumento
+
+from . import importers
+from .models import Carga
+from .progreso import ESTADOS_FINALES
+from .resolvers import normalizar_clave
+
+
+PLANTILLAS = {
+    'factores': Path(settings.BASE_DIR) / 'templates' / 'static' / 'files' / 'formato_carga_factor.csv',
+    'montos': Path(settings.BASE_DIR) / 'templates' / 'static' / 'files' / 'formato_carga_monto.csv',
+}
+ACCIONES = {'factores': 'upload_factores', 'montos': 'upload_montos'}
+FORMATOS = ('csv', 'xlsx')
+PREFIJO_SECUENCIA = 'BENCH-'
+# Cantidad de factores / montos con valor por línea (el resto va en 0)
+_COLUMNAS_CON_VALOR = 3
+
+
+def encabezados_plantilla(tipo):
+    """Encabezados de la plantilla de carga (sin la línea 'sep=;')"""
+    with open(PLANTILLAS[tipo], encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f, delimiter=';'):
+            if row and not row[0].lower().startswith('sep='):
+                return row
+    raise ValueError(f'La plantilla {PLANTILLAS[tipo].name} no tiene encabezados')
+
+
+def catalogos_benchmark(maximo=20):
+    """
+    Valores de catálogo que se escriben en los archivos: nombres de corredora
+    (solo los no repetidos, igual que exige CatalogResolver), instrumentos por
+    nombre y código, nombres de fuente y códigos de moneda.
+    """
+    nombres = {}
+    for nombre in Corredora.objects.values_list('nombre', flat=True):
+        nombres.setdefault(normalizar_clave(nombre), []).append(nombre)
+    corredoras = [lista[0] for lista in nombres.values() if len(lista) == 1][:maximo]
+    instrumentos = list(
+        Instrumento.objects.exclude(codigo__isnull=True).exclude(codigo='')
+        .order_by('id_instrumento').values_list('nombre', 'codigo')[:maximo]
+    )
+    fuentes = list(Fuente.objects.order_by('id_fuente').values_list('nombre', flat=True)[:1])
+    monedas = list(Moneda.objects.order_by('id_moneda').values_list('codigo', flat=True)[:maximo])
+    faltantes = [
+        nombre for nombre, valores in (
+            ('corredora', corredoras), ('instrumento con código', instrumentos),
+            ('fuente', fuentes), ('moneda', monedas),
+        ) if not valores
+    ]
+    if faltantes:
+        raise ValueError(f'No hay registros de {", ".join(faltantes)} en la BD para generar el benchmark')
+    return {'corredoras': corredoras, 'instrumentos': instrumentos, 'fuentes': fuentes, 'monedas': monedas}
+
+
+def generar_filas(tipo, filas, semilla, catalogos, prefijo):
+    """Filas (listas en el orden de la plantilla) generadas con random.Random(semilla)"""
+    rng = random.Random(semilla)
+    fecha_base = date(2015, 1, 1)
+    columnas_valor = 30  # F08-F37 / M08-M37
+    for i in range(1, filas + 1):
+        nombre_instrumento, codigo_instrumento = rng.choice(catalogos['instrumentos'])
+        ejercicio = rng.randint(2015, 2025)
+        fecha_pago = fecha_base + timedelta(days=rng.randint(0, 3650))
+        valores = ['0'] * columnas_valor
+        for columna in rng.sample(range(columnas_valor), _COLUMNAS_CON_VALOR):
+            if tipo == 'factores':
+                # Suma de factores siempre bajo 1
+                valores[columna] = f'{Decimal(rng.randint(1, 30000000)) / Decimal(100000000):.8f}'
+            else:
+                valores[columna] = f'{Decimal(rng.randint(1, 100000000)) / 100:.2f}'
+        fila = [
+            i, '', rng.choice(catalogos['corredoras']), nombre_instrumento, codigo_instrumento,
+            catalogos['fuentes'][0], rng.choice(catalogos['monedas']), ejercicio, fecha_pago,
+            f'Benchmark {i}', 'Borrador', rng.choice(('Sí', 'No')),
+        ]
+        if tipo == 'factores':
+            fila.append('No')  # Ingreso por Montos
+        fila.extend([f'{prefijo}{i:07d}', f'{Decimal(rng.randint(0, 10000000)) / 100:.2f}'])
+        fila.extend(valores)
+        yield fila
+
+
+def escribir_csv(ruta, encabezados, filas):
+    """CSV igual a la plantilla: línea 'sep=;', separador ';' y UTF-8 con BOM"""
+    with open(ruta, 'w', encoding='utf-8-sig', newline='') as f:
+        f.write('sep=;\r\n')
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(encabezados)
+        for fila in filas:
+            writer.writerow([valor.isoformat() if isinstance(valor, date) else valor for valor in fila])
+
+
+def escribir_xlsx(ruta, encabezados, filas):
+    """XLSX en modo write_only (no mantiene la hoja en memoria); ejercicio y fecha con su tipo"""
+    if not OPENPYXL_AVAILABLE:
+        raise ValueError('openpyxl no está instalado. Ejecuta: pip install openpyxl')
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Carga')
+    ws.append(encabezados)
+    for fila in filas:
+        ws.append(fila)
+    wb.save(ruta)
+
+
+def rss_maximo_mb():
+    """RSS máximo del proceso en MB (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maximo /= 1024
+    return round(maximo / 1024, 1)
+
+
+class _ContadorConsultas:
+    """execute_wrapper que solo cuenta las consultas (no las guarda como CaptureQueriesContext)"""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+
+class _Etapas:
+    """Tiempo y consultas entre cada cambio de estado de la carga (importers._cambiar_estado)"""
+
+    def __init__(self, contador):
+        self.contador = contador
+        self.etapas = {}
+        self._actual = None
+
+    def iniciar(self, etapa):
+        self.cerrar()
+        self._actual = (etapa, time.perf_counter(), self.contador.total)
+
+    def cerrar(self):
+        if self._actual is None:
+            return
+        etapa, inicio, consultas = self._actual
+        medida = self.etapas.setdefault(etapa, {'segundos': 0.0, 'consultas': 0})
+        medida['segundos'] = round(medida['segundos'] + time.perf_counter() - inicio, 3)
+        medida['consultas'] += self.contador.total - consultas
+        self._actual = None
+
+    @contextmanager
+    def observar(self):
+        cambiar_estado = importers._cambiar_estado
+
+        def _cambiar_estado(carga, estado, **campos):
+            cambiar_estado(carga, estado, **campos)
+            if estado in ESTADOS_FINALES:
+                self.cerrar()
+            else:
+                self.iniciar(estado)
+
+        with mock.patch.object(importers, '_cambiar_estado', _cambiar_estado):
+            yield self
+
+
+def _request_subida(accion, ruta_archivo, nombre, campos):
+    """
+    POST multipart con el archivo, leído desde un archivo temporal en disco (como
+    lo recibe el servidor web): el cuerpo no se arma en memoria aunque tenga 1M de filas.
+    """
+    boundary = uuid.uuid4().hex
+    cuerpo = open(ruta_archivo.with_suffix(ruta_archivo.suffix + '.multipart'), 'w+b')
+    for campo, valor in campos.items():
+        cuerpo.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{campo}"\r\n\r\n{valor}\r\n'.encode()
+        )
+    cuerpo.write(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{nombre}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    with open(ruta_archivo, 'rb') as archivo:
+        shutil.copyfileobj(archivo, cuerpo)
+    cuerpo.write(f'\r\n--{boundary}--\r\n'.encode())
+    largo = cuerpo.tell()
+    cuerpo.seek(0)
+    request = WSGIRequest({
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': f'/api/cargas/{accion.replace("_", "-")}/',
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': cuerpo,
+        'CONTENT_TYPE': f'multipart/form-data; boundary={boundary}',
+        'CONTENT_LENGTH': str(largo),
+    })
+    return request, cuerpo
+
+
+def _reservar(id_carga):
+    """Reserva la carga recién subida (mismo UPDATE condicional que tomar_siguiente_carga)"""
+    reservada = Carga.objects.filter(
+        pk=id_carga, estado='validando', iniciado_en__isnull=True
+    ).update(iniciado_en=timezone.now())
+    if not reservada:
+        raise ValueError(f'La carga #{id_carga} fue tomada por otro worker')
+    return Carga.objects.select_related('creado_por').get(pk=id_carga)
+
+
+def ejecutar_caso(usuario, tipo, ruta_archivo, campos=None):
+    """
+    Sube el archivo por CargaViewSet y procesa la carga con procesar_carga.
+    Retorna las medidas del caso.
+    """
+    from api.views import CargaViewSet
+
+    accion = ACCIONES[tipo]
+    vista = CargaViewSet.as_view({'post': accion})
+    contador = _ContadorConsultas()
+    etapas = _Etapas(contador)
+    inicio = time.perf_counter()
+    with connection.execute_wrapper(contador), etapas.observar():
+        request, cuerpo = _request_subida(accion, ruta_archivo, ruta_archivo.name, campos or {})
+        try:
+            force_authenticate(request, user=usuario)
+            etapas.iniciar('subida')
+            response = vista(request)
+            etapas.cerrar()
+        finally:
+            cuerpo.close()
+            os.remove(cuerpo.name)
+        if response.status_code != 202:
+            raise ValueError(f'La subida de {ruta_archivo.name} respondió {response.status_code}: {response.data}')
+        id_carga = response.data['carga_id']
+
+        etapas.iniciar('validando')
+        carga = importers.procesar_carga(_reservar(id_carga))
+        etapas.cerrar()
+    segundos = time.perf_counter() - inicio
+
+    lineas = carga.filas_total or 0
+    return {
+        'carga_id': id_carga,
+        'estado': carga.estado,
+        'mensaje_error': carga.mensaje_error,
+        'lineas': lineas,
+        'insertados': carga.insertados,
+        'actualizados': carga.actualizados,
+        'rechazados': carga.rechazados,
+        'omitidos': carga.omitidos,
+        'segundos': round(segundos, 3),
+        'filas_por_segundo': round(lineas / segundos, 1) if segundos > 0 else 0,
+        'consultas': contador.total,
+        'consultas_por_linea': round(contador.total / lineas, 4) if lineas else None,
+        'rss_max_caso_mb': rss_maximo_mb(),
+        'etapas': etapas.etapas,
+        'tiempos_carga': carga.tiempos,
+    }
+
+
+def ejecutar_caso_aislado(usuario, tipo, ruta_archivo, campos=None):
+    """
+    ejecutar_caso() en un proceso nuevo ('spawn', como el pool de validación): el
+    RSS máximo informado es el de ese caso y no el de los casos anteriores.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    import django
+    # django.setup como inicializador: la tarea (y este módulo, que importa modelos) se carga después
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+    ) as pool:
+        return pool.submit(_ejecutar_caso_proceso, usuario.pk, tipo, str(ruta_archivo), campos).result()
+
+
+def _ejecutar_caso_proceso(id_usuario, tipo, ruta_archivo, campos):
+    from django.contrib.auth.models import User
+    return ejecutar_caso(User.objects.get(pk=id_usuario), tipo, Path(ruta_archivo), campos)
+
+
+def metadatos():
+    """Entorno del benchmark: BD y parámetros de carga que afectan el rendimiento"""
+    return {
+        'fecha': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'bd': connection.vendor,
+        'CARGA_BATCH_SIZE': getattr(settings, 'CARGA_BATCH_SIZE', None),
+        'CARGA_COMMIT_CADA': getattr(settings, 'CARGA_COMMIT_CADA', None),
+        'CARGA_PROCESOS': getattr(settings, 'CARGA_PROCESOS', None),
+        'CARGA_PROGRESO_CADA': getattr(settings, 'CARGA_PROGRESO_CADA', None),
+    }
+
+
+def limpiar(ids_cargas, prefijo):
+    """Elimina las cargas del benchmark (con su archivo) y las calificaciones que insertaron"""
+    for carga in Carga.objects.filter(pk__in=ids_cargas):
+        if carga.archivo:
+            carga.archivo.delete(save=False)
+    Carga.objects.filter(pk__in=ids_cargas).delete()
+    CalificacionFactorDetalle.objects.filter(id_calificacion__secuencia_evento__startswith=prefijo).delete()
+    CalificacionMontoDetalle.objects.filter(id_calificacion__secuencia_evento__startswith=prefijo).delete()
+    Calificacion.objects.filter(secuencia_evento__startswith=prefijo).delete()
@@ -0,0 +1,654 @@
+"""
+Importación de cargas masivas de calificaciones (por factores o por montos).
+
+Las acciones upload_factores/upload_montos de CargaViewSet solo guardan el
+archivo y crean la Carga en estado 'validando'. El comando
+`python manage.py procesar_cargas` toma esas cargas y las procesa con
+procesar_carga(), que recorre los estados:
+
+    validando -> importando -> reconciliando -> done / failed
+
+Mientras valida o importa, la carga puede pausarse o cancelarse (CargaViewSet.pausar /
+cancelar): el importador revisa la solicitud entre bloques y la deja en 'pausada'
+(se retoma con /reanudar/) o 'cancelada'. Con CARGA_COMMIT_CADA = 0 la transacción
+única se revierte completa; con bloques, los ya confirmados se conservan.
+"""
+import logging
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from calificaciones.models import FactorDef
+from .models import Carga, CargaDetalle, CargaLineaPreparada
+from .perfiles import obtener_perfil
+from .progreso import (
+    PublicadorProgreso, leer_solicitud, limpiar_solicitud, publicar_estado, solicitar_interrupcion
+)
+from .readers import LectorCSVMapeado, abrir_lector, cerrar_lector
+from .reconciliacion import reconciliar_carga
+from .resolvers import CatalogResolver
+from .staging import insertar_lineas, limpiar_staging, lineas_validas, validar_staging
+from .tiempos import MedidorEtapas
+from .upsert import clave_calificacion, upsert_calificaciones
+from .validacion import (
+    ValidadorLineas, crear_pool, registro_a_json, registro_desde_json, validar_bloque, validar_lineas_mapeadas
+)
+from .writers import CargaBatchWriter
+
+logger = logging.getLogger(__name__)
+
+
+class CargaInterrumpida(Exception):
+    """El importador atendió una solicitud de pausa o cancelación entre bloques"""
+
+    def __init__(self, solicitud):
+        super().__init__(solicitud)
+        self.solicitud = solicitud
+
+
+class CargaImporter:
+    """
+    Procesa las filas de un archivo sobre una Carga ya creada.
+    `formato` es 'factores' (F08-F37 ya calculados) o 'montos' (M08-M37).
+    """
+
+    def __init__(self, carga, formato=None, batch_size=None, commit_cada=None, procesos=None, tiempos=None):
+        self.carga = carga
+        # Tiempo, CPU y consultas por etapa (Carga.tiempos)
+        self.tiempos = tiempos or MedidorEtapas(carga.tiempos)
+        self.formato = formato or carga.formato
+        self.usuario = carga.creado_por
+        self.batch_size = batch_size or getattr(settings, 'CARGA_BATCH_SIZE', 500)
+        self.commit_cada = getattr(settings, 'CARGA_COMMIT_CADA', 0) if commit_cada is None else commit_cada
+        self.procesos = getattr(settings, 'CARGA_PROCESOS', 1) if procesos is None else procesos
+        self._pool = None
+        self.omitir_duplicadas = carga.omitir_duplicadas
+        # Claves de calificaciones grabadas por esta carga (una línea posterior no puede omitirse)
+        self.calificaciones_escritas = set()
+        self.insertados = 0
+        self.actualizados = 0
+        self.rechazados = 0
+        self.omitidos = 0
+        self.errores = []
+        # Avance publicado cada CARGA_PROGRESO_CADA líneas (CargaViewSet.progreso)
+        self.progreso = PublicadorProgreso(carga)
+
+        if self.formato == 'factores':
+            # Nota: F19 se llama 'F19A' en la base de datos según create_data_initial.py
+            self.factor_codigos = [f'F{i:02d}' if i != 19 else 'F19A' for i in range(8, 38)]
+            # También incluimos 'F19' para compatibilidad con archivos CSV/Excel que lo usen
+            factor_codigos_search = self.factor_codigos + ['F19']
+            self.opciones_calificacion = {
+                'ingreso_por_montos': False,
+                'observaciones_nueva': 'Carga masiva',
+                'observaciones_existente': 'Carga masiva por factores',
+            }
+        else:
+            self.factor_codigos = [f'F{i:02d}' for i in range(8, 38)]
+            factor_codigos_search = self.factor_codigos
+            self.opciones_calificacion = {
+                'ingreso_por_montos': True,
+                'observaciones_nueva': 'Carga masiva por montos',
+                'observaciones_existente': 'Carga masiva por montos',
+            }
+
+        with self.tiempos.medir('catalogos'):
+            # Mapear todos los factores disponibles desde la BD
+            self.factor_map = {}
+            for factor in FactorDef.objects.filter(codigo_factor__in=factor_codigos_search):
+                self.factor_map[factor.codigo_factor] = factor
+                # Si es F19A, también mapearlo como F19 para compatibilidad
+                if self.formato == 'factores' and factor.codigo_factor == 'F19A':
+                    self.factor_map['F19'] = factor
+            # Código en BD -> FactorDef (los registros validados guardan solo el código)
+            self.factores_bd = {factor.codigo_factor: factor for factor in self.factor_map.values()}
+
+            # Catálogos (corredora, instrumento, fuente, moneda) cargados una sola vez por archivo
+            self.catalogos = CatalogResolver()
+            # Perfil de homologación (compilado y en caché mientras sus filas no cambien)
+            perfil = obtener_perfil(carga.perfil_origen, carga.perfil_certificado) if carga.perfil_origen else None
+            self.validador = ValidadorLineas(self.formato, self.factor_codigos, self.factor_map, self.catalogos, perfil=perfil)
+
+    def validar_encabezados(self, raw_headers):
+        """Valida los encabezados obligatorios; lanza CargaError si falta alguno"""
+        with self.tiempos.medir('encabezados'):
+            self.validador.validar_encabezados(raw_headers)
+
+    def importar(self, reader):
+        """
+        Procesa todas las filas del reader, escribiendo en bloques de batch_size líneas.
+
+        Con CARGA_COMMIT_CADA > 0 cada bloque de ese tamaño se confirma en su propia
+        transacción junto con Carga.ultima_linea_confirmada; si la carga falla, puede
+        reanudarse desde ese punto. Con 0 toda la carga va en una sola transacción.
+        """
+        self._abrir_pool()
+        try:
+            self._importar_filas(*self._filas(reader))
+        finally:
+            self._cerrar_pool()
+
+    def importar_preparada(self):
+        """
+        Graba una carga confirmada desde sus líneas preparadas (CargaLineaPreparada),
+        sin volver a leer ni validar el archivo. Mismos bloques y checkpoints que importar().
+        """
+        self._importar_filas(self._lineas_preparadas(), self._registros_preparados)
+
+    def cargar_staging(self, reader):
+        """
+        Validación en la BD (Carga.validacion_sql): inserta las líneas decodificadas
+        en carga_staging por bloques de batch_size y aplica las reglas por conjunto
+        (cargas.staging). Los rechazos quedan en carga_detalle en la misma
+        transacción que Carga.staging_validado_en, por lo que al reanudar la carga
+        no se vuelve a leer el archivo.
+        """
+        if self.carga.staging_validado_en:
+            return
+        limpiar_staging(self.carga)
+        decodificar = self.validador.decodificar_linea
+        filas = enumerate(reader, start=2)
+        total = 0
+        self.progreso.publicar(0)
+        while True:
+            self._revisar_solicitud()
+            with self.tiempos.medir('lectura'):
+                bloque = list(islice(filas, self.batch_size))
+            if not bloque:
+                break
+            with self.tiempos.medir('validacion'):
+                lineas = [decodificar(linea, row) for linea, row in bloque]
+            with self.tiempos.medir('validacion_sql'), transaction.atomic():
+                insertar_lineas(self.carga, lineas)
+            total += len(bloque)
+            self.progreso.publicar(total, ultima_linea=bloque[-1][0])
+        with self.tiempos.medir('validacion_sql'), transaction.atomic():
+            rechazados = validar_staging(self.carga, self.formato)
+            self.carga.staging_validado_en = timezone.now()
+            Carga.objects.filter(pk=self.carga.pk).update(
+                staging_validado_en=self.carga.staging_validado_en,
+                filas_total=rechazados,
+                rechazados=rechazados,
+                actualizado_en=timezone.now()
+            )
+        self.carga.rechazados = rechazados
+        # La importación publica su propio avance (y rendimiento) desde cero
+        self.progreso = PublicadorProgreso(self.carga)
+
+    def importar_staging(self):
+        """
+        Graba las líneas que pasaron la validación en la BD (cargar_staging), con
+        los mismos bloques y checkpoints que importar(). Los rechazos de la
+        validación ya están en carga_detalle y se cuentan desde el inicio.
+        """
+        if not self.carga.ultima_linea_confirmada:
+            self.rechazados = self.carga.rechazados
+        self._importar_filas(lineas_validas(self.carga, self.batch_size), self._completar_staging)
+
+    def preparar(self, reader):
+        """
+        Valida todas las filas y las guarda en CargaLineaPreparada (vista previa),
+        sin escribir calificaciones. Deja en la Carga el total de líneas y las rechazadas.
+        """
+        CargaLineaPreparada.objects.filter(id_carga=self.carga).delete()
+        total = 0
+        self.progreso.publicar(0)
+        self._abrir_pool()
+        try:
+            filas, validar = self._filas(reader)
+            while True:
+                self._revisar_solicitud()
+                with self.tiempos.medir('lectura'):
+                    bloque = list(islice(filas, self.batch_size))
+                if not bloque:
+                    break
+                with self.tiempos.medir('validacion'):
+                    registros = validar(bloque)
+                total += len(registros)
+                self.rechazados += sum(1 for registro in registros if 'error' in registro)
+                with self.tiempos.medir('detalles'):
+                    CargaLineaPreparada.objects.bulk_create(
+                        [self._linea_preparada(registro) for registro in registros], batch_size=self.batch_size
+                    )
+                    Carga.objects.filter(pk=self.carga.pk).update(
+                        filas_total=total,
+                        rechazados=self.rechazados,
+                        tiempos=self.tiempos.resumen(),
+                        actualizado_en=timezone.now()
+                    )
+                self.progreso.publicar(total, ultima_linea=bloque[-1][0], rechazados=self.rechazados)
+        finally:
+            self._cerrar_pool()
+
+    def _abrir_pool(self):
+        # Con CARGA_PROCESOS > 1 la validación de cada bloque se reparte en procesos
+        self._pool = crear_pool(self.validador, self.procesos) if self.procesos > 1 else None
+
+    def _cerrar_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _filas(self, reader):
+        """
+        (linea, row) del archivo y la función que valida un bloque de ellas (linea 1 = encabezados).
+        Con un pool de procesos y un CSV en disco, el archivo se indexa una vez y cada
+        proceso lee sus propias filas desde el mmap: aquí row queda en None.
+        """
+        if self._pool is not None and isinstance(reader, LectorCSVMapeado) and reader.ruta:
+            total = reader.indexar()
+            return ((linea, None) for linea in range(2, total + 2)), partial(self._validar_mapeadas, reader)
+        return enumerate(reader, start=2), self._validar
+
+    def _validar(self, pendientes):
+        return validar_bloque(self.validador, pendientes, pool=self._pool, procesos=self.procesos)
+
+    def _validar_mapeadas(self, lector, pendientes):
+        lineas = [linea for linea, _ in pendientes]
+        return validar_lineas_mapeadas(self.validador, lector, lineas, pool=self._pool, procesos=self.procesos)
+
+    @staticmethod
+    def _registros_preparados(pendientes):
+        # Las líneas preparadas ya vienen validadas
+        return [registro for _, registro in pendientes]
+
+    def _completar_staging(self, pendientes):
+        # Las líneas de carga_staging ya pasaron las reglas de la BD
+        return self.validador.completar_staging([registro for _, registro in pendientes])
+
+    def _linea_preparada(self, registro):
+        es_valida = 'error' not in registro
+        return CargaLineaPreparada(
+            id_carga=self.carga,
+            linea=registro['linea'],
+            linea_referencia=str(registro['linea_referencia'])[:40],
+            valida=es_valida,
+            registro=registro_a_json(registro) if es_valida else None,
+            mensaje_error=None if es_valida else registro['error'],
+            hash_linea=registro['huella']
+        )
+
+    def _lineas_preparadas(self):
+        """(linea, registro) de las líneas preparadas en orden, leídas en páginas de batch_size"""
+        ultima = self.carga.ultima_linea_confirmada
+        while True:
+            pagina = list(
+                CargaLineaPreparada.objects.filter(id_carga=self.carga, linea__gt=ultima)
+                .order_by('linea')
+                .values_list('linea', 'linea_referencia', 'valida', 'registro', 'mensaje_error', 'hash_linea')
+                [:self.batch_size]
+            )
+            if not pagina:
+                return
+            for linea, linea_referencia, valida, registro, mensaje_error, hash_linea in pagina:
+                if valida:
+                    yield linea, registro_desde_json(registro, linea, linea_referencia, hash_linea)
+                else:
+                    yield linea, {
+                        'linea': linea,
+                        'linea_referencia': linea_referencia,
+                        'error': mensaje_error,
+                        'huella': hash_linea
+                    }
+            ultima = pagina[-1][0]
+
+    def _importar_filas(self, filas, validar):
+        writer = CargaBatchWriter(self.carga, batch_size=self.batch_size)
+        ya_procesadas = self._cargar_checkpoint(writer)
+        self._publicar_progreso(self.carga.ultima_linea_confirmada or None)
+        if self.commit_cada:
+            while True:
+                with transaction.atomic():
+                    if not self._importar_bloque(writer, filas, self.commit_cada, ya_procesadas, validar):
+                        break
+        else:
+            with transaction.atomic():
+                while self._importar_bloque(writer, filas, self.batch_size, ya_procesadas, validar):
+                    pass
+
+    def _cargar_checkpoint(self, writer):
+        """
+        Al reanudar una carga, recupera las líneas ya confirmadas (CargaDetalle) para
+        saltarlas, sus hashes (detección de líneas idénticas) y los contadores.
+        Retorna el conjunto de líneas ya procesadas.
+        """
+        ya_procesadas = set()
+        if not self.carga.ultima_linea_confirmada:
+            return ya_procesadas
+        ok = 0
+        detalles = CargaDetalle.objects.filter(id_carga=self.carga).values_list('linea', 'estado_linea', 'hash_linea')
+        for linea, estado_linea, hash_linea in detalles.iterator():
+            ya_procesadas.add(linea)
+            writer.registrar_hash(hash_linea, linea)
+            if estado_linea == 'ok':
+                ok += 1
+            elif estado_linea == 'omitida':
+                self.omitidos += 1
+            else:
+                self.rechazados += 1
+        # CargaDetalle no distingue inserción de actualización: se usa el contador
+        # confirmado en la misma transacción que ultima_linea_confirmada
+        self.actualizados = self.carga.actualizados
+        self.insertados = ok - self.actualizados
+        return ya_procesadas
+
+    def _importar_bloque(self, writer, filas, tamano, ya_procesadas, validar):
+        """Procesa hasta `tamano` filas; retorna False cuando ya no quedan filas"""
+        self._revisar_solicitud()
+        tiempos = self.tiempos
+        with tiempos.medir('lectura'):
+            bloque = list(islice(filas, tamano))
+        if not bloque:
+            return False
+        # 1) Validar y normalizar (sin BD; en paralelo si hay pool de procesos)
+        pendientes = [(linea, row) for linea, row in bloque if linea not in ya_procesadas]
+        with tiempos.medir('validacion'):
+            registros = validar(pendientes)
+        with tiempos.medir('upsert'):
+            # 2) Líneas sin cambios respecto de cargas anteriores (una consulta por bloque)
+            ya_cargadas = self._buscar_ya_cargadas(registros)
+            # 3) Destino de cada línea (ok, omitida o rechazo) y upsert por conjunto de las 'ok'
+            destinos = self._clasificar_registros(writer, registros, ya_cargadas)
+            ids, creadas = upsert_calificaciones(
+                [(registro['datos'], registro['suma_factores'])
+                 for registro, (estado, _) in zip(registros, destinos) if estado == 'ok'],
+                self.usuario, batch_size=self.batch_size, **self.opciones_calificacion
+            )
+        # 4) Grabar en orden de línea
+        with tiempos.medir('detalles'):
+            for registro, destino in zip(registros, destinos):
+                self._escribir_registro(writer, registro, destino, ids, creadas)
+                if self._lineas_procesadas() >= self.progreso.siguiente:
+                    self._publicar_progreso(registro['linea'])
+            writer.flush()
+            self._guardar_avance(ultima_linea=bloque[-1][0])
+        if self._lineas_procesadas() != self.progreso.publicadas:
+            self._publicar_progreso(bloque[-1][0])
+        return True
+
+    def _revisar_solicitud(self):
+        """Entre bloques: lanza CargaInterrumpida si se pidió pausar o cancelar la carga"""
+        solicitud = leer_solicitud(self.carga.pk)
+        if solicitud:
+            raise CargaInterrumpida(solicitud)
+
+    def _lineas_procesadas(self):
+        return self.insertados + self.actualizados + self.rechazados + self.omitidos
+
+    def _publicar_progreso(self, ultima_linea):
+        self.progreso.publicar(
+            self._lineas_procesadas(), ultima_linea=ultima_linea, insertados=self.insertados,
+            actualizados=self.actualizados, rechazados=self.rechazados, omitidos=self.omitidos
+        )
+
+    def _guardar_avance(self, ultima_linea):
+        self.carga.ultima_linea_confirmada = ultima_linea
+        Carga.objects.filter(pk=self.carga.pk).update(
+            filas_total=self._lineas_procesadas(),
+            insertados=self.insertados,
+            actualizados=self.actualizados,
+            rechazados=self.rechazados,
+            omitidos=self.omitidos,
+            ultima_linea_confirmada=ultima_linea,
+            tiempos=self.tiempos.resumen(),
+            actualizado_en=timezone.now()
+        )
+
+    def _buscar_ya_cargadas(self, registros):
+        """
+        Una consulta por bloque: huellas del bloque que ya produjeron una línea 'ok'
+        en otra carga y que siguen siendo la última carga aplicada a esa calificación
+        (sin modificaciones posteriores). Retorna huella -> (id_calificacion, id_carga, linea).
+        """
+        huellas = [registro['huella'] for registro in registros if 'error' not in registro]
+        if not self.omitir_duplicadas or not huellas:
+            return {}
+
+        ultimo_ok = CargaDetalle.objects.filter(
+            id_calificacion=OuterRef('id_calificacion'), estado_linea='ok'
+        ).order_by('-id_detalle').values('id_detalle')[:1]
+        previas = (
+            CargaDetalle.objects.filter(
+                hash_linea__in=huellas,
+                estado_linea='ok',
+                id_calificacion__isnull=False,
+                id_calificacion__actualizado_en__lte=F('creado_en'),
+                id_detalle=Subquery(ultimo_ok)
+            )
+            .exclude(id_carga=self.carga)
+            .values_list('hash_linea', 'id_calificacion_id', 'id_carga_id', 'linea')
+        )
+        return {huella: (id_calificacion, id_carga, linea) for huella, id_calificacion, id_carga, linea in previas}
+
+    def _clasificar_registros(self, writer, registros, ya_cargadas):
+        """
+        Decide en orden de línea, sin escribir, el destino de cada registro del bloque:
+        ('rechazo', mensaje), ('omitida', carga previa) u ('ok', clave de la calificación).
+        """
+        vistas = {}  # huella -> línea, para las líneas de este bloque aún no registradas
+        destinos = []
+        for registro in registros:
+            hash_value = registro['huella']
+            linea_repetida = writer.linea_con_hash(hash_value) or vistas.get(hash_value)
+            vistas.setdefault(hash_value, registro['linea'])
+            if linea_repetida:
+                destinos.append(('rechazo', f'Línea idéntica a la línea {linea_repetida} (línea {registro["linea_referencia"]})'))
+                continue
+            if 'error' in registro:
+                destinos.append(('rechazo', registro['error']))
+                continue
+
+            clave = clave_calificacion(registro['datos'])
+            previa = ya_cargadas.get(hash_value)
+            # Si una línea anterior de esta misma carga ya modificó la calificación,
+            # la línea debe aplicarse aunque coincida con la carga previa
+            if previa and clave not in self.calificaciones_escritas:
+                destinos.append(('omitida', previa))
+                continue
+            self.calificaciones_escritas.add(clave)
+            destinos.append(('ok', clave))
+        return destinos
+
+    def _escribir_registro(self, writer, registro, destino, ids, creadas):
+        """
+        Registra una línea ya clasificada en el orden del archivo. La primera línea
+        'ok' de una clave en `creadas` cuenta como insertada; las demás, como actualizadas.
+        """
+        linea = registro['linea']
+        hash_value = registro['huella']
+        estado, detalle = destino
+
+        if estado == 'rechazo':
+            self.rechazados += 1
+            self.errores.append({
+                'linea': linea,
+                'error': detalle
+            })
+            writer.registrar_rechazo(linea, detalle, hash_value)
+            return
+
+        if estado == 'omitida':
+            id_calificacion, id_carga, linea_previa = detalle
+            writer.registrar_omitida(
+                linea, id_calificacion, hash_value,
+                f'Sin cambios respecto de la carga #{id_carga} (línea {linea_previa})'
+            )
+            self.omitidos += 1
+            return
+
+        id_calificacion = ids[detalle]
+        if detalle in creadas:
+            creadas.discard(detalle)
+            self.insertados += 1
+        else:
+            self.actualizados += 1
+
+        # Reemplazar montos y factores de la calificación (se escriben en bloque).
+        # IMPORTANTE: Al cargar factores, eliminamos montos si existían
+        # porque ahora la calificación se alimenta solo de factores
+        factores_bd = self.factores_bd
+        writer.registrar_detalles(
+            id_calificacion,
+            [(factores_bd[codigo], valor) for codigo, valor in registro['factores']],
+            montos=[(factores_bd[codigo], monto) for codigo, monto in registro['montos']]
+        )
+        writer.registrar_ok(linea, id_calificacion, hash_value)
+
+
+# ========= COLA DE CARGAS (worker) =========
+
+def tomar_siguiente_carga():
+    """
+    Reserva la carga pendiente más antigua para este worker.
+    La reserva es un UPDATE condicional (iniciado_en IS NULL), por lo que varios
+    workers pueden correr en paralelo sin tomar la misma carga.
+    """
+    pendientes = (
+        Carga.objects.filter(estado='validando', iniciado_en__isnull=True, archivo__isnull=False)
+        .exclude(archivo='')
+        .order_by('creado_en', 'id_carga')
+        .values_list('id_carga', flat=True)[:20]
+    )
+    for id_carga in pendientes:
+        reservada = Carga.objects.filter(
+            pk=id_carga, estado='validando', iniciado_en__isnull=True
+        ).update(iniciado_en=timezone.now())
+        if reservada:
+            return Carga.objects.select_related('creado_por').get(pk=id_carga)
+    return None
+
+
+def interrumpir_carga(carga, solicitud):
+    """
+    Pausa ('pausar') o cancela ('cancelar') una carga; retorna su estado resultante,
+    o None si la carga no admite la solicitud en su estado actual.
+
+    Una carga en cola (aún sin worker) cambia de inmediato, igual que al cancelar
+    una carga pausada, preparada o fallida. Si un worker la está procesando, la
+    solicitud se atiende al terminar el bloque en curso y se retorna el estado actual.
+    """
+    ahora = timezone.now()
+    detenible = Q(estado='validando', iniciado_en__isnull=True)
+    if solicitud == 'cancelar':
+        detenible |= Q(estado__in=('pausada', 'preparada', 'failed'))
+        campos = {'estado': 'cancelada', 'finalizado_en': ahora}
+    else:
+        campos = {'estado': 'pausada'}
+    if Carga.objects.filter(detenible, pk=carga.pk).update(actualizado_en=ahora, **campos):
+        carga.refresh_from_db()
+        if carga.estado == 'cancelada':
+            _descartar_intermedios(carga)
+        publicar_estado(carga)
+        return carga.estado
+
+    carga.refresh_from_db()
+    if carga.estado not in ('validando', 'importando'):
+        return None
+    solicitar_interrupcion(carga.pk, solicitud)
+    return carga.estado
+
+
+def _descartar_intermedios(carga):
+    """Elimina las líneas preparadas y de staging de una carga cancelada (no se volverán a usar)"""
+    carga.lineas_preparadas.all().delete()
+    if carga.validacion_sql:
+        limpiar_staging(carga)
+
+
+def _cambiar_estado(carga, estado, **campos):
+    carga.estado = estado
+    for campo, valor in campos.items():
+        setattr(carga, campo, valor)
+    Carga.objects.filter(pk=carga.pk).update(estado=estado, actualizado_en=timezone.now(), **campos)
+    publicar_estado(carga)
+
+
+def procesar_carga(carga):
+    """
+    Procesa una carga reservada: valida encabezados, importa las filas y deja
+    la carga en 'done' o 'failed' (con el motivo en mensaje_error).
+
+    Con carga.preparar solo valida el archivo y deja la carga en 'preparada'
+    (vista previa); al confirmarla, se graba desde sus líneas preparadas.
+
+    Los tiempos por etapa (cargas.tiempos) quedan en carga.tiempos.
+    """
+    tiempos = MedidorEtapas(carga.tiempos)
+    try:
+        with tiempos.medir('total'):
+            estado = _ejecutar_carga(carga, tiempos)
+        _cambiar_estado(carga, estado, finalizado_en=timezone.now(), tiempos=tiempos.resumen())
+    except CargaInterrumpida as e:
+        logger.info('Carga %s detenida entre bloques (%s)', carga.pk, e.solicitud)
+        # Contadores y checkpoint confirmados (con una sola transacción, los de antes de empezar)
+        carga.refresh_from_db()
+        if e.solicitud == 'cancelar':
+            _descartar_intermedios(carga)
+            _cambiar_estado(carga, 'cancelada', finalizado_en=timezone.now(), tiempos=tiempos.resumen())
+        else:
+            _cambiar_estado(carga, 'pausada', tiempos=tiempos.resumen())
+    except Exception as e:
+        logger.exception('Error procesando carga %s', carga.pk)
+        _cambiar_estado(
+            carga, 'failed', mensaje_error=str(e), finalizado_en=timezone.now(), tiempos=tiempos.resumen()
+        )
+    # Una solicitud que llegó después del último bloque ya no aplica
+    limpiar_solicitud(carga.pk)
+    return carga
+
+
+@contextmanager
+def _abrir_archivo(carga, importer):
+    """Abre el archivo de la carga y valida sus encabezados; entrega el lector y al salir cierra ambos"""
+    with carga.archivo.open('rb') as archivo:
+        with importer.tiempos.medir('lectura'):
+            reader = abrir_lector(archivo, carga.nombre_archivo or carga.archivo.name, miembro=carga.miembro_zip)
+        try:
+            importer.validar_encabezados(reader.fieldnames or [])
+            yield reader
+        finally:
+            cerrar_lector(reader)
+
+
+def _ejecutar_carga(carga, tiempos):
+    """Etapas de procesar_carga(); retorna el estado final ('preparada' o 'done')"""
+    importer = CargaImporter(carga, tiempos=tiempos)
+    if carga.preparar:
+        with _abrir_archivo(carga, importer) as reader:
+            importer.preparar(reader)
+        return 'preparada'
+
+    preparada = carga.lineas_preparadas.exists()
+    if preparada:
+        # Carga confirmada después de la vista previa: no se vuelve a leer el archivo
+        _cambiar_estado(carga, 'importando')
+        importer.importar_preparada()
+    elif carga.validacion_sql:
+        # Validación por conjunto en la BD (cargas.staging); al reanudar no se vuelve a leer el archivo
+        if not carga.staging_validado_en:
+            with _abrir_archivo(carga, importer) as reader:
+                importer.cargar_staging(reader)
+        _cambiar_estado(carga, 'importando')
+        importer.importar_staging()
+    else:
+        with _abrir_archivo(carga, importer) as reader:
+            _cambiar_estado(carga, 'importando')
+            importer.importar(reader)
+
+    # Etapa de reconciliación: compara lo afirmado por el archivo con lo guardado (cargas.reconciliacion)
+    _cambiar_estado(carga, 'reconciliando')
+    with tiempos.medir('reconciliacion'):
+        carga.refresh_from_db()
+        carga.reconciliacion = reconciliar_carga(carga)
+        Carga.objects.filter(pk=carga.pk).update(reconciliacion=carga.reconciliacion, actualizado_en=timezone.now())
+        if preparada:
+            # Las líneas preparadas ya quedaron grabadas en calificacion y carga_detalle
+            carga.lineas_preparadas.all().delete()
+        if carga.validacion_sql:
+            limpiar_staging(carga)
+    return 'done'
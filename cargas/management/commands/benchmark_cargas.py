@@ -0,0 +1,160 @@
+"""
+Benchmark de cargas masivas.
+
+Genera archivos de factores y montos (CSV y XLSX, con semilla fija) en el formato
+de las plantillas, los sube por upload_factores / upload_montos y los procesa con
+el worker contra la BD configurada, cada caso en su propio proceso. Informa
+filas/s, consultas por línea, RSS máximo de cada caso y tiempo por etapa en
+JSON (ver cargas.benchmark).
+
+Uso:
+    python manage.py benchmark_cargas                                   # 10k, 100k y 1M filas
+    python manage.py benchmark_cargas --filas 10000 --formatos csv      # un caso rápido
+    python manage.py benchmark_cargas --salida benchmark.json           # guarda el JSON en un archivo
+"""
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from cargas import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Mide el rendimiento de las cargas masivas con archivos generados de 10k, 100k y 1M filas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filas',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Cantidad de filas de cada archivo (se ejecutan de menor a mayor)'
+        )
+        parser.add_argument(
+            '--formatos',
+            nargs='+',
+            choices=benchmark.FORMATOS,
+            default=list(benchmark.FORMATOS),
+            help='Formatos de archivo a generar'
+        )
+        parser.add_argument(
+            '--tipos',
+            nargs='+',
+            choices=list(benchmark.ACCIONES),
+            default=list(benchmark.ACCIONES),
+            help='Tipos de carga (plantilla de factores y/o de montos)'
+        )
+        parser.add_argument(
+            '--semilla',
+            type=int,
+            default=42,
+            help='Semilla de los datos generados (mismos archivos en cada ejecución)'
+        )
+        parser.add_argument(
+            '--usuario',
+            help='Usuario (auth.User) que sube los archivos; por defecto el primer superusuario activo'
+        )
+        parser.add_argument(
+            '--directorio',
+            help='Directorio para los archivos generados (por defecto uno temporal)'
+        )
+        parser.add_argument(
+            '--salida',
+            help='Archivo donde escribir el JSON de resultados (por defecto la salida estándar)'
+        )
+        parser.add_argument(
+            '--conservar',
+            action='store_true',
+            help='No elimina las cargas, calificaciones ni archivos generados al terminar'
+        )
+
+    def handle(self, *args, **options):
+        usuario = self._usuario(options['usuario'])
+        if 'xlsx' in options['formatos'] and not benchmark.OPENPYXL_AVAILABLE:
+            raise CommandError('openpyxl no está instalado. Ejecuta: pip install openpyxl')
+        try:
+            catalogos = benchmark.catalogos_benchmark()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        directorio_temporal = None
+        if options['directorio']:
+            directorio = Path(options['directorio'])
+            directorio.mkdir(parents=True, exist_ok=True)
+        else:
+            directorio_temporal = tempfile.TemporaryDirectory(prefix='benchmark_cargas_')
+            directorio = Path(directorio_temporal.name)
+
+        semilla = options['semilla']
+        prefijo = f'{benchmark.PREFIJO_SECUENCIA}{semilla}-'
+        resultado = {'metadatos': benchmark.metadatos(), 'semilla': semilla, 'casos': []}
+        ids_cargas = []
+        try:
+            for filas in sorted(options['filas']):
+                for tipo in options['tipos']:
+                    for formato in options['formatos']:
+                        caso = self._ejecutar(usuario, catalogos, directorio, semilla, prefijo, tipo, formato, filas)
+                        if caso.get('carga_id'):
+                            ids_cargas.append(caso['carga_id'])
+                        resultado['casos'].append(caso)
+        finally:
+            if not options['conservar']:
+                self.stderr.write('Eliminando cargas y calificaciones del benchmark...')
+                benchmark.limpiar(ids_cargas, prefijo)
+                if directorio_temporal is not None:
+                    directorio_temporal.cleanup()
+
+        salida = json.dumps(resultado, ensure_ascii=False, indent=2, default=str)
+        if options['salida']:
+            Path(options['salida']).write_text(salida + '\n', encoding='utf-8')
+            self.stderr.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
+        else:
+            self.stdout.write(salida)
+
+    def _usuario(self, username):
+        usuarios = User.objects.filter(is_active=True)
+        usuario = (
+            usuarios.filter(username=username).first() if username
+            else usuarios.filter(is_superuser=True).order_by('id').first()
+        )
+        if usuario is None:
+            raise CommandError(
+                f'No existe el usuario activo "{username}"' if username
+                else 'No hay superusuarios activos: indica uno con --usuario'
+            )
+        return usuario
+
+    def _ejecutar(self, usuario, catalogos, directorio, semilla, prefijo, tipo, formato, filas):
+        codigo = f'{tipo[0].upper()}{formato[0].upper()}{filas}'
+        ruta = directorio / f'benchmark_{tipo}_{filas}.{formato}'
+        caso = {'tipo': tipo, 'formato': formato, 'filas': filas}
+
+        self.stderr.write(f'Generando {ruta.name}...')
+        inicio = time.perf_counter()
+        generador = benchmark.generar_filas(tipo, filas, f'{semilla}-{codigo}', catalogos, f'{prefijo}{codigo}-')
+        encabezados = benchmark.encabezados_plantilla(tipo)
+        if formato == 'csv':
+            benchmark.escribir_csv(ruta, encabezados, generador)
+        else:
+            benchmark.escribir_xlsx(ruta, encabezados, generador)
+        caso['generacion_segundos'] = round(time.perf_counter() - inicio, 3)
+        caso['archivo_bytes'] = ruta.stat().st_size
+
+        self.stderr.write(f'Cargando {ruta.name}...')
+        try:
+            medidas = benchmark.ejecutar_caso_aislado(usuario, tipo, ruta)
+        except ValueError as e:
+            caso['error'] = str(e)
+            self.stderr.write(self.style.ERROR(f'{ruta.name}: {e}'))
+            return caso
+        caso.update(medidas)
+        estilo = self.style.SUCCESS if medidas['estado'] == 'done' else self.style.ERROR
+        self.stderr.write(estilo(
+            f'{ruta.name}: {medidas["estado"]}, {medidas["filas_por_segundo"]} filas/s, '
+            f'{medidas["consultas_por_linea"]} consultas/línea, RSS máx. del caso {medidas["rss_max_caso_mb"]} MB'
+        ))
+        return caso
@@ -0,0 +1,87 @@
+"""
+Worker de cargas masivas.
+
+Procesa las cargas creadas por upload_factores / upload_montos / preparar (estado 'validando')
+y los recálculos masivos de factores (CalificacionViewSet.recalcular_factores).
+
+Uso:
+    python manage.py procesar_cargas            # procesa en bucle (Ctrl+C para detener)
+    python manage.py procesar_cargas --una-vez  # procesa las pendientes y termina
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from calificaciones.recalculo import procesar_recalculo, tomar_siguiente_recalculo
+from cargas.importers import procesar_carga, tomar_siguiente_carga
+
+
+class Command(BaseCommand):
+    help = 'Procesa en segundo plano las cargas masivas y los recálculos de factores pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Procesa las cargas pendientes y termina (sin quedar escuchando)'
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos de espera entre consultas cuando no hay cargas pendientes'
+        )
+
+    def handle(self, *args, **options):
+        una_vez = options['una_vez']
+        intervalo = options['intervalo']
+
+        self.stdout.write('Worker de cargas iniciado')
+        try:
+            while True:
+                carga = tomar_siguiente_carga()
+                if carga is None:
+                    recalculo = tomar_siguiente_recalculo()
+                    if recalculo is not None:
+                        self._procesar_recalculo(recalculo)
+                        continue
+                    if una_vez:
+                        break
+                    time.sleep(intervalo)
+                    continue
+
+                self.stdout.write(f'Procesando carga #{carga.id_carga} ({carga.nombre_archivo})...')
+                procesar_carga(carga)
+                if carga.estado == 'done':
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Carga #{carga.id_carga} completada: {carga.insertados} insertados, '
+                        f'{carga.actualizados} actualizados, {carga.rechazados} rechazados'
+                    ))
+                elif carga.estado == 'preparada':
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Carga #{carga.id_carga} preparada para vista previa (pendiente de confirmar)'
+                    ))
+                elif carga.estado in ('pausada', 'cancelada'):
+                    self.stdout.write(self.style.WARNING(
+                        f'Carga #{carga.id_carga} {carga.estado} (hasta la línea {carga.ultima_linea_confirmada})'
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(
+                        f'Carga #{carga.id_carga} fallida: {carga.mensaje_error}'
+                    ))
+        except KeyboardInterrupt:
+            self.stdout.write('Worker detenido')
+
+    def _procesar_recalculo(self, recalculo):
+        self.stdout.write(f'Procesando recálculo de factores #{recalculo.id_recalculo}...')
+        procesar_recalculo(recalculo)
+        if recalculo.estado == 'done':
+            self.stdout.write(self.style.SUCCESS(
+                f'Recálculo #{recalculo.id_recalculo} completado: {recalculo.procesadas} procesadas, '
+                f'{recalculo.actualizadas} actualizadas, {recalculo.sin_cambios} sin cambios, '
+                f'{recalculo.rechazadas} rechazadas'
+            ))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'Recálculo #{recalculo.id_recalculo} fallido: {recalculo.mensaje_error}'
+            ))
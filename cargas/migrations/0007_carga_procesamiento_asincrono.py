@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0006_homologacioncampo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='archivo',
+            field=models.FileField(blank=True, max_length=255, null=True, upload_to='cargas/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='finalizado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='formato',
+            field=models.CharField(blank=True, choices=[('factores', 'Factores'), ('montos', 'Montos')], max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='iniciado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='mensaje_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0007_carga_procesamiento_asincrono'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='ultima_linea_confirmada',
+            field=models.IntegerField(default=0),
+        ),
+    ]
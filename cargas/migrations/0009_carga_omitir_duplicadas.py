@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0005_calificacion_ix_calif_corr_and_more'),
+        ('cargas', '0008_carga_ultima_linea_confirmada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='omitidos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='omitir_duplicadas',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='cargadetalle',
+            name='estado_linea',
+            field=models.CharField(choices=[('ok', 'OK'), ('rechazo', 'Rechazo'), ('omitida', 'Omitida')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='cargadetalle',
+            index=models.Index(fields=['hash_linea'], name='carga_detal_hash_li_af5aaa_idx'),
+        ),
+    ]
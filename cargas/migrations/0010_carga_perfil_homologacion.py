@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0009_carga_omitir_duplicadas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='perfil_certificado',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='perfil_origen',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+    ]
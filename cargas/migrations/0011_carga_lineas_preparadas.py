@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0010_carga_perfil_homologacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='preparar',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='carga',
+            name='estado',
+            field=models.CharField(choices=[('validando', 'Validando'), ('importando', 'Importando'), ('reconciliando', 'Reconciliando'), ('preparada', 'Preparada (vista previa)'), ('done', 'Completada'), ('failed', 'Fallida')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='CargaLineaPreparada',
+            fields=[
+                ('id_linea', models.BigAutoField(primary_key=True, serialize=False)),
+                ('linea', models.IntegerField()),
+                ('linea_referencia', models.CharField(blank=True, max_length=40, null=True)),
+                ('valida', models.BooleanField(default=True)),
+                ('registro', models.TextField(blank=True, null=True)),
+                ('mensaje_error', models.TextField(blank=True, null=True)),
+                ('hash_linea', models.CharField(blank=True, max_length=64, null=True)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('id_carga', models.ForeignKey(db_column='id_carga', on_delete=django.db.models.deletion.CASCADE, related_name='lineas_preparadas', to='cargas.carga')),
+            ],
+            options={
+                'verbose_name': 'Línea Preparada',
+                'verbose_name_plural': 'Líneas Preparadas',
+                'db_table': 'carga_linea_preparada',
+                'indexes': [models.Index(fields=['id_carga', 'valida', 'linea'], name='carga_linea_id_carg_f790b9_idx')],
+                'unique_together': {('id_carga', 'linea')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0011_carga_lineas_preparadas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='hash_archivo',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0012_carga_hash_archivo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='miembro_zip',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0013_carga_miembro_zip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='staging_validado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='validacion_sql',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='CargaStaging',
+            fields=[
+                ('id_staging', models.BigAutoField(primary_key=True, serialize=False)),
+                ('linea', models.IntegerField()),
+                ('linea_referencia', models.CharField(max_length=255)),
+                ('huella', models.CharField(max_length=64)),
+                ('hash_repetida', models.CharField(max_length=64)),
+                ('hash_linea', models.CharField(max_length=64)),
+                ('id_corredora_texto', models.CharField(blank=True, max_length=255, null=True)),
+                ('corredora', models.CharField(blank=True, max_length=255, null=True)),
+                ('id_corredora', models.BigIntegerField(blank=True, null=True)),
+                ('id_instrumento_texto', models.CharField(blank=True, max_length=255, null=True)),
+                ('instrumento_codigo', models.CharField(blank=True, max_length=255, null=True)),
+                ('instrumento', models.CharField(blank=True, max_length=255, null=True)),
+                ('id_instrumento', models.BigIntegerField(blank=True, null=True)),
+                ('id_fuente_texto', models.CharField(blank=True, max_length=255, null=True)),
+                ('fuente_codigo', models.CharField(blank=True, max_length=255, null=True)),
+                ('fuente', models.CharField(blank=True, max_length=255, null=True)),
+                ('id_fuente', models.BigIntegerField(blank=True, null=True)),
+                ('id_moneda_texto', models.CharField(blank=True, max_length=255, null=True)),
+                ('moneda', models.CharField(blank=True, max_length=255, null=True)),
+                ('id_moneda', models.BigIntegerField(blank=True, null=True)),
+                ('ejercicio', models.IntegerField(blank=True, null=True)),
+                ('fecha_pago', models.DateField(blank=True, null=True)),
+                ('ingreso_por_montos', models.BooleanField(default=False)),
+                ('acogido_sfut', models.BooleanField(default=False)),
+                ('estado', models.CharField(blank=True, max_length=255, null=True)),
+                ('descripcion', models.TextField(blank=True, null=True)),
+                ('valor_historico', models.DecimalField(blank=True, decimal_places=18, max_digits=38, null=True)),
+                ('secuencia_evento', models.CharField(blank=True, max_length=255, null=True)),
+                ('suma_factores', models.DecimalField(blank=True, decimal_places=18, max_digits=38, null=True)),
+                ('error_formato', models.TextField(blank=True, null=True)),
+                ('etapa_error', models.SmallIntegerField(blank=True, null=True)),
+                ('mensaje_error', models.TextField(blank=True, null=True)),
+                ('id_carga', models.ForeignKey(db_column='id_carga', on_delete=django.db.models.deletion.CASCADE, related_name='lineas_staging', to='cargas.carga')),
+            ],
+            options={
+                'verbose_name': 'Línea Staging',
+                'verbose_name_plural': 'Líneas Staging',
+                'db_table': 'carga_staging',
+                'indexes': [models.Index(fields=['id_carga', 'huella', 'linea'], name='carga_stagi_id_carg_2547e0_idx')],
+                'unique_together': {('id_carga', 'linea')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CargaStagingValor',
+            fields=[
+                ('id_valor', models.BigAutoField(primary_key=True, serialize=False)),
+                ('linea', models.IntegerField()),
+                ('codigo_factor', models.CharField(max_length=10)),
+                ('valor', models.DecimalField(decimal_places=18, max_digits=38)),
+                ('id_carga', models.ForeignKey(db_column='id_carga', on_delete=django.db.models.deletion.CASCADE, related_name='valores_staging', to='cargas.carga')),
+            ],
+            options={
+                'verbose_name': 'Valor Staging',
+                'verbose_name_plural': 'Valores Staging',
+                'db_table': 'carga_staging_valor',
+                'indexes': [models.Index(fields=['id_carga', 'linea'], name='carga_stagi_id_carg_0f32ed_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:55
+
+import auditoria.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0014_carga_staging'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='reconciliacion',
+            field=auditoria.fields.OracleJSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='carga',
+            name='snapshot_completo',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:58
+
+import auditoria.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0015_carga_reconciliacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carga',
+            name='tiempos',
+            field=auditoria.fields.OracleJSONField(blank=True, null=True),
+        ),
+    ]
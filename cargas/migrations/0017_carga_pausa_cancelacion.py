@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargas', '0016_carga_tiempos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='carga',
+            name='estado',
+            field=models.CharField(choices=[('validando', 'Validando'), ('importando', 'Importando'), ('reconciliando', 'Reconciliando'), ('preparada', 'Preparada (vista previa)'), ('pausada', 'Pausada'), ('cancelada', 'Cancelada'), ('done', 'Completada'), ('failed', 'Fallida')], max_length=20),
+        ),
+    ]
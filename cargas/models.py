@@ -1,5 +1,7 @@
 from django.db import models
 
+from auditoria.fields import OracleJSONField
+
 
 class Carga(models.Model):
     id_carga = models.BigAutoField(primary_key=True)
@@ -30,16 +32,57 @@ class Carga(models.Model):
     insertados = models.IntegerField(default=0)
     actualizados = models.IntegerField(default=0)
     rechazados = models.IntegerField(default=0)
+    omitidos = models.IntegerField(default=0)
     estado = models.CharField(
         max_length=20,
         choices=[
             ('validando', 'Validando'),
             ('importando', 'Importando'),
             ('reconciliando', 'Reconciliando'),
+            ('preparada', 'Preparada (vista previa)'),
+            ('pausada', 'Pausada'),
+            ('cancelada', 'Cancelada'),
             ('done', 'Completada'),
             ('failed', 'Fallida'),
         ]
     )
+    # Procesamiento asíncrono (comando procesar_cargas)
+    archivo = models.FileField(upload_to='cargas/%Y/%m/', null=True, blank=True, max_length=255)
+    # SHA-256 del archivo, calculado mientras se recibe (ver cargas.uploads)
+    hash_archivo = models.CharField(max_length=64, null=True, blank=True)
+    # CSV dentro del archivo .zip que procesa esta carga (una carga por CSV del zip)
+    miembro_zip = models.CharField(max_length=255, null=True, blank=True)
+    formato = models.CharField(
+        max_length=20,
+        choices=[
+            ('factores', 'Factores'),
+            ('montos', 'Montos'),
+        ],
+        null=True,
+        blank=True
+    )
+    mensaje_error = models.TextField(null=True, blank=True)
+    # Solo validar y dejar la carga en vista previa ('preparada'); se graba con /confirmar/
+    preparar = models.BooleanField(default=False)
+    # Omitir líneas idénticas (misma huella) a una línea 'ok' de una carga anterior
+    omitir_duplicadas = models.BooleanField(default=False)
+    # Validar las líneas en la BD con sentencias por conjunto sobre carga_staging (ver cargas.staging)
+    validacion_sql = models.BooleanField(default=False)
+    # Fin de la validación en la BD: sus rechazos ya están en carga_detalle (punto de reanudación)
+    staging_validado_en = models.DateTimeField(null=True, blank=True)
+    # El archivo trae todas las calificaciones de sus corredoras/ejercicios (la reconciliación informa las que faltan)
+    snapshot_completo = models.BooleanField(default=False)
+    # Resumen de la etapa 'reconciliando' (ver cargas.reconciliacion)
+    reconciliacion = OracleJSONField(null=True, blank=True)
+    # Segundos, segundos de CPU y consultas por etapa del procesamiento (ver cargas.tiempos)
+    tiempos = OracleJSONField(null=True, blank=True)
+    # Perfil de homologación (HomologacionCampo.origen / certificado) para archivos con otro formato
+    perfil_origen = models.CharField(max_length=10, null=True, blank=True)
+    perfil_certificado = models.CharField(max_length=10, null=True, blank=True)
+    iniciado_en = models.DateTimeField(null=True, blank=True)
+    finalizado_en = models.DateTimeField(null=True, blank=True)
+    # Última línea del archivo confirmada en la BD (punto de reanudación)
+    ultima_linea_confirmada = models.IntegerField(default=0)
     creado_en = models.DateTimeField(auto_now_add=True)
     actualizado_en = models.DateTimeField(auto_now=True)
 
@@ -66,6 +109,7 @@ class CargaDetalle(models.Model):
         choices=[
             ('ok', 'OK'),
             ('rechazo', 'Rechazo'),
+            ('omitida', 'Omitida'),
         ]
     )
     mensaje_error = models.TextField(null=True, blank=True)
@@ -76,6 +120,7 @@ class CargaDetalle(models.Model):
         null=True,
         blank=True
     )
+    # Huella canónica sha256 de la línea (ver cargas.importers.huella_linea)
     hash_linea = models.CharField(max_length=64, null=True, blank=True)
     creado_en = models.DateTimeField(auto_now_add=True)
     actualizado_en = models.DateTimeField(auto_now=True)
@@ -91,12 +136,44 @@ class CargaDetalle(models.Model):
         indexes = [
             # COMENTADO: Oracle crea automáticamente índice para Foreign Key id_carga
             # models.Index(fields=['id_carga', 'linea']),  # COMENTADO: Oracle crea automáticamente índice único para unique_together
+            # Búsqueda de líneas ya cargadas por huella (el índice único (id_carga, hash_linea) no sirve: parte por id_carga)
+            models.Index(fields=['hash_linea']),
         ]
 
     def __str__(self):
         return f"Línea {self.linea} - {self.estado_linea}"
 
 
+class CargaLineaPreparada(models.Model):
+    """
+    Línea ya validada de una carga preparada (vista previa). Al confirmar la carga,
+    el worker graba desde estas líneas sin volver a leer ni validar el archivo.
+    """
+    id_linea = models.BigAutoField(primary_key=True)
+    id_carga = models.ForeignKey(Carga, on_delete=models.CASCADE, db_column='id_carga', related_name='lineas_preparadas')
+    linea = models.IntegerField()
+    linea_referencia = models.CharField(max_length=40, null=True, blank=True)
+    valida = models.BooleanField(default=True)
+    # Registro validado en JSON (ver cargas.validacion.registro_a_json); vacío si la línea es inválida
+    registro = models.TextField(null=True, blank=True)
+    mensaje_error = models.TextField(null=True, blank=True)
+    hash_linea = models.CharField(max_length=64, null=True, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'carga_linea_preparada'
+        verbose_name = 'Línea Preparada'
+        verbose_name_plural = 'Líneas Preparadas'
+        unique_together = [['id_carga', 'linea']]
+        indexes = [
+            # Páginas de vista previa de líneas válidas o con error
+            models.Index(fields=['id_carga', 'valida', 'linea']),
+        ]
+
+    def __str__(self):
+        return f"Línea {self.linea} - {'válida' if self.valida else 'error'}"
+
+
 class HomologacionCampo(models.Model):
     """
     Tabla para homologar/mapear campos de diferentes formatos de archivo CSV/Excel.
@@ -142,4 +219,83 @@ class HomologacionCampo(models.Model):
             return False
         if self.vigente_hasta and self.vigente_hasta < hoy:
             return False
-        return True
\ No newline at end of file
+        return True
+
+
+class CargaStaging(models.Model):
+    """
+    Línea de una carga validada en la BD (Carga.validacion_sql), insertada tal como
+    viene en el archivo: textos recortados y números/fechas decodificados, sin
+    resolver catálogos ni aplicar reglas. cargas.staging resuelve los catálogos
+    (id_corredora, id_instrumento, ...) y deja el primer error en mensaje_error.
+    """
+    id_staging = models.BigAutoField(primary_key=True)
+    id_carga = models.ForeignKey(Carga, on_delete=models.CASCADE, db_column='id_carga', related_name='lineas_staging')
+    linea = models.IntegerField()
+    linea_referencia = models.CharField(max_length=255)
+    # huella_fila de la línea; hash_repetida es el hash con que se registra si repite otra línea
+    huella = models.CharField(max_length=64)
+    hash_repetida = models.CharField(max_length=64)
+    hash_linea = models.CharField(max_length=64)
+    # Catálogos: texto del archivo y el ID (leído del archivo y luego resuelto por la BD)
+    id_corredora_texto = models.CharField(max_length=255, null=True, blank=True)
+    corredora = models.CharField(max_length=255, null=True, blank=True)
+    id_corredora = models.BigIntegerField(null=True, blank=True)
+    id_instrumento_texto = models.CharField(max_length=255, null=True, blank=True)
+    instrumento_codigo = models.CharField(max_length=255, null=True, blank=True)
+    instrumento = models.CharField(max_length=255, null=True, blank=True)
+    id_instrumento = models.BigIntegerField(null=True, blank=True)
+    id_fuente_texto = models.CharField(max_length=255, null=True, blank=True)
+    fuente_codigo = models.CharField(max_length=255, null=True, blank=True)
+    fuente = models.CharField(max_length=255, null=True, blank=True)
+    id_fuente = models.BigIntegerField(null=True, blank=True)
+    id_moneda_texto = models.CharField(max_length=255, null=True, blank=True)
+    moneda = models.CharField(max_length=255, null=True, blank=True)
+    id_moneda = models.BigIntegerField(null=True, blank=True)
+    ejercicio = models.IntegerField(null=True, blank=True)
+    fecha_pago = models.DateField(null=True, blank=True)
+    ingreso_por_montos = models.BooleanField(default=False)
+    acogido_sfut = models.BooleanField(default=False)
+    estado = models.CharField(max_length=255, null=True, blank=True)
+    descripcion = models.TextField(null=True, blank=True)
+    valor_historico = models.DecimalField(max_digits=38, decimal_places=18, null=True, blank=True)
+    secuencia_evento = models.CharField(max_length=255, null=True, blank=True)
+    suma_factores = models.DecimalField(max_digits=38, decimal_places=18, null=True, blank=True)
+    # Error detectado al decodificar la línea y su etapa (cargas.validacion.ETAPA_*)
+    error_formato = models.TextField(null=True, blank=True)
+    etapa_error = models.SmallIntegerField(null=True, blank=True)
+    mensaje_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'carga_staging'
+        verbose_name = 'Línea Staging'
+        verbose_name_plural = 'Líneas Staging'
+        unique_together = [['id_carga', 'linea']]
+        indexes = [
+            # Líneas idénticas dentro de la carga
+            models.Index(fields=['id_carga', 'huella', 'linea']),
+        ]
+
+    def __str__(self):
+        return f"Línea {self.linea} - {'error' if self.mensaje_error else 'válida'}"
+
+
+class CargaStagingValor(models.Model):
+    """Factor (cargas por factores) o monto (cargas por montos) positivo de una línea de carga_staging"""
+    id_valor = models.BigAutoField(primary_key=True)
+    id_carga = models.ForeignKey(Carga, on_delete=models.CASCADE, db_column='id_carga', related_name='valores_staging')
+    linea = models.IntegerField()
+    # Código del factor en la BD (F08-F37, F19A); en cargas por montos, el factor del monto
+    codigo_factor = models.CharField(max_length=10)
+    valor = models.DecimalField(max_digits=38, decimal_places=18)
+
+    class Meta:
+        db_table = 'carga_staging_valor'
+        verbose_name = 'Valor Staging'
+        verbose_name_plural = 'Valores Staging'
+        indexes = [
+            models.Index(fields=['id_carga', 'linea']),
+        ]
+
+    def __str__(self):
+        return f"Línea {self.linea} - {self.codigo_factor}"
@@ -0,0 +1,143 @@
+"""
+Cálculo de factores desde montos por bloque de filas.
+
+Cada fila es un vector de 30 montos en el orden de CODIGOS_MONTO (M08-M37).
+El factor de cada columna es monto / suma de montos de la fila, a 8 decimales
+(ROUND_HALF_UP, la escala de valor_factor); la suma de factores considera solo
+las columnas con aplica_en_suma.
+
+El cálculo es exacto: los montos del bloque se llevan a enteros con una escala
+común y las divisiones se hacen con aritmética entera, sin depender del contexto
+Decimal. Con numpy (incluido en requirements.txt), el bloque se calcula como una matriz
+int64 cuando los valores caben sin desborde; si no, con enteros de Python.
+"""
+from decimal import Context, Decimal
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+CODIGOS_FACTOR = tuple(f'F{i:02d}' for i in range(8, 38))
+CODIGOS_MONTO = tuple(codigo.replace('F', 'M') for codigo in CODIGOS_FACTOR)
+DECIMALES_FACTOR = 8
+_ESCALA_FACTOR = 10 ** DECIMALES_FACTOR
+# Mayor suma de fila que permite calcular 2 * suma * 10^8 + suma en int64
+_MAX_SUMA_INT64 = (2 ** 63 - 1) // (2 * _ESCALA_FACTOR + 1)
+# Contexto sin redondeo práctico para llevar los montos a enteros
+_CONTEXTO_EXACTO = Context(prec=100)
+
+
+# Un entero escalado en 10^8 por esta unidad da el factor (producto exacto: pocos dígitos)
+_UNIDAD_FACTOR = Decimal(1).scaleb(-DECIMALES_FACTOR)
+
+
+def _decimales(texto, valor):
+    """Cantidad de decimales de un Decimal a partir de str(valor) (más barato que as_tuple())"""
+    if 'E' in texto:
+        exponente = valor.as_tuple().exponent
+        return -exponente if exponente < 0 else 0
+    punto = texto.find('.')
+    return len(texto) - punto - 1 if punto >= 0 else 0
+
+
+def _cuociente(numerador, suma):
+    """round(numerador / suma, 8) con ROUND_HALF_UP, como entero escalado en 10^8"""
+    return (2 * numerador * _ESCALA_FACTOR + suma) // (2 * suma)
+
+
+class MotorFactores:
+    """
+    Calculadora de factores para un conjunto de FactorDef (factor_map: código -> FactorDef).
+    Se construye una vez (p. ej. por archivo) y se aplica a bloques de filas con calcular().
+    """
+
+    def __init__(self, factor_map):
+        # Columnas con factor definido en la BD y máscara de aplica_en_suma
+        self.definidos = tuple(codigo in factor_map for codigo in CODIGOS_FACTOR)
+        self.aplica_en_suma = tuple(
+            codigo in factor_map and bool(factor_map[codigo].aplica_en_suma) for codigo in CODIGOS_FACTOR
+        )
+
+    def calcular(self, matriz):
+        """
+        matriz: lista de filas de 30 montos (Decimal; None, 0 o negativos = sin monto).
+        Retorna, por fila, (factores, suma_montos, suma_factores), donde factores es
+        una lista de 30 Decimal a 8 decimales (None si no hay monto o no hay factor definido).
+        """
+        # Solo se recorren los montos positivos de cada fila: (columna, monto)
+        filas = [
+            [(columna, monto) for columna, monto in enumerate(fila) if monto is not None and monto > 0]
+            for fila in matriz
+        ]
+        if not filas:
+            return []
+
+        # Escala común del bloque: los montos pasan a enteros sin pérdida
+        decimales = max(
+            (_decimales(str(monto), monto) for positivos in filas for _, monto in positivos), default=0
+        )
+        contexto = _CONTEXTO_EXACTO
+        enteros = [[int(monto.scaleb(decimales, contexto)) for _, monto in positivos] for positivos in filas]
+        if NUMPY_AVAILABLE and max(sum(fila) for fila in enteros) <= _MAX_SUMA_INT64:
+            cuocientes, sumas_factores = self._calcular_numpy(filas, enteros)
+        else:
+            cuocientes, sumas_factores = self._calcular_enteros(filas, enteros)
+
+        definidos = self.definidos
+        unidad = _UNIDAD_FACTOR
+        resultados = []
+        for positivos, cuocientes_fila, suma_factores in zip(filas, cuocientes, sumas_factores):
+            factores = [None] * len(CODIGOS_FACTOR)
+            if not positivos:
+                resultados.append((factores, Decimal('0'), Decimal('0')))
+                continue
+            for (columna, _), cuociente in zip(positivos, cuocientes_fila):
+                if definidos[columna]:
+                    factores[columna] = Decimal(cuociente) * unidad
+            suma_montos = sum(monto for _, monto in positivos)
+            resultados.append((factores, suma_montos, Decimal(suma_factores) * unidad))
+        return resultados
+
+    def _calcular_enteros(self, filas, enteros):
+        aplica_en_suma = self.aplica_en_suma
+        cuocientes = []
+        sumas_factores = []
+        for positivos, fila in zip(filas, enteros):
+            suma = sum(fila)
+            if not suma:
+                cuocientes.append([])
+                sumas_factores.append(0)
+                continue
+            doble_suma = 2 * suma
+            cuocientes.append([(2 * _ESCALA_FACTOR * monto + suma) // doble_suma for monto in fila])
+            aplicados = sum(monto for (columna, _), monto in zip(positivos, fila) if aplica_en_suma[columna])
+            sumas_factores.append(_cuociente(aplicados, suma))
+        return cuocientes, sumas_factores
+
+    def _calcular_numpy(self, filas, enteros):
+        # Matriz densa (filas x 30) armada desde los montos positivos
+        indices_fila = np.array(
+            [posicion for posicion, positivos in enumerate(filas) for _ in positivos], dtype=np.intp
+        )
+        indices_columna = np.array([columna for positivos in filas for columna, _ in positivos], dtype=np.intp)
+        montos = np.zeros((len(filas), len(CODIGOS_FACTOR)), dtype=np.int64)
+        montos[indices_fila, indices_columna] = np.array([monto for fila in enteros for monto in fila], dtype=np.int64)
+
+        sumas = montos.sum(axis=1)
+        # Filas sin montos: se divide por 1 (no tienen factores)
+        divisor = np.where(sumas == 0, 1, sumas)
+        cuocientes = (2 * montos * _ESCALA_FACTOR + divisor[:, None]) // (2 * divisor[:, None])
+        aplicados = montos @ np.array(self.aplica_en_suma, dtype=np.int64)
+        sumas_factores = (2 * aplicados * _ESCALA_FACTOR + divisor) // (2 * divisor)
+
+        # De vuelta a listas por fila, solo en las columnas con monto
+        seleccion = cuocientes[indices_fila, indices_columna].tolist()
+        por_fila = []
+        inicio = 0
+        for positivos in filas:
+            por_fila.append(seleccion[inicio:inicio + len(positivos)])
+            inicio += len(positivos)
+        return por_fila, sumas_factores.tolist()
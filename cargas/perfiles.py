@@ -0,0 +1,220 @@
+"""
+Perfiles de importación construidos desde HomologacionCampo.
+
+Un perfil agrupa las filas vigentes de homologación de un par (origen, certificado):
+cada fila traduce una columna del archivo del corredor (campo_origen) a un campo
+del formato NUAM (campo_destino, p. ej. 'corredora', 'fecha_pago', 'F08', 'M08'),
+con una transformación opcional y la marca de obligatorio.
+
+Las filas se traducen con cargas.validacion.aplicar_perfil().
+
+El perfil se compila una vez (alias normalizados y funciones de transformación) y
+queda en caché por proceso. La clave de caché incluye la fecha y una "versión" de
+las filas (cantidad y último actualizado_en): si alguien modifica, agrega o borra
+homologaciones, la siguiente carga recompila el perfil sin reiniciar el worker.
+
+Transformaciones soportadas en `transform` (se pueden encadenar con '|'):
+    mayusculas, minusculas, sin_espacios
+    decimal_coma          1.234,56 -> 1234.56
+    fecha:<formato>       p. ej. fecha:%d.%m.%Y -> YYYY-MM-DD
+    multiplicar:<n>       p. ej. multiplicar:0.01 (montos en centavos)
+    mapa:<a>=<b>,<c>=<d>  reemplazo de valores (p. ej. mapa:S=Sí,N=No)
+    por_defecto:<valor>   valor cuando la celda viene vacía
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import partial
+
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import HomologacionCampo
+from .validacion import CargaError, normalize_header
+
+
+# ========= TRANSFORMACIONES =========
+
+def _mayusculas(valor, arg):
+    return valor.upper()
+
+
+def _minusculas(valor, arg):
+    return valor.lower()
+
+
+def _sin_espacios(valor, arg):
+    return ''.join(valor.split())
+
+
+def _decimal_coma(valor, arg):
+    if not valor:
+        return valor
+    return valor.replace('.', '').replace(',', '.')
+
+
+def _fecha(valor, arg):
+    if not valor:
+        return valor
+    try:
+        return datetime.strptime(valor, arg).strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Fecha "{valor}" no tiene el formato {arg}')
+
+
+def _multiplicar(valor, arg):
+    if not valor:
+        return valor
+    try:
+        return str(Decimal(valor) * arg)
+    except InvalidOperation:
+        raise ValueError(f'"{valor}" no es un número válido')
+
+
+def _mapa(valor, arg):
+    return arg.get(valor.upper(), valor)
+
+
+def _por_defecto(valor, arg):
+    return valor or arg
+
+
+def _arg_multiplicar(arg):
+    try:
+        return Decimal(arg)
+    except InvalidOperation:
+        raise ValueError(f'multiplicar requiere un número (recibido "{arg}")')
+
+
+def _arg_mapa(arg):
+    reemplazos = {}
+    for par in arg.split(','):
+        if '=' not in par:
+            raise ValueError(f'mapa requiere pares origen=destino (recibido "{par}")')
+        origen, destino = par.split('=', 1)
+        reemplazos[origen.strip().upper()] = destino.strip()
+    return reemplazos
+
+
+# nombre -> (función, conversor del argumento o None si no lleva argumento)
+TRANSFORMACIONES = {
+    'mayusculas': (_mayusculas, None),
+    'minusculas': (_minusculas, None),
+    'sin_espacios': (_sin_espacios, None),
+    'decimal_coma': (_decimal_coma, None),
+    'fecha': (_fecha, str),
+    'multiplicar': (_multiplicar, _arg_multiplicar),
+    'mapa': (_mapa, _arg_mapa),
+    'por_defecto': (_por_defecto, str),
+}
+
+
+def compilar_transform(transform):
+    """
+    Convierte el texto de HomologacionCampo.transform en una lista de funciones
+    valor -> valor (partials de funciones de módulo, para poder enviarlas a otros procesos).
+    """
+    pasos = []
+    for paso in (transform or '').split('|'):
+        paso = paso.strip()
+        if not paso:
+            continue
+        nombre, _, arg = paso.partition(':')
+        nombre = nombre.strip().lower()
+        if nombre not in TRANSFORMACIONES:
+            raise CargaError(f'Transformación desconocida "{nombre}" en homologación')
+        funcion, conversor = TRANSFORMACIONES[nombre]
+        if conversor is None:
+            pasos.append(partial(funcion, arg=None))
+            continue
+        if not arg:
+            raise CargaError(f'La transformación "{nombre}" requiere un argumento ({nombre}:valor)')
+        try:
+            pasos.append(partial(funcion, arg=conversor(arg)))
+        except ValueError as e:
+            raise CargaError(str(e))
+    return pasos
+
+
+# ========= PERFILES =========
+
+class PerfilImportacion:
+    """Perfil compilado para un par (origen, certificado)"""
+
+    def __init__(self, origen, certificado, homologaciones):
+        self.origen = origen
+        self.certificado = certificado
+        # (campo_origen normalizado, campo_origen, campo_destino, transformaciones, obligatorio)
+        self.reglas = [
+            (
+                normalize_header(h.campo_origen), h.campo_origen, h.campo_destino,
+                compilar_transform(h.transform), h.obligatorio
+            )
+            for h in homologaciones
+            if h.campo_origen and h.campo_destino
+        ]
+
+    def __str__(self):
+        return f'{self.origen}/{self.certificado or "-"}'
+
+    def resolver(self, raw_headers):
+        """
+        Resuelve las reglas contra los encabezados de un archivo (una vez por archivo).
+        Retorna (encabezados_destino, columnas) donde columnas es una lista de
+        (columna_archivo, campo_destino, transformaciones, obligatorio, campo_origen).
+        Lanza CargaError si falta alguna columna obligatoria.
+        """
+        header_map = {normalize_header(h): h for h in raw_headers}
+        columnas = []
+        faltantes = []
+        for normalizado, campo_origen, campo_destino, transformaciones, obligatorio in self.reglas:
+            columna = header_map.get(normalizado)
+            if columna is None:
+                if obligatorio:
+                    faltantes.append(campo_origen)
+                continue
+            columnas.append((columna, campo_destino, transformaciones, obligatorio, campo_origen))
+        if faltantes:
+            raise CargaError(f'Encabezados faltantes para el perfil {self}: {", ".join(faltantes)}')
+
+        # Las columnas no homologadas se mantienen con su nombre original
+        mapeadas = {columna for columna, *_ in columnas}
+        encabezados = [h for h in raw_headers if h not in mapeadas]
+        encabezados.extend(campo_destino for _, campo_destino, *_ in columnas)
+        return encabezados, columnas
+
+
+# Caché por proceso: (origen, certificado) -> (versión, PerfilImportacion)
+_cache_perfiles = {}
+
+
+def _homologaciones_vigentes(origen, certificado, hoy):
+    return HomologacionCampo.objects.filter(
+        origen=origen,
+        certificado=certificado or None,
+    ).filter(
+        Q(vigente_desde__isnull=True) | Q(vigente_desde__lte=hoy),
+        Q(vigente_hasta__isnull=True) | Q(vigente_hasta__gte=hoy),
+    )
+
+
+def obtener_perfil(origen, certificado=None):
+    """
+    Retorna el PerfilImportacion vigente de (origen, certificado), compilándolo
+    solo si sus homologaciones cambiaron desde la última vez. Lanza CargaError si
+    no hay homologaciones vigentes.
+    """
+    hoy = timezone.localdate()
+    vigentes = _homologaciones_vigentes(origen, certificado, hoy)
+    resumen = vigentes.aggregate(cantidad=Count('id_homologacion'), ultima=Max('actualizado_en'))
+    if not resumen['cantidad']:
+        raise CargaError(f'No hay homologaciones vigentes para el perfil {origen}/{certificado or "-"}')
+
+    clave = (origen, certificado or None)
+    version = (hoy, resumen['cantidad'], resumen['ultima'])
+    en_cache = _cache_perfiles.get(clave)
+    if en_cache and en_cache[0] == version:
+        return en_cache[1]
+
+    perfil = PerfilImportacion(origen, certificado, vigentes.order_by('id_homologacion'))
+    _cache_perfiles[clave] = (version, perfil)
+    return perfil
@@ -0,0 +1,176 @@
+"""
+Progreso en vivo de las cargas masivas (CargaViewSet.progreso / progreso_stream).
+
+El importador publica el avance cada CARGA_PROGRESO_CADA líneas en el caché
+'cargas' (settings.CACHES) y no en la BD: no agrega consultas por línea y el
+avance se ve aunque el bloque en curso todavía no se confirme (COMMIT).
+El caché debe ser compartido por el worker y el servidor web (por defecto en
+disco, igual que MEDIA_ROOT; en producción puede ser Redis o Memcached).
+
+Si no hay nada publicado (la carga aún no parte, o el caché se limpió), el
+progreso se arma con los contadores de la Carga.
+
+Por el mismo caché llegan al worker las solicitudes de pausa o cancelación
+(CargaViewSet.pausar / cancelar): el importador las revisa entre bloques sin
+tocar la fila de la Carga, que una carga en una sola transacción mantiene
+bloqueada hasta el COMMIT.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.utils import timezone
+
+
+# Estados en los que el worker ya no avanza la carga
+ESTADOS_FINALES = ('done', 'failed', 'preparada', 'pausada', 'cancelada')
+# Solicitudes que el worker atiende entre bloques (ver solicitar_interrupcion)
+SOLICITUDES = ('pausar', 'cancelar')
+# Tiempo que se conserva el último progreso publicado (segundos)
+_DURACION_PROGRESO = 24 * 60 * 60
+
+
+def _cache():
+    try:
+        return caches['cargas']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _clave(id_carga):
+    return f'carga:{id_carga}:progreso'
+
+
+def _clave_solicitud(id_carga):
+    return f'carga:{id_carga}:solicitud'
+
+
+def progreso_desde_carga(carga):
+    """Progreso con los contadores ya confirmados en la Carga"""
+    inicio = carga.iniciado_en
+    fin = carga.finalizado_en or timezone.now()
+    segundos = (fin - inicio).total_seconds() if inicio else 0
+    return {
+        'carga_id': carga.id_carga,
+        'estado': carga.estado,
+        'lineas_procesadas': carga.filas_total,
+        'insertados': carga.insertados,
+        'actualizados': carga.actualizados,
+        'rechazados': carga.rechazados,
+        'omitidos': carga.omitidos,
+        'ultima_linea': carga.ultima_linea_confirmada,
+        'lineas_por_segundo': round(carga.filas_total / segundos, 1) if segundos > 0 else 0,
+        'actualizado_en': carga.actualizado_en.isoformat() if carga.actualizado_en else None,
+    }
+
+
+def leer_progreso(carga):
+    """
+    Progreso actual de una carga: el publicado por el worker mientras la carga
+    avanza, o el de la Carga si ya terminó o no hay nada publicado.
+    """
+    if carga.estado not in ESTADOS_FINALES:
+        datos = _cache().get(_clave(carga.pk))
+        if datos is not None:
+            return datos
+    return progreso_desde_carga(carga)
+
+
+def publicar_estado(carga):
+    """
+    Publica un cambio de etapa (validando, importando, reconciliando, done, ...).
+    Conserva los contadores ya publicados; si no hay, usa los de la Carga.
+    """
+    cache = _cache()
+    datos = cache.get(_clave(carga.pk)) or progreso_desde_carga(carga)
+    datos['estado'] = carga.estado
+    datos['actualizado_en'] = timezone.now().isoformat()
+    cache.set(_clave(carga.pk), datos, _DURACION_PROGRESO)
+
+
+def solicitar_interrupcion(id_carga, solicitud):
+    """Pide al worker pausar o cancelar la carga ('pausar' o 'cancelar') al terminar el bloque en curso"""
+    _cache().set(_clave_solicitud(id_carga), solicitud, _DURACION_PROGRESO)
+
+
+def leer_solicitud(id_carga):
+    """Solicitud pendiente de la carga ('pausar', 'cancelar') o None"""
+    return _cache().get(_clave_solicitud(id_carga))
+
+
+def limpiar_solicitud(id_carga):
+    _cache().delete(_clave_solicitud(id_carga))
+
+
+class PublicadorProgreso:
+    """
+    Publica el avance de una carga en curso. El importador compara las líneas
+    procesadas con `siguiente` (sin llamadas por línea) y llama a publicar()
+    cada `cada` líneas: una escritura en el caché, ninguna en la BD.
+    """
+
+    def __init__(self, carga, cada=None):
+        self.carga = carga
+        self.cada = max(1, cada or getattr(settings, 'CARGA_PROGRESO_CADA', 1000))
+        self.siguiente = 0
+        self.publicadas = None
+        # (instante, líneas) de la primera publicación, para calcular el rendimiento
+        self._inicio = None
+
+    def publicar(self, lineas_procesadas, ultima_linea=None, insertados=0, actualizados=0, rechazados=0, omitidos=0):
+        ahora = time.monotonic()
+        if self._inicio is None:
+            self._inicio = (ahora, lineas_procesadas)
+        instante_inicio, lineas_inicio = self._inicio
+        segundos = ahora - instante_inicio
+        datos = {
+            'carga_id': self.carga.pk,
+            'estado': self.carga.estado,
+            'lineas_procesadas': lineas_procesadas,
+            'insertados': insertados,
+            'actualizados': actualizados,
+            'rechazados': rechazados,
+            'omitidos': omitidos,
+            'ultima_linea': ultima_linea,
+            'lineas_por_segundo': round((lineas_procesadas - lineas_inicio) / segundos, 1) if segundos > 0 else 0,
+            'actualizado_en': timezone.now().isoformat(),
+        }
+        _cache().set(_clave(self.carga.pk), datos, _DURACION_PROGRESO)
+        self.publicadas = lineas_procesadas
+        self.siguiente = lineas_procesadas + self.cada
+
+
+def eventos_progreso(carga, cada=None, intervalo=1.0, keepalive=15.0):
+    """
+    Eventos server-sent (text/event-stream) con el progreso de una carga.
+    Envía un evento 'progreso' al conectarse, cada vez que avanzan `cada` líneas
+    o cambia la etapa, y termina después de enviar un estado final.
+    Solo lee el caché; consulta la Carga mientras no haya nada publicado.
+    """
+    cada = max(1, cada or getattr(settings, 'CARGA_PROGRESO_CADA', 1000))
+    ultimo = None
+    sin_enviar = 0.0
+    while True:
+        datos = None if carga.estado in ESTADOS_FINALES else _cache().get(_clave(carga.pk))
+        if datos is None or datos['estado'] in ESTADOS_FINALES:
+            # El resultado final se toma de la Carga (contadores confirmados)
+            carga.refresh_from_db()
+            datos = progreso_desde_carga(carga)
+        final = datos['estado'] in ESTADOS_FINALES
+        if (
+            ultimo is None or final or datos['estado'] != ultimo['estado']
+            or datos['lineas_procesadas'] - ultimo['lineas_procesadas'] >= cada
+        ):
+            yield f'event: progreso\nid: {datos["lineas_procesadas"]}\ndata: {json.dumps(datos)}\n\n'
+            ultimo = datos
+            sin_enviar = 0.0
+        if final:
+            return
+        time.sleep(intervalo)
+        sin_enviar += intervalo
+        if sin_enviar >= keepalive:
+            # Comentario SSE: mantiene abierta la conexión a través de proxies
+            yield ': keepalive\n\n'
+            sin_enviar = 0.0
@@ -0,0 +1,448 @@
+"""
+Lectura de archivos de carga masiva (CSV o Excel).
+
+abrir_lector() entrega un objeto iterable de filas (dict encabezado -> valor)
+con el atributo `fieldnames`, igual que csv.DictReader, tanto para CSV como
+para Excel. Lo usan las acciones de CargaViewSet y el worker de cargas.
+
+Un CSV que está en disco (archivo de la Carga o upload en archivo temporal) se
+lee desde un mmap del archivo (LectorCSVMapeado), sin copiarlo a memoria; su
+índice de desplazamientos por fila permite que cada proceso de validación lea
+solo su rango de filas.
+
+Los CSV comprimidos (.csv.gz, o uno o varios CSV en un .zip) se descomprimen
+por bloques a medida que se leen: el archivo expandido nunca queda completo en
+memoria ni en disco.
+
+Los archivos Parquet (requieren pyarrow) se leen por record batches y sus filas
+conservan el tipo de cada columna (int, date, Decimal de decimal128): el
+validador usa esos valores sin convertirlos desde texto.
+"""
+import codecs
+import csv
+import gzip
+import mmap
+import os
+import zipfile
+import zlib
+from array import array
+from datetime import datetime
+from itertools import chain
+
+try:
+    from openpyxl import load_workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+try:
+    import pyarrow.parquet as pq
+    from pyarrow import types as pa_types
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+EXTENSIONES_EXCEL = ('.xlsx', '.xls')
+EXTENSIONES_CSV = ('.csv',)
+EXTENSIONES_COMPRIMIDAS = ('.csv.gz', '.zip')
+EXTENSIONES_PARQUET = ('.parquet',)
+# Errores que pueden aparecer mientras se recorren las filas (contenido inválido o comprimido dañado)
+ERRORES_LECTURA = (UnicodeDecodeError, csv.Error, gzip.BadGzipFile, zipfile.BadZipFile, zlib.error, EOFError)
+
+
+def es_excel(nombre_archivo):
+    return nombre_archivo.lower().endswith(EXTENSIONES_EXCEL)
+
+
+def es_csv(nombre_archivo):
+    return nombre_archivo.lower().endswith(EXTENSIONES_CSV)
+
+
+def es_parquet(nombre_archivo):
+    return nombre_archivo.lower().endswith(EXTENSIONES_PARQUET)
+
+
+def es_comprimido(nombre_archivo):
+    return nombre_archivo.lower().endswith(EXTENSIONES_COMPRIMIDAS)
+
+
+def es_zip(nombre_archivo):
+    return nombre_archivo.lower().endswith('.zip')
+
+
+def miembros_zip(file):
+    """
+    Nombres de los CSV contenidos en un .zip, en el orden del archivo (se ignoran
+    directorios, otros tipos de archivo y los metadatos de macOS).
+    Lanza ValueError si el archivo no es un zip válido.
+    """
+    try:
+        with zipfile.ZipFile(file) as archivo_zip:
+            nombres = [
+                info.filename for info in archivo_zip.infolist()
+                if not info.is_dir() and es_csv(info.filename)
+                and not info.filename.startswith('__MACOSX/')
+                and not os.path.basename(info.filename).startswith('.')
+            ]
+    except zipfile.BadZipFile as e:
+        raise ValueError(f'El archivo zip no es válido: {e}')
+    finally:
+        file.seek(0)
+    return nombres
+
+
+class ExcelDictReader:
+    """
+    Reader-like object para compatibilidad con csv.DictReader.
+
+    Recorre la hoja en modo read_only con values_only, entregando una fila a la
+    vez: el libro nunca se carga completo en memoria.
+    """
+
+    def __init__(self, file):
+        file.seek(0)  # Resetear posición del archivo
+        self._wb = load_workbook(file, read_only=True, data_only=True)
+        ws = self._wb.active
+        # Las dimensiones guardadas en el archivo pueden venir mal (p. ej. archivos
+        # generados por otras herramientas); se recorren las filas reales
+        ws.reset_dimensions()
+        self._filas = ws.iter_rows(values_only=True)
+
+        # Leer headers (primera fila)
+        primera = next(self._filas, None) or ()
+        self.fieldnames = [str(value) if value else '' for value in primera]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Leer datos (desde la segunda fila)
+        for row in self._filas:
+            row_dict = _fila_excel_a_dict(self.fieldnames, row)
+            if any(row_dict.values()):  # Solo entregar si la fila tiene datos
+                return row_dict
+        self._wb.close()
+        raise StopIteration
+
+
+def _valor_excel_a_texto(header, value):
+    """Convierte un valor de celda a string, manejando None, fechas, números, etc."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        # Formatear fecha como YYYY-MM-DD
+        return value.strftime('%Y-%m-%d')
+    if hasattr(value, 'date') and hasattr(value.date(), 'strftime'):
+        # Para objetos date de Python
+        return value.date().strftime('%Y-%m-%d')
+    if isinstance(value, (int, float)) and header.lower() in ['ejercicio', 'linea']:
+        # Mantener números para ejercicio y linea
+        return str(int(value))
+    # Convertir a string y limpiar
+    return str(value).strip() if value else ''
+
+
+def _fila_excel_a_dict(headers, row):
+    # En modo read_only las filas pueden venir sin las celdas vacías del final
+    largo = len(row)
+    return {
+        header: _valor_excel_a_texto(header, row[idx] if idx < largo else None)
+        for idx, header in enumerate(headers)
+    }
+
+
+def _leer_excel(file):
+    return ExcelDictReader(file)
+
+
+# Filas por record batch leído de un archivo Parquet
+TAMANO_LOTE_PARQUET = 10000
+
+
+class ParquetDictReader:
+    """
+    Reader-like object para archivos Parquet, compatible con csv.DictReader.
+
+    Lee el archivo por record batches (nunca completo en memoria) y entrega las
+    filas con los valores ya tipados por pyarrow: enteros, fechas, Decimal para
+    columnas decimal128 y texto para columnas string.
+    """
+
+    def __init__(self, file, tamano_lote=TAMANO_LOTE_PARQUET):
+        file.seek(0)
+        try:
+            self._archivo = pq.ParquetFile(file)
+        except Exception as e:
+            raise ValueError(f'El archivo Parquet no es válido: {e}')
+        esquema = self._archivo.schema_arrow
+        # Columnas anidadas (listas, structs, mapas) no tienen equivalente en una fila de carga
+        for campo in esquema:
+            if pa_types.is_nested(campo.type):
+                raise ValueError(f'La columna "{campo.name}" tiene un tipo no soportado ({campo.type})')
+        self.fieldnames = list(esquema.names)
+        self._filas = (
+            fila
+            for lote in self._archivo.iter_batches(batch_size=tamano_lote)
+            for fila in lote.to_pylist()
+        )
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for fila in self._filas:
+            if any(valor is not None and valor != '' for valor in fila.values()):  # Solo filas con datos
+                return fila
+        raise StopIteration
+
+
+# Tamaño de los bloques leídos del archivo (el CSV nunca se carga completo en memoria)
+TAMANO_BLOQUE = 64 * 1024
+
+
+def _iterar_bloques(file, tamano=TAMANO_BLOQUE):
+    """Entrega el contenido binario del archivo en bloques de `tamano` bytes"""
+    if hasattr(file, 'chunks'):
+        # UploadedFile / FieldFile de Django
+        yield from file.chunks(tamano)
+        return
+    while True:
+        bloque = file.read(tamano)
+        if not bloque:
+            break
+        yield bloque
+
+
+def _iterar_lineas(file):
+    """
+    Decodifica el archivo de forma incremental (UTF-8, con o sin BOM) y entrega
+    una línea a la vez, conservando el salto de línea para que csv maneje los
+    campos entre comillas que contienen saltos.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pendiente = ''
+    for bloque in _iterar_bloques(file):
+        pendiente += decoder.decode(bloque)
+        *lineas, pendiente = pendiente.split('\n')
+        for linea in lineas:
+            yield linea + '\n'
+    pendiente += decoder.decode(b'', final=True)
+    if pendiente:
+        yield pendiente
+
+
+def _detectar_delimitador(encabezados, hint=None):
+    """Delimitador del archivo: el de la línea "sep=" o el detectado en la línea de encabezados"""
+    if hint:
+        return hint
+    sample = encabezados.rstrip('\r\n')
+    delimiter = ';' if sample.count(';') >= sample.count(',') else ','
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;')
+        delimiter = dialect.delimiter
+    except Exception:
+        pass
+    return delimiter
+
+
+def _hint_separador(primera):
+    """Delimitador de la línea "sep=;" que agrega Excel al exportar (None si no es esa línea)"""
+    if not primera.lower().startswith('sep='):
+        return None
+    hint = primera[4:].strip('\r\n')
+    return hint if hint in (',', ';') else ''
+
+
+def _leer_csv(file):
+    lineas = _iterar_lineas(file)
+    primera = next(lineas, '')
+
+    # Línea "sep=;" que agrega Excel al exportar: se descarta y se usa como delimitador
+    delimitador_hint = _hint_separador(primera)
+    if delimitador_hint is not None:
+        primera = next(lineas, '')
+
+    # El delimitador se detecta solo con la línea de encabezados
+    delimiter = _detectar_delimitador(primera, delimitador_hint)
+
+    contenido = chain([primera], lineas) if primera else lineas
+    return csv.DictReader(contenido, delimiter=delimiter)
+
+
+# ========= CSV MAPEADO EN MEMORIA =========
+
+class _LineasMapeadas:
+    """
+    Líneas (str, con su salto) de un mmap entre dos desplazamientos. `posicion`
+    queda al final de la última línea entregada, por lo que después de cada fila
+    de csv.reader indica dónde empieza la siguiente.
+    """
+
+    def __init__(self, mapa, inicio, fin):
+        self.mapa = mapa
+        self.posicion = inicio
+        self.fin = fin
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        inicio = self.posicion
+        if inicio >= self.fin:
+            raise StopIteration
+        corte = self.mapa.find(b'\n', inicio, self.fin)
+        corte = self.fin if corte < 0 else corte + 1
+        self.posicion = corte
+        return self.mapa[inicio:corte].decode('utf-8')
+
+
+def filas_mapeadas(mapa, inicio, fin, fieldnames, delimiter):
+    """Filas dict del CSV entre los desplazamientos inicio y fin (ver LectorCSVMapeado.indexar)"""
+    return csv.DictReader(_LineasMapeadas(mapa, inicio, fin), fieldnames=fieldnames, delimiter=delimiter)
+
+
+def mapear_archivo(ruta):
+    """mmap de solo lectura del archivo en `ruta`"""
+    with open(ruta, 'rb') as archivo:
+        return mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class LectorCSVMapeado:
+    """
+    Reader de un CSV en disco leído desde un mmap (mismas filas que _leer_csv).
+
+    indexar() recorre el archivo una vez y guarda el desplazamiento en bytes donde
+    empieza cada fila de datos: con `ruta`, otro proceso puede mapear el mismo
+    archivo y leer un rango de filas con filas_mapeadas() sin recibir su contenido.
+    """
+
+    def __init__(self, mapa, ruta=None):
+        self.mapa = mapa
+        self.ruta = ruta
+        self.indice = None
+        lineas = _LineasMapeadas(mapa, len(codecs.BOM_UTF8) if mapa[:3] == codecs.BOM_UTF8 else 0, len(mapa))
+
+        # Línea "sep=;" que agrega Excel al exportar: se descarta y se usa como delimitador
+        inicio_encabezados = lineas.posicion
+        primera = next(lineas, '')
+        delimitador_hint = _hint_separador(primera)
+        if delimitador_hint is not None:
+            inicio_encabezados = lineas.posicion
+            primera = next(lineas, '')
+        self.delimiter = _detectar_delimitador(primera, delimitador_hint)
+
+        # Encabezados leídos con csv (pueden tener campos entre comillas)
+        lineas.posicion = inicio_encabezados
+        self.fieldnames = next(csv.reader(lineas, delimiter=self.delimiter), None)
+        self.inicio_datos = lineas.posicion
+
+    def __iter__(self):
+        return iter(filas_mapeadas(self.mapa, self.inicio_datos, len(self.mapa), self.fieldnames, self.delimiter))
+
+    def close(self):
+        """Libera el mmap (en Windows, hasta cerrarlo el archivo no se puede borrar)"""
+        self.mapa.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def indexar(self):
+        """
+        Arma el índice de filas de datos: indice[i] es el byte donde empieza la
+        fila i (las filas vacías, que csv.DictReader salta, no cuentan) y el último
+        valor es el fin del archivo. Retorna la cantidad de filas.
+        """
+        lineas = _LineasMapeadas(self.mapa, self.inicio_datos, len(self.mapa))
+        indice = array('q')
+        inicio = lineas.posicion
+        for fila in csv.reader(lineas, delimiter=self.delimiter):
+            if fila:
+                indice.append(inicio)
+            inicio = lineas.posicion
+        indice.append(len(self.mapa))
+        self.indice = indice
+        return len(indice) - 1
+
+
+def cerrar_lector(reader):
+    """Libera los recursos de un reader de abrir_lector() (el mmap de un LectorCSVMapeado, el zip de un LectorZip)"""
+    if isinstance(reader, (LectorCSVMapeado, LectorZip)):
+        reader.close()
+
+
+def _ruta_en_disco(file):
+    """Ruta del archivo en disco (archivo temporal del upload o archivo de la Carga), o None"""
+    if hasattr(file, 'temporary_file_path'):
+        return file.temporary_file_path()
+    nombre = getattr(getattr(file, 'file', file), 'name', None)
+    return nombre if isinstance(nombre, str) and os.path.isfile(nombre) else None
+
+
+def _leer_csv_mapeado(file):
+    """LectorCSVMapeado del archivo si está en disco y no está vacío; None si no"""
+    ruta = _ruta_en_disco(file)
+    if ruta is None or not os.path.getsize(ruta):
+        return None
+    return LectorCSVMapeado(mapear_archivo(ruta), ruta=ruta)
+
+
+class LectorZip:
+    """
+    Reader del CSV de un miembro de un .zip (mismas filas que _leer_csv),
+    descomprimido mientras se lee. close() cierra el miembro y el zip.
+    """
+
+    def __init__(self, file, miembro):
+        self.archivo_zip = zipfile.ZipFile(file)
+        try:
+            self.contenido = self.archivo_zip.open(miembro)
+            self.reader = _leer_csv(self.contenido)
+            self.fieldnames = self.reader.fieldnames
+        except BaseException:
+            self.close()
+            raise
+
+    def __iter__(self):
+        return iter(self.reader)
+
+    def close(self):
+        if getattr(self, 'contenido', None) is not None:
+            self.contenido.close()
+        self.archivo_zip.close()
+
+
+def _leer_zip(file, miembro=None):
+    """CSV `miembro` del zip (o su único CSV), descomprimido mientras se lee"""
+    if miembro is None:
+        miembros = miembros_zip(file)
+        if len(miembros) != 1:
+            raise ValueError(f'El zip debe contener un archivo CSV (contiene {len(miembros)})')
+        miembro = miembros[0]
+    return LectorZip(file, miembro)
+
+
+def abrir_lector(file, nombre_archivo, miembro=None):
+    """
+    Abre un archivo de carga (CSV, Excel, Parquet, .csv.gz o .zip) y retorna un reader de filas dict.
+    En un .zip, `miembro` es el CSV a leer (si se omite, el zip debe tener uno solo).
+    Lanza ValueError si la extensión no es soportada.
+    """
+    if miembro is not None or es_zip(nombre_archivo):
+        return _leer_zip(file, miembro)
+    if es_parquet(nombre_archivo):
+        if not PYARROW_AVAILABLE:
+            raise ValueError('pyarrow no está instalado. Ejecuta: pip install pyarrow')
+        return ParquetDictReader(file)
+    if nombre_archivo.lower().endswith('.csv.gz'):
+        return _leer_csv(gzip.GzipFile(fileobj=file, mode='rb'))
+    if es_excel(nombre_archivo):
+        if not OPENPYXL_AVAILABLE:
+            raise ValueError('openpyxl no está instalado. Ejecuta: pip install openpyxl')
+        return _leer_excel(file)
+    if es_csv(nombre_archivo):
+        return _leer_csv_mapeado(file) or _leer_csv(file)
+    raise ValueError('El archivo debe ser CSV, Excel (.xlsx, .xls), Parquet o CSV comprimido (.csv.gz, .zip)')
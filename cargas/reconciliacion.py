@@ -0,0 +1,157 @@
+"""
+Reconciliación de una carga masiva (etapa 'reconciliando').
+
+Después de importar, compara lo que afirmaba el archivo con lo que quedó en
+calificacion y calificacion_factor_detalle para las mismas corredoras y
+ejercicios. Cada control es una consulta por conjunto (subconsultas EXISTS y
+agregados en la BD), sin recorrer calificaciones en Python:
+
+- Calificaciones definidas por más de una línea 'ok' del archivo (gana la última).
+- Calificaciones modificadas después de la carga (por otra carga o a mano).
+- Con validación en la BD (Carga.validacion_sql): líneas cuyos factores o montos
+  guardados no coinciden con los del archivo (carga_staging_valor).
+- Deriva de la suma de factores: factor_actualizacion distinto de la suma de los
+  factores guardados que aplican en suma, y sumas guardadas mayores que 1.
+- Con Carga.snapshot_completo: calificaciones de las mismas corredoras y
+  ejercicios que no vienen en el archivo (o cuya línea fue rechazada).
+
+El resumen queda en Carga.reconciliacion (ver reconciliar_carga()).
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+from django.utils import timezone
+
+from calificaciones.models import Calificacion, CalificacionFactorDetalle, CalificacionMontoDetalle, FactorDef
+from .models import CargaDetalle, CargaStagingValor
+
+# IDs de calificaciones de ejemplo que se guardan por cada control
+EJEMPLOS = 20
+
+_DECIMAL = DecimalField(max_digits=38, decimal_places=18)
+
+
+def _tolerancia():
+    """Diferencia máxima aceptada entre dos sumas o valores (valor_factor se guarda a 8 decimales)"""
+    return Decimal(str(getattr(settings, 'CARGA_RECONCILIACION_TOLERANCIA', '0.000001')))
+
+
+def _control(queryset, campo='pk'):
+    """{'total', 'ejemplos'} de un control: cantidad y los primeros IDs (por `campo`)"""
+    return {
+        'total': queryset.count(),
+        'ejemplos': list(queryset.order_by(campo).values_list(campo, flat=True)[:EJEMPLOS]),
+    }
+
+
+def reconciliar_carga(carga):
+    """Ejecuta los controles sobre una carga ya importada y retorna su resumen (dict serializable en JSON)"""
+    tolerancia = _tolerancia()
+    # Líneas que afirman una calificación: grabadas ('ok') o sin cambios respecto de una carga previa ('omitida')
+    lineas = CargaDetalle.objects.filter(
+        id_carga=carga, estado_linea__in=('ok', 'omitida'), id_calificacion__isnull=False
+    )
+    en_archivo = lineas.filter(id_calificacion=OuterRef('pk'))
+    calificaciones = Calificacion.objects.filter(Exists(en_archivo))
+
+    resumen = {
+        'calificaciones': calificaciones.count(),
+        'corredoras_ejercicios': [
+            list(par) for par in
+            calificaciones.order_by('id_corredora_id', 'ejercicio')
+            .values_list('id_corredora_id', 'ejercicio').distinct()
+        ],
+        'snapshot_completo': carga.snapshot_completo,
+    }
+
+    # Varias líneas 'ok' para la misma clave natural: la calificación queda con la última
+    resumen['definidas_mas_de_una_vez'] = _control(
+        lineas.filter(estado_linea='ok').order_by().values('id_calificacion')
+        .annotate(lineas=Count('id_detalle')).filter(lineas__gt=1),
+        campo='id_calificacion'
+    )
+
+    # Modificadas después de la última línea de esta carga que las afirma
+    ultima_linea = en_archivo.order_by('-creado_en').values('creado_en')[:1]
+    resumen['modificadas_despues'] = _control(
+        calificaciones.annotate(afirmada_en=Subquery(ultima_linea)).filter(actualizado_en__gt=F('afirmada_en'))
+    )
+
+    # Valores del archivo distintos de los guardados (solo si la carga tiene carga_staging)
+    resumen['valores_distintos'] = _valores_distintos(carga, tolerancia)
+
+    # Deriva de la suma de factores respecto de los factores guardados
+    suma_guardada = (
+        CalificacionFactorDetalle.objects.filter(id_calificacion=OuterRef('pk'), id_factor__aplica_en_suma=True)
+        .order_by().values('id_calificacion').annotate(total=Sum('valor_factor')).values('total')
+    )
+    con_suma = calificaciones.annotate(
+        suma_detalle=Coalesce(Subquery(suma_guardada), Value(Decimal('0')), output_field=_DECIMAL)
+    )
+    resumen['suma_desalineada'] = _control(
+        con_suma.annotate(
+            deriva=Abs(
+                Coalesce('factor_actualizacion', Value(Decimal('0')), output_field=_DECIMAL) - F('suma_detalle'),
+                output_field=_DECIMAL
+            )
+        ).filter(deriva__gt=tolerancia)
+    )
+    resumen['suma_excede_1'] = _control(con_suma.filter(suma_detalle__gt=Decimal('1') + tolerancia))
+
+    # Archivo con todas las calificaciones de sus corredoras/ejercicios: las que no vienen faltan
+    resumen['faltantes'] = None
+    if carga.snapshot_completo:
+        mismo_periodo = calificaciones.filter(id_corredora=OuterRef('id_corredora'), ejercicio=OuterRef('ejercicio'))
+        resumen['faltantes'] = _control(
+            Calificacion.objects.filter(Exists(mismo_periodo)).exclude(Exists(en_archivo))
+        )
+
+    resumen['con_diferencias'] = any(
+        control['total'] for control in (
+            resumen['definidas_mas_de_una_vez'], resumen['modificadas_despues'], resumen['valores_distintos'],
+            resumen['suma_desalineada'], resumen['suma_excede_1'], resumen['faltantes'],
+        ) if control
+    )
+    resumen['reconciliado_en'] = timezone.now().isoformat()
+    return resumen
+
+
+def _valores_distintos(carga, tolerancia):
+    """
+    Líneas 'ok' cuyos factores (cargas por factores) o montos (por montos) guardados
+    no coinciden con los del archivo: un valor del archivo sin detalle guardado igual,
+    o un detalle guardado que el archivo no trae. None si la carga no tiene staging.
+    """
+    if not carga.validacion_sql or not CargaStagingValor.objects.filter(id_carga=carga).exists():
+        return None
+    if carga.formato == 'factores':
+        modelo, campo = CalificacionFactorDetalle, 'valor_factor'
+    else:
+        modelo, campo = CalificacionMontoDetalle, 'valor_monto'
+
+    valores_linea = CargaStagingValor.objects.filter(id_carga=carga, linea=OuterRef('linea'))
+    # Valor del archivo (de un factor definido en factor_def) sin un detalle guardado igual
+    guardado_igual = modelo.objects.filter(**{
+        'id_calificacion': OuterRef(OuterRef('id_calificacion')),
+        'id_factor__codigo_factor': OuterRef('codigo_factor'),
+        f'{campo}__gte': OuterRef('valor') - Value(tolerancia, output_field=_DECIMAL),
+        f'{campo}__lte': OuterRef('valor') + Value(tolerancia, output_field=_DECIMAL),
+    })
+    falta_guardado = valores_linea.filter(
+        codigo_factor__in=FactorDef.objects.values('codigo_factor')
+    ).exclude(Exists(guardado_igual))
+    # Detalle guardado que el archivo no trae
+    en_linea = CargaStagingValor.objects.filter(
+        id_carga=carga, linea=OuterRef(OuterRef('linea')), codigo_factor=OuterRef('id_factor__codigo_factor')
+    )
+    sobra_guardado = modelo.objects.filter(
+        id_calificacion=OuterRef('id_calificacion'), **{f'{campo}__isnull': False}
+    ).exclude(Exists(en_linea))
+
+    return _control(
+        CargaDetalle.objects.filter(id_carga=carga, estado_linea='ok', id_calificacion__isnull=False)
+        .filter(Exists(falta_guardado) | Exists(sobra_guardado)),
+        campo='linea'
+    )
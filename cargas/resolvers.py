@@ -0,0 +1,145 @@
+"""
+Resolución de catálogos en memoria para las cargas masivas.
+
+Las cargas de factores y montos necesitan resolver corredora, instrumento,
+fuente y moneda en cada línea. En lugar de consultar Oracle línea a línea,
+CatalogResolver lee cada catálogo una sola vez por carga y lo indexa en
+diccionarios por id, código (en mayúsculas) y nombre normalizado.
+
+Los mensajes de error son los mismos que entregaba la resolución por ORM,
+para que el detalle de rechazos (carga_detalle) no cambie.
+"""
+from core.models import Fuente, Moneda
+from corredoras.models import Corredora
+from instrumentos.models import Instrumento
+
+
+def normalizar_clave(valor):
+    """Normaliza un código o nombre para compararlo sin distinguir mayúsculas (equivale a __iexact)"""
+    return (valor or '').strip().upper()
+
+
+def _parse_id(valor):
+    """Convierte un ID leído del archivo a entero; retorna None si no es numérico"""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+class CatalogResolver:
+    """
+    Índices en memoria de los catálogos usados por las cargas masivas.
+
+    Solo guarda IDs (no instancias de modelos): los valores resueltos se asignan
+    con los campos *_id de Calificacion y el objeto puede copiarse a otros procesos.
+    """
+
+    def __init__(self):
+        # Corredoras: por ID y por nombre (el nombre NO es único en la BD)
+        self.corredoras_ids = set()
+        self.corredoras_por_nombre = {}
+        for id_corredora, nombre in Corredora.objects.order_by('id_corredora').values_list('id_corredora', 'nombre'):
+            self.corredoras_ids.add(id_corredora)
+            self.corredoras_por_nombre.setdefault(normalizar_clave(nombre), []).append(id_corredora)
+
+        # Instrumentos: por ID, código y nombre (el nombre puede repetirse)
+        self.instrumentos_ids = set()
+        self.instrumentos_por_codigo = {}
+        self.instrumentos_por_nombre = {}
+        for id_instrumento, codigo, nombre in Instrumento.objects.order_by('id_instrumento').values_list('id_instrumento', 'codigo', 'nombre'):
+            self.instrumentos_ids.add(id_instrumento)
+            self.instrumentos_por_codigo.setdefault(normalizar_clave(codigo), id_instrumento)
+            self.instrumentos_por_nombre.setdefault(normalizar_clave(nombre), []).append(id_instrumento)
+
+        # Fuentes: por ID, código y nombre (si el nombre se repite se usa la primera, igual que .first())
+        self.fuentes_ids = set()
+        self.fuentes_por_codigo = {}
+        self.fuentes_por_nombre = {}
+        for id_fuente, codigo, nombre in Fuente.objects.order_by('id_fuente').values_list('id_fuente', 'codigo', 'nombre'):
+            self.fuentes_ids.add(id_fuente)
+            self.fuentes_por_codigo.setdefault(normalizar_clave(codigo), id_fuente)
+            self.fuentes_por_nombre.setdefault(normalizar_clave(nombre), id_fuente)
+
+        # Monedas: por ID y código ISO-4217
+        self.monedas_ids = set()
+        self.monedas_por_codigo = {}
+        for id_moneda, codigo in Moneda.objects.order_by('id_moneda').values_list('id_moneda', 'codigo'):
+            self.monedas_ids.add(id_moneda)
+            self.monedas_por_codigo.setdefault(normalizar_clave(codigo), id_moneda)
+
+    def resolver_corredora(self, id_raw, nombre, linea_referencia):
+        """Retorna id_corredora a partir del ID o del nombre informado en la línea"""
+        if id_raw:
+            id_corredora = _parse_id(id_raw)
+            if id_corredora not in self.corredoras_ids:
+                raise ValueError(f'Corredora con ID {id_raw} no existe (línea {linea_referencia})')
+            return id_corredora
+
+        if not nombre:
+            raise ValueError(f'Corredora es obligatoria (línea {linea_referencia})')
+        candidatas = self.corredoras_por_nombre.get(normalizar_clave(nombre))
+        if not candidatas:
+            raise ValueError(f'Corredora "{nombre}" no existe (línea {linea_referencia})')
+        if len(candidatas) > 1:
+            raise ValueError(f'Corredora "{nombre}" no es única (línea {linea_referencia})')
+        return candidatas[0]
+
+    def resolver_instrumento(self, id_raw, codigo, nombre, linea_referencia):
+        """Retorna id_instrumento a partir del ID, del código o del nombre (en ese orden)"""
+        if id_raw:
+            id_instrumento = _parse_id(id_raw)
+            if id_instrumento not in self.instrumentos_ids:
+                raise ValueError(f'Instrumento con ID {id_raw} no existe (línea {linea_referencia})')
+            return id_instrumento
+
+        if codigo:
+            id_instrumento = self.instrumentos_por_codigo.get(normalizar_clave(codigo))
+            if id_instrumento is None:
+                raise ValueError(f'Instrumento con código "{codigo}" no existe (línea {linea_referencia})')
+            return id_instrumento
+
+        if not nombre:
+            raise ValueError(f'Instrumento es obligatorio (línea {linea_referencia})')
+        candidatos = self.instrumentos_por_nombre.get(normalizar_clave(nombre))
+        if not candidatos:
+            raise ValueError(f'Instrumento "{nombre}" no existe (línea {linea_referencia})')
+        if len(candidatos) > 1:
+            raise ValueError(f'Instrumento "{nombre}" no es único, especifique el código (línea {linea_referencia})')
+        return candidatos[0]
+
+    def resolver_fuente(self, id_raw, codigo, nombre, linea_referencia):
+        """Retorna id_fuente a partir del ID, del código o del nombre (en ese orden)"""
+        if id_raw:
+            id_fuente = _parse_id(id_raw)
+            if id_fuente not in self.fuentes_ids:
+                raise ValueError(f'Fuente con ID {id_raw} no existe (línea {linea_referencia})')
+            return id_fuente
+
+        if codigo:
+            id_fuente = self.fuentes_por_codigo.get(normalizar_clave(codigo))
+            if id_fuente is None:
+                raise ValueError(f'Fuente con código "{codigo}" no existe (línea {linea_referencia})')
+            return id_fuente
+
+        if not nombre:
+            raise ValueError(f'Fuente es obligatoria (línea {linea_referencia})')
+        id_fuente = self.fuentes_por_nombre.get(normalizar_clave(nombre))
+        if id_fuente is None:
+            raise ValueError(f'Fuente "{nombre}" no existe (línea {linea_referencia})')
+        return id_fuente
+
+    def resolver_moneda(self, id_raw, codigo, linea_referencia):
+        """Retorna id_moneda a partir del ID o del código ISO-4217"""
+        if id_raw:
+            id_moneda = _parse_id(id_raw)
+            if id_moneda not in self.monedas_ids:
+                raise ValueError(f'Moneda con ID {id_raw} no existe (línea {linea_referencia})')
+            return id_moneda
+
+        if not codigo:
+            raise ValueError(f'Moneda es obligatoria (línea {linea_referencia})')
+        id_moneda = self.monedas_por_codigo.get(normalizar_clave(codigo))
+        if id_moneda is None:
+            raise ValueError(f'Moneda "{codigo}" no existe (línea {linea_referencia})')
+        return id_moneda
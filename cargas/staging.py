@@ -0,0 +1,393 @@
+"""
+Validación de las cargas masivas en la BD (Carga.validacion_sql).
+
+En lugar de resolver catálogos y aplicar las reglas línea a línea en Python
+(cargas.validacion), el importador inserta las líneas decodificadas en
+carga_staging y carga_staging_valor (insertar_lineas: un executemany con
+arreglos de binds por bloque) y validar_staging() aplica las reglas a toda la
+carga con unas pocas sentencias por conjunto:
+
+1. Líneas idénticas a una línea anterior del archivo.
+2. Catálogos: un UPDATE resuelve corredora, instrumento, fuente y moneda (por
+   ID, código o nombre) y un UPDATE por catálogo marca los que no existen.
+3. Ejercicio y fecha de pago, ingreso por montos, estado, valor histórico y
+   factores o montos.
+4. Cargas por factores: suma de factores <= 1 y factores definidos en factor_def.
+
+Las reglas van en el mismo orden que ValidadorLineas.parsear_linea() y cada una
+solo marca líneas que aún no tienen error, por lo que cada línea queda con el
+mismo mensaje que en la validación en Python, salvo el número de 'Suma de
+factores excede 1': la BD lo escribe sin la escala de las celdas del archivo
+(6 en vez de 6.0). Los rechazos se insertan en
+carga_detalle con un INSERT ... SELECT; las líneas válidas se leen por páginas
+(lineas_validas) y se graban con el mismo upsert y escritura en bloque de siempre.
+
+Los números y fechas se decodifican al insertar (como los tipos por campo de un
+SQL*Loader); los factores de las cargas por montos se siguen calculando con
+MotorFactores, que redondea igual que el resto de la aplicación.
+"""
+from django.db import connection
+from django.utils import timezone
+
+from calificaciones.models import FactorDef
+from core.models import Fuente, Moneda
+from corredoras.models import Corredora
+from instrumentos.models import Instrumento
+from .models import CargaDetalle, CargaStaging, CargaStagingValor
+from .motor_factores import CODIGOS_FACTOR
+from .validacion import CAMPOS_STAGING, ESTADOS_CALIFICACION, ETAPA_FECHAS, ETAPA_PERFIL, ETAPA_VALORES
+
+
+# Resolución de cada catálogo, en el orden de CatalogResolver:
+# (modelo, columna destino, columna con el ID escrito, mensaje si el ID no existe,
+#  vías [(columna de staging, campo del catálogo, nombre único, mensaje si no existe,
+#         mensaje si no es único)], mensaje si no viene ninguna vía)
+CATALOGOS = [
+    (Corredora, 'id_corredora', 'id_corredora_texto', 'Corredora con ID {} no existe', [
+        ('corredora', 'nombre', True, 'Corredora "{}" no existe', 'Corredora "{}" no es única'),
+    ], 'Corredora es obligatoria'),
+    (Instrumento, 'id_instrumento', 'id_instrumento_texto', 'Instrumento con ID {} no existe', [
+        ('instrumento_codigo', 'codigo', False, 'Instrumento con código "{}" no existe', None),
+        ('instrumento', 'nombre', True, 'Instrumento "{}" no existe',
+         'Instrumento "{}" no es único, especifique el código'),
+    ], 'Instrumento es obligatorio'),
+    (Fuente, 'id_fuente', 'id_fuente_texto', 'Fuente con ID {} no existe', [
+        ('fuente_codigo', 'codigo', False, 'Fuente con código "{}" no existe', None),
+        ('fuente', 'nombre', False, 'Fuente "{}" no existe', None),
+    ], 'Fuente es obligatoria'),
+    (Moneda, 'id_moneda', 'id_moneda_texto', 'Moneda con ID {} no existe', [
+        ('moneda', 'codigo', False, 'Moneda "{}" no existe', None),
+    ], 'Moneda es obligatoria'),
+]
+
+# Posición de cada factor en los vectores de montos de MotorFactores
+_POSICION_FACTOR = {codigo: posicion for posicion, codigo in enumerate(CODIGOS_FACTOR)}
+
+
+class _Sql:
+    """Nombres de tablas y columnas ya citados para el motor de la conexión"""
+
+    def __init__(self):
+        self.qn = connection.ops.quote_name
+        self.staging = self.qn(CargaStaging._meta.db_table)
+        self.valores = self.qn(CargaStagingValor._meta.db_table)
+        self.factor_def = self.qn(FactorDef._meta.db_table)
+
+    def col(self, modelo, campo):
+        return self.qn(modelo._meta.get_field(campo).column)
+
+    def s(self, campo):
+        """Columna de la línea de carga_staging que se está actualizando"""
+        return f'{self.staging}.{self.col(CargaStaging, campo)}'
+
+    def en_linea(self):
+        """Sufijo ' (línea X)' de los mensajes (params: ' (línea ', ')')"""
+        return f' || %s || {self.s("linea_referencia")} || %s', [' (línea ', ')']
+
+    def texto(self, mensaje, campo):
+        """Mensaje 'texto {} texto' con el valor de la columna en {}"""
+        prefijo, sufijo = mensaje.split('{}')
+        return f'%s || {self.s(campo)} || %s', [prefijo, sufijo]
+
+
+def insertar_lineas(carga, lineas):
+    """
+    Inserta un bloque de líneas decodificadas [(campos, valores), ...]
+    (ValidadorLineas.decodificar_linea): un executemany por tabla.
+    """
+    if not lineas:
+        return
+    sql = _Sql()
+    campos = [CargaStaging._meta.get_field(nombre) for nombre in CAMPOS_STAGING]
+    # Solo fechas, decimales y booleanos necesitan adaptarse al motor
+    adaptar = [
+        campo.get_internal_type() in ('DateField', 'DecimalField', 'BooleanField') for campo in campos
+    ]
+    filas = []
+    valores = []
+    campo_valor = CargaStagingValor._meta.get_field('valor')
+    for fila, valores_linea in lineas:
+        filas.append([carga.pk] + [
+            campo.get_db_prep_save(fila[campo.attname], connection) if adapta else fila[campo.attname]
+            for campo, adapta in zip(campos, adaptar)
+        ])
+        valores.extend(
+            (carga.pk, fila['linea'], codigo, campo_valor.get_db_prep_save(valor, connection))
+            for codigo, valor in valores_linea
+        )
+
+    columnas = [sql.col(CargaStaging, 'id_carga')] + [sql.qn(campo.column) for campo in campos]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {sql.staging} ({", ".join(columnas)}) VALUES ({", ".join(["%s"] * len(columnas))})',
+            filas
+        )
+        if valores:
+            columnas_valor = [sql.col(CargaStagingValor, campo) for campo in ('id_carga', 'linea', 'codigo_factor', 'valor')]
+            cursor.executemany(
+                f'INSERT INTO {sql.valores} ({", ".join(columnas_valor)}) VALUES (%s, %s, %s, %s)',
+                valores
+            )
+
+
+def validar_staging(carga, formato):
+    """
+    Aplica las reglas de validación a las líneas de la carga en carga_staging y
+    registra los rechazos en carga_detalle. Retorna la cantidad de rechazos.
+    Debe ejecutarse en una transacción (junto con el avance de la carga).
+    """
+    sql = _Sql()
+    with connection.cursor() as cursor:
+        marcar = _Marcador(cursor, carga, sql)
+        _marcar_repetidas(marcar, sql)
+        marcar.error_formato(ETAPA_PERFIL)
+        _resolver_catalogos(cursor, carga, sql)
+        for catalogo in CATALOGOS:
+            _marcar_catalogo(marcar, sql, *catalogo)
+        marcar.error_formato(ETAPA_FECHAS)
+        if formato == 'factores':
+            mensaje, params = sql.en_linea()
+            marcar(f'%s{mensaje}', ['Ingreso por montos debe ser "No" para cargas por factor', *params],
+                   f'{sql.s("ingreso_por_montos")} = %s', [True])
+        _marcar_estado(marcar, sql)
+        marcar.error_formato(ETAPA_VALORES)
+        if formato == 'factores':
+            _marcar_suma_factores(cursor, carga, marcar, sql)
+            _marcar_factores_inexistentes(marcar, sql)
+        return _insertar_rechazos(cursor, carga, sql)
+
+
+class _Marcador:
+    """UPDATE que deja `mensaje` en las líneas de la carga sin error que cumplen `condicion`"""
+
+    def __init__(self, cursor, carga, sql):
+        self.cursor = cursor
+        self.carga = carga
+        self.sql = sql
+
+    def __call__(self, mensaje, params_mensaje, condicion, params_condicion=(), asignaciones=''):
+        sql = self.sql
+        self.cursor.execute(
+            f'UPDATE {sql.staging} SET {sql.col(CargaStaging, "mensaje_error")} = {mensaje}{asignaciones} '
+            f'WHERE {sql.s("id_carga")} = %s AND {sql.s("mensaje_error")} IS NULL AND ({condicion})',
+            [*params_mensaje, self.carga.pk, *params_condicion]
+        )
+
+    def error_formato(self, etapa):
+        """Errores de decodificación de la etapa (ETAPA_*), en su lugar dentro del orden de las reglas"""
+        self(self.sql.s('error_formato'), [], f'{self.sql.s("etapa_error")} = %s', [etapa])
+
+
+def _marcar_repetidas(marcar, sql):
+    """Líneas idénticas (misma huella) a una línea anterior de la carga"""
+    # Primera línea con la misma huella (índice (id_carga, huella, linea))
+    primera = (
+        f'(SELECT MIN(t.{sql.col(CargaStaging, "linea")}) FROM {sql.staging} t '
+        f'WHERE t.{sql.col(CargaStaging, "id_carga")} = {sql.s("id_carga")} '
+        f'AND t.{sql.col(CargaStaging, "huella")} = {sql.s("huella")})'
+    )
+    en_linea, params = sql.en_linea()
+    marcar(
+        f'%s || {primera}{en_linea}',
+        ['Línea idéntica a la línea ', *params],
+        f'{sql.s("linea")} > {primera}',
+        # Se registra con un hash distinto para no violar unique (id_carga, hash_linea)
+        asignaciones=f', {sql.col(CargaStaging, "hash_linea")} = {sql.s("hash_repetida")}'
+    )
+
+
+def _comparar_nombre(sql, modelo, alias, campo_catalogo, campo_staging):
+    """Comparación sin distinguir mayúsculas (como normalizar_clave)"""
+    return f'UPPER(TRIM({alias}.{sql.col(modelo, campo_catalogo)})) = UPPER({sql.s(campo_staging)})'
+
+
+def _resolver_catalogos(cursor, carga, sql):
+    """Un UPDATE: ID de corredora, instrumento, fuente y moneda de cada línea sin error (NULL si no existe)"""
+    asignaciones = []
+    params = []
+    for modelo, destino, id_texto, _, vias, _ in CATALOGOS:
+        tabla = sql.qn(modelo._meta.db_table)
+        pk = sql.qn(modelo._meta.pk.column)
+        casos = [
+            f'WHEN {sql.s(id_texto)} IS NOT NULL THEN '
+            f'(SELECT c.{pk} FROM {tabla} c WHERE c.{pk} = {sql.s(destino)})'
+        ]
+        for campo_staging, campo_catalogo, unico, _, _ in vias:
+            # Nombre: debe identificar una sola fila; código: la de menor ID
+            having = ' HAVING COUNT(*) = %s' if unico else ''
+            casos.append(
+                f'WHEN {sql.s(campo_staging)} IS NOT NULL THEN '
+                f'(SELECT MIN(c.{pk}) FROM {tabla} c WHERE '
+                f'{_comparar_nombre(sql, modelo, "c", campo_catalogo, campo_staging)}{having})'
+            )
+            if unico:
+                params.append(1)
+        asignaciones.append(f'{sql.col(CargaStaging, destino)} = CASE {" ".join(casos)} END')
+    cursor.execute(
+        f'UPDATE {sql.staging} SET {", ".join(asignaciones)} '
+        f'WHERE {sql.s("id_carga")} = %s AND {sql.s("mensaje_error")} IS NULL',
+        [*params, carga.pk]
+    )
+
+
+def _marcar_catalogo(marcar, sql, modelo, destino, id_texto, mensaje_id, vias, mensaje_obligatorio):
+    """Líneas cuyo catálogo no se resolvió, con el mensaje de CatalogResolver"""
+    tabla = sql.qn(modelo._meta.db_table)
+    texto, params = sql.texto(mensaje_id, id_texto)
+    casos = [f'WHEN {sql.s(id_texto)} IS NOT NULL THEN {texto}']
+    for campo_staging, campo_catalogo, unico, mensaje_no_existe, mensaje_no_unico in vias:
+        no_existe, params_no_existe = sql.texto(mensaje_no_existe, campo_staging)
+        if unico:
+            no_unico, params_no_unico = sql.texto(mensaje_no_unico, campo_staging)
+            casos.append(
+                f'WHEN {sql.s(campo_staging)} IS NOT NULL THEN CASE WHEN EXISTS ('
+                f'SELECT 1 FROM {tabla} c WHERE {_comparar_nombre(sql, modelo, "c", campo_catalogo, campo_staging)}'
+                f') THEN {no_unico} ELSE {no_existe} END'
+            )
+            params.extend(params_no_unico + params_no_existe)
+        else:
+            casos.append(f'WHEN {sql.s(campo_staging)} IS NOT NULL THEN {no_existe}')
+            params.extend(params_no_existe)
+    en_linea, params_en_linea = sql.en_linea()
+    marcar(
+        f'(CASE {" ".join(casos)} ELSE %s END){en_linea}',
+        [*params, mensaje_obligatorio, *params_en_linea],
+        f'{sql.s(destino)} IS NULL'
+    )
+
+
+def _marcar_estado(marcar, sql):
+    """Estado fuera de ESTADOS_CALIFICACION (vacío = borrador)"""
+    estado = f'LOWER({sql.s("estado")})'
+    en_linea, params = sql.en_linea()
+    marcar(
+        f'%s || {estado} || %s{en_linea}',
+        ['Estado "', '" inválido', *params],
+        f'{sql.s("estado")} IS NOT NULL AND {estado} NOT IN ({", ".join(["%s"] * len(ESTADOS_CALIFICACION))})',
+        ESTADOS_CALIFICACION
+    )
+
+
+def _valores_linea(sql):
+    """FROM de los factores de la línea de carga_staging que se está actualizando"""
+    return (
+        f'FROM {sql.valores} v WHERE v.{sql.col(CargaStagingValor, "id_carga")} = {sql.s("id_carga")} '
+        f'AND v.{sql.col(CargaStagingValor, "linea")} = {sql.s("linea")}'
+    )
+
+
+def _marcar_suma_factores(cursor, carga, marcar, sql):
+    """Suma de los factores que aplican en suma (factor_def.aplica_en_suma) mayor que 1"""
+    codigo = sql.col(FactorDef, 'codigo_factor')
+    cursor.execute(
+        f'UPDATE {sql.staging} SET {sql.col(CargaStaging, "suma_factores")} = COALESCE(('
+        f'SELECT SUM(v.{sql.col(CargaStagingValor, "valor")}) {_valores_linea(sql)} '
+        f'AND EXISTS (SELECT 1 FROM {sql.factor_def} f WHERE f.{codigo} = v.{sql.col(CargaStagingValor, "codigo_factor")} '
+        f'AND f.{sql.col(FactorDef, "aplica_en_suma")} = %s)'
+        f'), 0) WHERE {sql.s("id_carga")} = %s AND {sql.s("mensaje_error")} IS NULL',
+        [True, carga.pk]
+    )
+    en_linea, params = sql.en_linea()
+    marcar(
+        f'%s || {sql.s("suma_factores")}{en_linea}',
+        ['Suma de factores excede 1: ', *params],
+        f'{sql.s("suma_factores")} > 1'
+    )
+
+
+def _marcar_factores_inexistentes(marcar, sql):
+    """Factores del archivo que no están en factor_def (se informa el primero)"""
+    inexistentes = (
+        f'{_valores_linea(sql)} AND NOT EXISTS (SELECT 1 FROM {sql.factor_def} f '
+        f'WHERE f.{sql.col(FactorDef, "codigo_factor")} = v.{sql.col(CargaStagingValor, "codigo_factor")})'
+    )
+    en_linea, params = sql.en_linea()
+    marcar(
+        f'%s || (SELECT MIN(v.{sql.col(CargaStagingValor, "codigo_factor")}) {inexistentes}) || %s{en_linea}',
+        ['Factor ', ' no encontrado en la base de datos', *params],
+        f'EXISTS (SELECT 1 {inexistentes})'
+    )
+
+
+def _insertar_rechazos(cursor, carga, sql):
+    """INSERT ... SELECT de las líneas con error en carga_detalle; retorna cuántas son"""
+    columnas = [
+        sql.col(CargaDetalle, campo) for campo in (
+            'id_carga', 'linea', 'estado_linea', 'mensaje_error', 'hash_linea', 'creado_en', 'actualizado_en'
+        )
+    ]
+    ahora = CargaDetalle._meta.get_field('creado_en').get_db_prep_save(timezone.now(), connection)
+    cursor.execute(
+        f'INSERT INTO {sql.qn(CargaDetalle._meta.db_table)} ({", ".join(columnas)}) '
+        f'SELECT {sql.s("id_carga")}, {sql.s("linea")}, %s, {sql.s("mensaje_error")}, {sql.s("hash_linea")}, %s, %s '
+        f'FROM {sql.staging} WHERE {sql.s("id_carga")} = %s AND {sql.s("mensaje_error")} IS NOT NULL',
+        ['rechazo', ahora, ahora, carga.pk]
+    )
+    return cursor.rowcount
+
+
+def lineas_validas(carga, batch_size):
+    """
+    (linea, registro) de las líneas sin error de carga_staging, en orden y por
+    páginas de batch_size, desde Carga.ultima_linea_confirmada. Los registros se
+    completan con ValidadorLineas.completar_staging().
+    """
+    ultima = carga.ultima_linea_confirmada
+    while True:
+        pagina = list(
+            CargaStaging.objects.filter(id_carga=carga, mensaje_error__isnull=True, linea__gt=ultima)
+            .order_by('linea')
+            .values_list(
+                'linea', 'linea_referencia', 'huella', 'id_corredora', 'id_instrumento', 'id_fuente', 'id_moneda',
+                'ejercicio', 'fecha_pago', 'acogido_sfut', 'descripcion', 'estado', 'valor_historico',
+                'secuencia_evento', 'suma_factores',
+            )[:batch_size]
+        )
+        if not pagina:
+            return
+        valores = {}
+        for linea, codigo, valor in (
+            CargaStagingValor.objects.filter(id_carga=carga, linea__gte=pagina[0][0], linea__lte=pagina[-1][0])
+            .values_list('linea', 'codigo_factor', 'valor')
+        ):
+            valores.setdefault(linea, []).append((codigo, valor.normalize()))
+        for (linea, linea_referencia, huella, id_corredora, id_instrumento, id_fuente, id_moneda, ejercicio,
+             fecha_pago, acogido_sfut, descripcion, estado, valor_historico, secuencia_evento, suma_factores) in pagina:
+            registro = {
+                'datos': {
+                    'id_corredora': id_corredora,
+                    'id_instrumento': id_instrumento,
+                    'id_fuente': id_fuente,
+                    'id_moneda': id_moneda,
+                    'ejercicio': ejercicio,
+                    'fecha_pago': fecha_pago,
+                    'acogido_sfut': acogido_sfut,
+                    'descripcion': descripcion or '',
+                    'estado': (estado or '').lower() or 'borrador',
+                    'valor_historico': valor_historico.normalize() if valor_historico is not None else None,
+                    'secuencia_evento': secuencia_evento or '',
+                },
+                'linea': linea,
+                'linea_referencia': linea_referencia,
+                # huella_fila: la de la línea si MotorFactores la rechaza (completar_staging la reemplaza)
+                'huella': huella,
+            }
+            if carga.formato == 'factores':
+                registro.update({
+                    'suma_factores': suma_factores,
+                    'factores': sorted(valores.get(linea, [])),
+                    'montos': [],
+                })
+            else:
+                vector = [None] * len(CODIGOS_FACTOR)
+                for codigo, monto in valores.get(linea, []):
+                    vector[_POSICION_FACTOR[codigo]] = monto
+                registro['vector_montos'] = vector
+            yield linea, registro
+        ultima = pagina[-1][0]
+
+
+def limpiar_staging(carga):
+    """Elimina las líneas de la carga en carga_staging (al terminar o antes de volver a insertarlas)"""
+    CargaStagingValor.objects.filter(id_carga=carga).delete()
+    CargaStaging.objects.filter(id_carga=carga).delete()
@@ -1,3 +1,447 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import random
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from calificaciones.detalles import sincronizar_detalles
+from calificaciones.models import Calificacion, CalificacionFactorDetalle, CalificacionMontoDetalle
+from calificaciones.tests import FACTORES_EN_SUMA, crear_catalogos
+
+from . import motor_factores
+from .importers import CargaImporter, procesar_carga, tomar_siguiente_carga
+from .models import Carga, CargaDetalle
+from .motor_factores import CODIGOS_FACTOR, CODIGOS_MONTO, MotorFactores
+from .readers import ERRORES_LECTURA, PYARROW_AVAILABLE, abrir_lector, cerrar_lector, miembros_zip
+
+if PYARROW_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+
+ESCALA_FACTOR = Decimal('1e-8')
+
+COLUMNAS_FACTORES = (
+    'Linea', 'Corredora', 'Instrumento', 'Instrumento Código', 'Fuente', 'Moneda', 'Ejercicio', 'Fecha Pago',
+    'Descripción', 'Estado', 'Acogido SFUT', 'Ingreso por Montos', 'Secuencia Evento', 'Valor Histórico',
+) + CODIGOS_FACTOR
+COLUMNAS_MONTOS = (
+    'Linea', 'ID', 'Corredora', 'Instrumento', 'Instrumento Código', 'Fuente', 'Moneda', 'Ejercicio', 'Fecha Pago',
+    'Descripción', 'Estado', 'Acogido SFUT', 'Secuencia Evento', 'Valor Histórico',
+) + CODIGOS_MONTO
+# Valores de una línea válida; cada línea de prueba indica solo lo que cambia
+LINEA_BASE = {
+    'Corredora': 'Banco de Chile', 'Instrumento': 'ADP Bolsa', 'Fuente': 'Superintendencia de Valores y Seguros',
+    'Moneda': 'CLP', 'Ejercicio': '2024', 'Fecha Pago': '2025-11-06', 'Descripción': 'desc', 'Estado': 'Borrador',
+    'Acogido SFUT': 'Sí', 'Ingreso por Montos': 'No', 'Valor Histórico': '10.5',
+}
+LINEAS_FACTORES = [
+    {'Secuencia Evento': '0001', 'F08': '0.1', 'F20': '0.2'},
+    {'Secuencia Evento': '0002', 'Instrumento': '', 'Instrumento Código': 'cl0001234567', 'Moneda': 'clp',
+     'Fecha Pago': '06-11-2025', 'Estado': 'validada', 'F08': '0.3'},
+    {'Secuencia Evento': '0003', 'Corredora': 'Banco Inexistente', 'F08': '0.1'},
+    {'Secuencia Evento': '0004', 'Fuente': 'Fuente X', 'F08': '0.1'},
+    {'Secuencia Evento': '0005', 'Moneda': 'XXX', 'F08': '0.1'},
+    {'Secuencia Evento': '0006', 'Ejercicio': 'abc', 'F08': '0.1'},
+    {'Secuencia Evento': '0007', 'Fecha Pago': '2025/11/06', 'F08': '0.1'},
+    {'Secuencia Evento': '0008', 'Estado': 'raro', 'F08': '0.1'},
+    {'Secuencia Evento': '0009', 'F08': '0.7', 'F09': '0.6'},
+    {'Secuencia Evento': '0010', 'F08': 'x'},
+    {'Secuencia Evento': '0011', 'Valor Histórico': 'abc', 'F08': '0.1'},
+    {'Secuencia Evento': '0012', 'Instrumento': 'NOPE', 'F08': '0.1'},
+    {'Secuencia Evento': '0001', 'F08': '0.1', 'F20': '0.2'},
+    {'Secuencia Evento': '0013', 'Corredora': '', 'F08': '0.1'},
+]
+LINEAS_MONTOS = [
+    {'Secuencia Evento': '0001', 'M08': '1000.00', 'M09': '2000.00', 'M10': '1500.00'},
+    {'Secuencia Evento': '0002', 'M08': 'x', 'M09': '2000.00'},
+    {'Secuencia Evento': '0003', 'M08': '-5', 'M09': '2000.00', 'M20': '1'},
+    {'Secuencia Evento': '0004', 'Moneda': 'ZZZ', 'M08': '1000.00'},
+    {'Secuencia Evento': '0005', 'ID': '999999', 'M08': '1000.00'},
+    {'Secuencia Evento': '0006', 'ID': 'abc', 'M08': '1000.00'},
+    {'Secuencia Evento': '0007', 'M08': '1000.123456789', 'M20': '1'},
+    {'Secuencia Evento': '0001', 'M08': '1000.00', 'M09': '2000.00', 'M10': '1500.00'},
+    {'Secuencia Evento': '0008', 'M20': '300', 'M21': '0.5'},
+]
+
+
+def archivo_csv(columnas, lineas):
+    """Contenido de un CSV de carga (separador ;); cada línea es un dict que completa LINEA_BASE"""
+    salida = io.StringIO()
+    writer = csv.DictWriter(salida, fieldnames=columnas, delimiter=';', extrasaction='ignore')
+    writer.writeheader()
+    for numero, linea in enumerate(lineas, start=1):
+        writer.writerow({'Linea': numero, **LINEA_BASE, **linea})
+    return salida.getvalue().encode('utf-8')
+
+
+def archivo_zip(miembros):
+    """Contenido de un .zip con los archivos de `miembros` (nombre -> bytes)"""
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED) as archivo:
+        for nombre, contenido in miembros.items():
+            archivo.writestr(nombre, contenido)
+    return salida.getvalue()
+
+
+@contextmanager
+def deshacer():
+    """Ejecuta el bloque y deshace todo lo que escribió en la BD"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+class MotorFactoresTests(SimpleTestCase):
+    def setUp(self):
+        # F19 sin FactorDef: su monto suma pero no tiene factor
+        self.factor_map = {
+            codigo: SimpleNamespace(aplica_en_suma=codigo in FACTORES_EN_SUMA)
+            for codigo in CODIGOS_FACTOR if codigo != 'F19'
+        }
+        self.motor = MotorFactores(self.factor_map)
+
+    def _esperado(self, fila):
+        """Cálculo de referencia: (monto / suma).quantize(1e-8, ROUND_HALF_UP) por columna"""
+        positivos = [(codigo, monto) for codigo, monto in zip(CODIGOS_FACTOR, fila) if monto is not None and monto > 0]
+        suma = sum((monto for _, monto in positivos), Decimal('0'))
+        factores = [None] * len(CODIGOS_FACTOR)
+        if not suma:
+            return factores, suma, Decimal('0')
+        # Precisión suficiente para que el cociente no se redondee antes de quantize
+        with localcontext() as contexto:
+            contexto.prec = 60
+            for codigo, monto in positivos:
+                if codigo in self.factor_map:
+                    factores[CODIGOS_FACTOR.index(codigo)] = (monto / suma).quantize(ESCALA_FACTOR, ROUND_HALF_UP)
+            aplicados = sum(monto for codigo, monto in positivos if codigo in FACTORES_EN_SUMA)
+            suma_factores = (aplicados / suma).quantize(ESCALA_FACTOR, ROUND_HALF_UP)
+        return factores, suma, suma_factores
+
+    def _fila(self, **montos):
+        return [montos.get(codigo) for codigo in CODIGOS_MONTO]
+
+    def _comparar(self, filas):
+        for numpy in (True, False):
+            with self.subTest(numpy=numpy), mock.patch.object(
+                motor_factores, 'NUMPY_AVAILABLE', numpy and motor_factores.NUMPY_AVAILABLE
+            ):
+                for fila, resultado in zip(filas, self.motor.calcular(filas)):
+                    self.assertEqual(resultado, self._esperado(fila), fila)
+
+    def _filas_aleatorias(self, semilla, max_digitos, escalas):
+        aleatorio = random.Random(semilla)
+        return [
+            [
+                Decimal(aleatorio.randint(-5, 10 ** aleatorio.randint(1, max_digitos))).scaleb(-aleatorio.choice(escalas))
+                if aleatorio.random() < 0.4 else None
+                for _ in CODIGOS_MONTO
+            ]
+            for _ in range(300)
+        ]
+
+    def test_coincide_con_division_redondeada(self):
+        # Montos chicos: el bloque cabe en int64 (matriz numpy); grandes: enteros de Python
+        self._comparar(self._filas_aleatorias(7, 6, (0, 2)))
+        self._comparar(self._filas_aleatorias(8, 12, (0, 2, 4)))
+
+    def test_montos_que_no_caben_en_int64(self):
+        self._comparar([
+            self._fila(M08=Decimal('123456789012345.6789'), M09=Decimal('0.0001')),
+            self._fila(M10=Decimal('999999999999999.9999'), M20=Decimal('1')),
+        ])
+
+    def test_redondeo_half_up(self):
+        # 1/512 = 0.001953125: con ROUND_HALF_EVEN quedaría 0.00195312
+        [(factores, suma_montos, _)] = self.motor.calcular([self._fila(M08=Decimal('1'), M09=Decimal('511'))])
+
+        self.assertEqual(factores[0], Decimal('0.00195313'))
+        self.assertEqual(factores[1], Decimal('0.99804688'))
+        self.assertEqual(suma_montos, Decimal('512'))
+
+    def test_montos_no_positivos_y_factores_sin_definir(self):
+        fila = self._fila(M08=Decimal('-10'), M09=Decimal('0'), M10=Decimal('3'), M19=Decimal('1'))
+        [(factores, suma_montos, suma_factores)] = self.motor.calcular([fila])
+
+        self.assertEqual(suma_montos, Decimal('4'))
+        self.assertEqual(factores[:3], [None, None, Decimal('0.75')])
+        self.assertIsNone(factores[CODIGOS_FACTOR.index('F19')])
+        self.assertEqual(suma_factores, Decimal('0.75'))
+
+    def test_fila_sin_montos(self):
+        self.assertEqual(
+            self.motor.calcular([self._fila()]),
+            [([None] * len(CODIGOS_FACTOR), Decimal('0'), Decimal('0'))]
+        )
+        self.assertEqual(self.motor.calcular([]), [])
+
+
+class LectoresTests(SimpleTestCase):
+    def setUp(self):
+        self.contenido = archivo_csv(COLUMNAS_MONTOS, LINEAS_MONTOS)
+        self.filas = self._leer(io.BytesIO(self.contenido), 'carga.csv')
+
+    def _leer(self, archivo, nombre, miembro=None):
+        reader = abrir_lector(archivo, nombre, miembro=miembro)
+        try:
+            return reader.fieldnames, list(reader)
+        finally:
+            cerrar_lector(reader)
+
+    def test_csv_gz(self):
+        archivo = io.BytesIO(gzip.compress(self.contenido))
+
+        self.assertEqual(self._leer(archivo, 'carga.csv.gz'), self.filas)
+
+    def test_gz_truncado(self):
+        archivo = io.BytesIO(gzip.compress(self.contenido)[:60])
+
+        with self.assertRaises(ERRORES_LECTURA):
+            self._leer(archivo, 'carga.csv.gz')
+
+    def test_zip_con_varios_csv(self):
+        otro = archivo_csv(COLUMNAS_MONTOS, LINEAS_MONTOS[:2])
+        archivo = io.BytesIO(archivo_zip({
+            'a/uno.csv': self.contenido, '__MACOSX/a/._uno.csv': b'x', 'leeme.txt': b'hola', 'dos.csv': otro,
+        }))
+
+        self.assertEqual(miembros_zip(archivo), ['a/uno.csv', 'dos.csv'])
+        self.assertEqual(self._leer(archivo, 'cargas.zip', miembro='a/uno.csv'), self.filas)
+        self.assertEqual(self._leer(archivo, 'cargas.zip', miembro='dos.csv'), (self.filas[0], self.filas[1][:2]))
+        # Sin indicar miembro el zip debe traer un solo CSV
+        with self.assertRaises(ValueError):
+            abrir_lector(archivo, 'cargas.zip')
+
+    def test_zip_cierra_el_archivo(self):
+        archivo = io.BytesIO(archivo_zip({'uno.csv': self.contenido}))
+        reader = abrir_lector(archivo, 'carga.zip')
+        next(iter(reader))
+
+        cerrar_lector(reader)
+
+        self.assertIsNone(reader.archivo_zip.fp)
+        self.assertTrue(reader.contenido.closed)
+
+    @skipUnless(PYARROW_AVAILABLE, 'pyarrow no está instalado')
+    def test_parquet_entrega_valores_tipados(self):
+        salida = io.BytesIO()
+        pq.write_table(pa.table({
+            'Ejercicio': pa.array([2024, None], pa.int64()),
+            'Fecha Pago': pa.array([date(2025, 11, 6), None], pa.date32()),
+            'M08': pa.array([Decimal('1000.00'), None], pa.decimal128(20, 2)),
+            'Corredora': pa.array(['Banco de Chile', None], pa.string()),
+        }), salida)
+
+        campos, filas = self._leer(salida, 'carga.parquet')
+
+        self.assertEqual(campos, ['Ejercicio', 'Fecha Pago', 'M08', 'Corredora'])
+        # La fila sin datos se omite
+        self.assertEqual(filas, [
+            {'Ejercicio': 2024, 'Fecha Pago': date(2025, 11, 6), 'M08': Decimal('1000.00'), 'Corredora': 'Banco de Chile'}
+        ])
+
+
+class CargaWorkerTestCase(TestCase):
+    """Crea cargas con su archivo y las procesa con el worker (procesar_carga)"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.enterClassContext(override_settings(
+            MEDIA_ROOT=cls.media_root,
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'cargas': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'cargas-tests'},
+            },
+        ))
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.catalogos = crear_catalogos()
+
+    def _cargar(self, contenido, nombre='carga.csv', formato='factores', **campos):
+        carga = Carga.objects.create(
+            id_corredora=self.catalogos.corredora, creado_por=self.catalogos.usuario,
+            id_fuente=self.catalogos.fuente, tipo='masiva', nombre_archivo=nombre,
+            archivo=ContentFile(contenido, name=nombre), formato=formato, estado='validando', **campos
+        )
+        self._procesar()
+        carga.refresh_from_db()
+        return carga
+
+    def _procesar(self):
+        while True:
+            carga = tomar_siguiente_carga()
+            if carga is None:
+                break
+            procesar_carga(carga)
+
+    def _detalles(self, carga):
+        return list(
+            CargaDetalle.objects.filter(id_carga=carga).order_by('linea')
+            .values_list('linea', 'estado_linea', 'mensaje_error')
+        )
+
+    def _contadores(self, carga):
+        return carga.estado, carga.filas_total, carga.insertados, carga.actualizados, carga.rechazados, carga.omitidos
+
+    def _calificaciones(self):
+        """Lo que quedó guardado: por secuencia, campos de la calificación y sus detalles"""
+        resultado = {}
+        for calificacion in Calificacion.objects.all():
+            resultado[calificacion.secuencia_evento] = (
+                calificacion.ejercicio, calificacion.fecha_pago, calificacion.valor_historico,
+                calificacion.factor_actualizacion, calificacion.estado,
+                dict(CalificacionMontoDetalle.objects.filter(id_calificacion=calificacion)
+                     .values_list('id_factor__codigo_factor', 'valor_monto')),
+                dict(CalificacionFactorDetalle.objects.filter(id_calificacion=calificacion)
+                     .values_list('id_factor__codigo_factor', 'valor_factor')),
+            )
+        return resultado
+
+
+class ImportacionTests(CargaWorkerTestCase):
+    def test_validacion_sql_registra_los_mismos_mensajes(self):
+        for formato, columnas, lineas in (
+            ('factores', COLUMNAS_FACTORES, LINEAS_FACTORES),
+            ('montos', COLUMNAS_MONTOS, LINEAS_MONTOS),
+        ):
+            contenido = archivo_csv(columnas, lineas)
+            resultados = {}
+            for validacion_sql in (False, True):
+                with deshacer():
+                    carga = self._cargar(contenido, formato=formato, validacion_sql=validacion_sql)
+                    resultados[validacion_sql] = (
+                        self._contadores(carga), self._detalles(carga), self._calificaciones()
+                    )
+            with self.subTest(formato=formato):
+                self.assertEqual(resultados[True], resultados[False])
+                estados = {estado for _, estado, _ in resultados[False][1]}
+                self.assertEqual(estados, {'ok', 'rechazo'})
+
+    @override_settings(CARGA_COMMIT_CADA=3, CARGA_BATCH_SIZE=2)
+    def test_reanuda_desde_ultima_linea_confirmada(self):
+        contenido = archivo_csv(COLUMNAS_FACTORES, LINEAS_FACTORES)
+        with deshacer():
+            carga = self._cargar(contenido)
+            esperado = (self._contadores(carga), self._detalles(carga), self._calificaciones())
+
+        escribir_registro = CargaImporter._escribir_registro
+        lineas_escritas = []
+
+        def falla_en_linea_9(importer, writer, registro, *args):
+            if registro['linea'] == 9:
+                raise RuntimeError('caída simulada')
+            return escribir_registro(importer, writer, registro, *args)
+
+        def registra_linea(importer, writer, registro, *args):
+            lineas_escritas.append(registro['linea'])
+            return escribir_registro(importer, writer, registro, *args)
+
+        with mock.patch.object(CargaImporter, '_escribir_registro', falla_en_linea_9), \
+                self.assertLogs('cargas.importers', 'ERROR'):
+            carga = self._cargar(contenido)
+        confirmada = carga.ultima_linea_confirmada
+        self.assertEqual((carga.estado, carga.mensaje_error), ('failed', 'caída simulada'))
+        # Bloques de 3 líneas: quedan confirmados los dos primeros (líneas 2 a 7)
+        self.assertEqual(confirmada, 7)
+        self.assertEqual([linea for linea, _, _ in self._detalles(carga)], list(range(2, 8)))
+
+        # Misma transición que CargaViewSet.reanudar
+        Carga.objects.filter(pk=carga.pk).update(estado='validando', iniciado_en=None, mensaje_error=None)
+        with mock.patch.object(CargaImporter, '_escribir_registro', registra_linea):
+            self._procesar()
+        carga.refresh_from_db()
+
+        self.assertEqual(lineas_escritas, list(range(confirmada + 1, len(LINEAS_FACTORES) + 2)))
+        self.assertEqual((self._contadores(carga), self._detalles(carga), self._calificaciones()), esperado)
+
+    def test_omitir_duplicadas(self):
+        contenido = archivo_csv(COLUMNAS_FACTORES, LINEAS_FACTORES[:2])
+        primera = self._cargar(contenido)
+        sin_omitir = self._cargar(contenido)
+        segunda = self._cargar(contenido, omitir_duplicadas=True)
+
+        self.assertEqual(self._contadores(sin_omitir), ('done', 2, 0, 2, 0, 0))
+        self.assertEqual(self._contadores(segunda), ('done', 2, 0, 0, 0, 2))
+        self.assertEqual(self._detalles(segunda), [
+            (2, 'omitida', f'Sin cambios respecto de la carga #{sin_omitir.pk} (línea 2)'),
+            (3, 'omitida', f'Sin cambios respecto de la carga #{sin_omitir.pk} (línea 3)'),
+        ])
+        self.assertEqual(CargaDetalle.objects.filter(id_carga=primera, estado_linea='ok').count(), 2)
+
+        # Un cambio solo en los detalles de una calificación hace que su línea se vuelva a cargar
+        calificacion = Calificacion.objects.get(secuencia_evento='0001')
+        sincronizar_detalles(
+            CalificacionFactorDetalle, 'valor_factor',
+            {calificacion.pk: {self.catalogos.factores['F08'].id_factor: Decimal('0.5')}}
+        )
+        tercera = self._cargar(contenido, omitir_duplicadas=True)
+
+        self.assertEqual([estado for _, estado, _ in self._detalles(tercera)], ['ok', 'omitida'])
+        self.assertEqual(
+            CalificacionFactorDetalle.objects.get(id_calificacion=calificacion, id_factor__codigo_factor='F08').valor_factor,
+            Decimal('0.1')
+        )
+
+    def test_archivos_comprimidos(self):
+        contenido = archivo_csv(COLUMNAS_MONTOS, LINEAS_MONTOS)
+        with deshacer():
+            carga = self._cargar(contenido, formato='montos')
+            esperado = (self._contadores(carga), self._detalles(carga), self._calificaciones())
+
+        for nombre, datos, campos in (
+            ('carga.csv.gz', gzip.compress(contenido), {}),
+            ('carga.zip', archivo_zip({'montos.csv': contenido}), {}),
+            ('cargas.zip', archivo_zip({'otro.csv': b'x', 'a/montos.csv': contenido}), {'miembro_zip': 'a/montos.csv'}),
+        ):
+            with self.subTest(nombre=nombre), deshacer():
+                carga = self._cargar(datos, nombre=nombre, formato='montos', **campos)
+                self.assertEqual((self._contadores(carga), self._detalles(carga), self._calificaciones()), esperado)
+
+    @skipUnless(PYARROW_AVAILABLE, 'pyarrow no está instalado')
+    def test_parquet_con_columnas_tipadas(self):
+        lineas = [LINEAS_MONTOS[0], LINEAS_MONTOS[-1]]
+        with deshacer():
+            self._cargar(archivo_csv(COLUMNAS_MONTOS, lineas), formato='montos')
+            esperado = self._calificaciones()
+
+        columnas = {nombre: [] for nombre in COLUMNAS_MONTOS}
+        for numero, linea in enumerate(lineas, start=1):
+            for nombre, valor in {'Linea': str(numero), **LINEA_BASE, **linea}.items():
+                if nombre in columnas:
+                    columnas[nombre].append(valor)
+            for valores in columnas.values():
+                valores.extend([None] * (numero - len(valores)))
+        tipos = {'Ejercicio': pa.int64(), 'Fecha Pago': pa.date32(), 'Valor Histórico': pa.decimal128(20, 2)}
+        tipos.update((codigo, pa.decimal128(20, 2)) for codigo in CODIGOS_MONTO)
+        convertir = {
+            'Ejercicio': int, 'Fecha Pago': date.fromisoformat,
+            **{nombre: Decimal for nombre in ('Valor Histórico',) + CODIGOS_MONTO},
+        }
+        salida = io.BytesIO()
+        pq.write_table(pa.table({
+            nombre: pa.array(
+                [convertir[nombre](valor) if valor is not None and nombre in convertir else valor for valor in valores],
+                tipos.get(nombre, pa.string())
+            )
+            for nombre, valores in columnas.items()
+        }), salida)
+
+        carga = self._cargar(salida.getvalue(), nombre='carga.parquet', formato='montos')
+
+        self.assertEqual(self._contadores(carga), ('done', 2, 2, 0, 0, 0))
+        self.assertEqual(self._calificaciones(), esperado)
@@ -0,0 +1,62 @@
+"""
+Tiempos por etapa de una carga masiva (Carga.tiempos).
+
+El worker mide cada etapa del procesamiento con MedidorEtapas.medir(): tiempo
+real, tiempo de CPU del proceso y cantidad de consultas a la BD. Las etapas se
+acumulan entre bloques (y entre ejecuciones, al reanudar o confirmar una carga)
+y se guardan en la Carga junto con cada checkpoint y al terminar, por lo que una
+carga lenta muestra qué etapa creció sin perfilar el worker en producción:
+
+    lectura          abrir el archivo y leer/decodificar sus filas (o páginas de staging/preparadas)
+    encabezados      mapeo de encabezados y perfil de homologación
+    catalogos        catálogos (corredora, instrumento, fuente, moneda) y factores
+    validacion       validación y normalización de las líneas en Python
+    validacion_sql   inserción en carga_staging y reglas por conjunto en la BD
+    upsert           líneas ya cargadas, clasificación y upsert de calificaciones
+    detalles         detalles de factores/montos, carga_detalle y checkpoint
+    reconciliacion   controles de la etapa 'reconciliando'
+    total            todo el procesamiento (incluye las etapas anteriores)
+
+Con CARGA_PROCESOS > 1 el tiempo de CPU no incluye los procesos de validación.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class MedidorEtapas:
+    """Acumula segundos, segundos de CPU y consultas por etapa; `inicial` es Carga.tiempos"""
+
+    def __init__(self, inicial=None):
+        self.etapas = {}
+        for etapa, medidas in (inicial or {}).items():
+            self.etapas[etapa] = [
+                medidas.get('segundos', 0), medidas.get('cpu_segundos', 0), medidas.get('consultas', 0)
+            ]
+
+    @contextmanager
+    def medir(self, etapa):
+        consultas = [0]
+
+        def contar(execute, sql, params, many, context):
+            consultas[0] += 1
+            return execute(sql, params, many, context)
+
+        inicio = time.perf_counter()
+        inicio_cpu = time.process_time()
+        try:
+            with connection.execute_wrapper(contar):
+                yield
+        finally:
+            medidas = self.etapas.setdefault(etapa, [0, 0, 0])
+            medidas[0] += time.perf_counter() - inicio
+            medidas[1] += time.process_time() - inicio_cpu
+            medidas[2] += consultas[0]
+
+    def resumen(self):
+        """{etapa: {'segundos', 'cpu_segundos', 'consultas'}} para guardar en Carga.tiempos"""
+        return {
+            etapa: {'segundos': round(segundos, 3), 'cpu_segundos': round(cpu, 3), 'consultas': consultas}
+            for etapa, (segundos, cpu, consultas) in self.etapas.items()
+        }
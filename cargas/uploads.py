@@ -0,0 +1,50 @@
+"""
+Recepción de archivos de carga (settings.FILE_UPLOAD_HANDLERS).
+
+Mismos handlers de Django (en memoria hasta FILE_UPLOAD_MAX_MEMORY_SIZE, en un
+archivo temporal de FILE_UPLOAD_TEMP_DIR sobre ese tamaño), pero calculan el
+SHA-256 del archivo a medida que llegan sus bloques: el archivo subido queda con
+el atributo `sha256` sin tener que volver a leerlo.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class _Sha256Mixin:
+
+    def new_file(self, *args, **kwargs):
+        self._sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        resto = super().receive_data_chunk(raw_data, start)
+        # None: este handler guardó el bloque (si no, pasa al siguiente handler)
+        if resto is None:
+            self._sha256.update(raw_data)
+        return resto
+
+    def file_complete(self, file_size):
+        archivo = super().file_complete(file_size)
+        if archivo is not None:
+            archivo.sha256 = self._sha256.hexdigest()
+        return archivo
+
+
+class MemorySha256UploadHandler(_Sha256Mixin, MemoryFileUploadHandler):
+    """Archivos pequeños: en memoria"""
+
+
+class TemporarySha256UploadHandler(_Sha256Mixin, TemporaryFileUploadHandler):
+    """Archivos grandes: escritos a disco mientras llegan (se leen con mmap, ver cargas.readers)"""
+
+
+def sha256_archivo(archivo):
+    """SHA-256 del archivo subido: el calculado al recibirlo o, si no lo tiene, leyéndolo por bloques"""
+    if getattr(archivo, 'sha256', None):
+        return archivo.sha256
+    sha256 = hashlib.sha256()
+    for bloque in archivo.chunks():
+        sha256.update(bloque)
+    archivo.seek(0)
+    return sha256.hexdigest()
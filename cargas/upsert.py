@@ -0,0 +1,193 @@
+"""
+Upsert por conjunto de calificaciones para las cargas masivas.
+
+upsert_calificaciones() graba las calificaciones ya validadas de un bloque por su
+clave natural (id_corredora, id_instrumento, ejercicio, secuencia_evento), en lugar
+de un get_or_create + save() por línea:
+
+- Oracle: un solo MERGE por bloque, ejecutado con arreglos de binds (executemany).
+- Otros motores (desarrollo local): bulk_create de las nuevas y bulk_update de las existentes.
+
+Antes se consulta en una sola query qué claves ya existen (para distinguir
+insertadas de actualizadas) y, si el motor no retorna los ids de las filas
+insertadas, una segunda query recupera los ids de las nuevas.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from calificaciones.models import Calificacion
+
+
+CAMPOS_CLAVE = ('id_corredora', 'id_instrumento', 'ejercicio', 'secuencia_evento')
+# Campos que se escriben tanto al insertar como al actualizar
+CAMPOS_VALORES = (
+    'id_fuente', 'id_moneda', 'fecha_pago', 'descripcion', 'ingreso_por_montos', 'acogido_sfut',
+    'factor_actualizacion', 'valor_historico', 'estado', 'actualizado_por', 'actualizado_en',
+)
+
+
+def clave_calificacion(datos):
+    """
+    Clave natural de una línea validada. En Oracle '' es NULL, por lo que una
+    secuencia_evento vacía se compara como None (igual que la fila guardada).
+    """
+    secuencia = datos['secuencia_evento']
+    if not secuencia and connection.features.interprets_empty_strings_as_nulls:
+        secuencia = None
+    return (datos['id_corredora'], datos['id_instrumento'], datos['ejercicio'], secuencia)
+
+
+def _buscar_ids(claves):
+    """Una consulta: clave natural -> id_calificacion de las claves que ya existen"""
+    if not claves:
+        return {}
+    filtro = Q(
+        id_corredora_id__in={clave[0] for clave in claves},
+        id_instrumento_id__in={clave[1] for clave in claves},
+        ejercicio__in={clave[2] for clave in claves},
+    )
+    filas = Calificacion.objects.filter(filtro).values_list(
+        'id_calificacion', 'id_corredora_id', 'id_instrumento_id', 'ejercicio', 'secuencia_evento'
+    )
+    ids = {}
+    for id_calificacion, id_corredora, id_instrumento, ejercicio, secuencia_evento in filas:
+        clave = clave_calificacion({
+            'id_corredora': id_corredora, 'id_instrumento': id_instrumento,
+            'ejercicio': ejercicio, 'secuencia_evento': secuencia_evento,
+        })
+        if clave in claves:
+            ids[clave] = id_calificacion
+    return ids
+
+
+def _valores(datos, suma_factores, ingreso_por_montos, usuario, ahora):
+    """Valores de CAMPOS_VALORES para una línea (en el mismo orden)"""
+    return (
+        datos['id_fuente'], datos['id_moneda'], datos['fecha_pago'], datos['descripcion'],
+        ingreso_por_montos, datos['acogido_sfut'], suma_factores, datos['valor_historico'],
+        datos['estado'], usuario.pk, ahora,
+    )
+
+
+def upsert_calificaciones(filas, usuario, ingreso_por_montos, observaciones_nueva, observaciones_existente,
+                          batch_size=500):
+    """
+    Graba las calificaciones de un bloque. `filas` es una lista de (datos, suma_factores)
+    en orden de línea; si una clave se repite gana la última línea (como al grabar
+    línea a línea).
+
+    Retorna (ids, creadas): clave natural -> id_calificacion, y el conjunto de claves
+    que no existían antes del bloque.
+    """
+    # Una fila por clave con los valores de la última línea y cuántas líneas la traen
+    ultimas = {}
+    for datos, suma_factores in filas:
+        clave = clave_calificacion(datos)
+        repeticiones = ultimas[clave][2] + 1 if clave in ultimas else 1
+        ultimas[clave] = (datos, suma_factores, repeticiones)
+    if not ultimas:
+        return {}, set()
+
+    ids = _buscar_ids(set(ultimas))
+    creadas = {clave for clave in ultimas if clave not in ids}
+    ahora = timezone.now()
+
+    if connection.vendor == 'oracle':
+        _merge_oracle(ultimas, usuario, ingreso_por_montos, observaciones_nueva, observaciones_existente, ahora)
+        ids.update(_buscar_ids(creadas))
+    else:
+        ids.update(_bulk_orm(
+            ultimas, ids, creadas, usuario, ingreso_por_montos,
+            observaciones_nueva, observaciones_existente, ahora, batch_size
+        ))
+    return ids, creadas
+
+
+def _observaciones(repeticiones, observaciones_nueva, observaciones_existente):
+    # Una clave nueva repetida en el bloque queda como si la última línea la hubiera actualizado
+    return observaciones_nueva if repeticiones == 1 else observaciones_existente
+
+
+def _merge_oracle(ultimas, usuario, ingreso_por_montos, observaciones_nueva, observaciones_existente, ahora):
+    """Un MERGE por bloque con arreglos de binds: una ejecución para todas las claves"""
+    qn = connection.ops.quote_name
+    opts = Calificacion._meta
+    campos_clave = [opts.get_field(nombre) for nombre in CAMPOS_CLAVE]
+    campos_valores = [opts.get_field(nombre) for nombre in CAMPOS_VALORES]
+    campo_observaciones = opts.get_field('observaciones')
+    campos_insercion = [opts.get_field('creado_por'), opts.get_field('creado_en')]
+    campos_origen = campos_clave + campos_valores + campos_insercion
+
+    columnas_origen = [qn(campo.column) for campo in campos_origen]
+    obs_nueva, obs_existente = qn('OBS_NUEVA'), qn('OBS_EXISTENTE')
+    seleccion = ', '.join(f'%s AS {columna}' for columna in columnas_origen + [obs_nueva, obs_existente])
+    condiciones = []
+    for campo in campos_clave:
+        columna = qn(campo.column)
+        if campo.null:
+            # DECODE considera iguales dos NULL (misma semántica que get_or_create con None)
+            condiciones.append(f'DECODE(t.{columna}, s.{columna}, 1, 0) = 1')
+        else:
+            condiciones.append(f't.{columna} = s.{columna}')
+    columnas_valores = [qn(campo.column) for campo in campos_valores]
+    columnas_insercion = [qn(campo.column) for campo in campos_clave + campos_valores + campos_insercion]
+    columna_observaciones = qn(campo_observaciones.column)
+
+    sql = (
+        f'MERGE INTO {qn(opts.db_table)} t '
+        f'USING (SELECT {seleccion} FROM DUAL) s '
+        f'ON ({" AND ".join(condiciones)}) '
+        f'WHEN MATCHED THEN UPDATE SET '
+        f'{", ".join(f"t.{columna} = s.{columna}" for columna in columnas_valores)}, '
+        f't.{columna_observaciones} = s.{obs_existente} '
+        f'WHEN NOT MATCHED THEN INSERT ({", ".join(columnas_insercion)}, {columna_observaciones}) '
+        f'VALUES ({", ".join(f"s.{columna}" for columna in columnas_insercion)}, s.{obs_nueva})'
+    )
+
+    parametros = []
+    for clave, (datos, suma_factores, repeticiones) in ultimas.items():
+        valores = (
+            (datos['id_corredora'], datos['id_instrumento'], datos['ejercicio'], datos['secuencia_evento'])
+            + _valores(datos, suma_factores, ingreso_por_montos, usuario, ahora)
+            + (usuario.pk, ahora)
+        )
+        fila = [campo.get_db_prep_save(valor, connection) for campo, valor in zip(campos_origen, valores)]
+        fila.append(_observaciones(repeticiones, observaciones_nueva, observaciones_existente))
+        fila.append(observaciones_existente)
+        parametros.append(fila)
+
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, parametros)
+
+
+def _bulk_orm(ultimas, ids, creadas, usuario, ingreso_por_montos, observaciones_nueva, observaciones_existente,
+              ahora, batch_size):
+    """Alternativa portable: bulk_create de las nuevas y bulk_update de las existentes"""
+    attnames = [Calificacion._meta.get_field(nombre).attname for nombre in CAMPOS_VALORES]
+    nuevas = []
+    existentes = []
+    for clave, (datos, suma_factores, repeticiones) in ultimas.items():
+        calificacion = Calificacion(**dict(zip(attnames, _valores(datos, suma_factores, ingreso_por_montos, usuario, ahora))))
+        if clave in creadas:
+            calificacion.id_corredora_id = datos['id_corredora']
+            calificacion.id_instrumento_id = datos['id_instrumento']
+            calificacion.ejercicio = datos['ejercicio']
+            calificacion.secuencia_evento = datos['secuencia_evento']
+            calificacion.observaciones = _observaciones(repeticiones, observaciones_nueva, observaciones_existente)
+            calificacion.creado_por_id = usuario.pk
+            nuevas.append((clave, calificacion))
+        else:
+            calificacion.id_calificacion = ids[clave]
+            calificacion.observaciones = observaciones_existente
+            existentes.append(calificacion)
+
+    if existentes:
+        Calificacion.objects.bulk_update(existentes, list(CAMPOS_VALORES) + ['observaciones'], batch_size=batch_size)
+    if not nuevas:
+        return {}
+    Calificacion.objects.bulk_create([calificacion for _, calificacion in nuevas], batch_size=batch_size)
+    if all(calificacion.pk for _, calificacion in nuevas):
+        return {clave: calificacion.pk for clave, calificacion in nuevas}
+    # El motor no retornó los ids de las filas insertadas
+    return _buscar_ids({clave for clave, _ in nuevas})
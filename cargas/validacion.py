@@ -0,0 +1,835 @@
+"""
+Validación y normalización de las líneas de una carga masiva.
+
+Este módulo no consulta la BD: ValidadorLineas recibe los catálogos y factores ya
+cargados y convierte cada fila del archivo en un registro tipado (o un registro de
+error). Por eso puede ejecutarse en otros procesos (CARGA_PROCESOS > 1), mientras
+un único proceso escribe en la BD en orden de línea (ver cargas.importers).
+"""
+import hashlib
+import json
+import pickle
+import unicodedata
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from .motor_factores import CODIGOS_FACTOR, CODIGOS_MONTO, MotorFactores
+from .readers import filas_mapeadas, mapear_archivo
+
+
+REQUIRED_ALIAS_GROUPS = [
+    ('corredora',),
+    ('instrumento', 'instrumento_codigo'),
+    ('fuente', 'fuente_codigo'),
+    ('moneda', 'moneda_codigo'),
+    ('ejercicio',),
+    ('fecha_pago', 'fecha'),
+    ('secuencia_evento', 'secuencia')
+]
+
+ESTADOS_CALIFICACION = ['borrador', 'validada', 'publicada', 'pendiente']
+
+# Etapa de los errores de decodificación de carga_staging (ver cargas.staging): indica
+# entre qué reglas de la BD se aplican, para conservar el orden de parsear_linea()
+ETAPA_PERFIL = 0    # perfil de homologación: antes que cualquier regla
+ETAPA_FECHAS = 1    # ejercicio y fecha de pago: después de los catálogos
+ETAPA_VALORES = 2   # valor histórico, factores y montos: después de ingreso por montos y estado
+# Mayor valor absoluto que cabe en los decimales de carga_staging (NUMBER(38,18))
+_MAXIMO_STAGING = Decimal(10) ** 20
+
+# Columna de cada factor F08-F37 en los vectores de MotorFactores
+_POSICION_FACTOR = {codigo: posicion for posicion, codigo in enumerate(CODIGOS_FACTOR)}
+
+
+class CargaError(Exception):
+    """Error que impide procesar la carga completa (no una línea puntual)"""
+
+
+# Tipos de error de línea según el texto del mensaje (se evalúan en orden: gana el primero)
+TIPOS_ERROR = [
+    ('duplicada', ('Línea idéntica',)),
+    ('catalogo', ('no existe', 'no es única', 'no es único', 'no encontrado')),
+    ('obligatorio', ('es obligatori',)),
+    ('suma', ('excede 1',)),
+    ('formato', ('inválid', 'no es un número válido', 'no tiene el formato', 'debe ser')),
+]
+# Tipo de los mensajes que no calzan con ninguno de TIPOS_ERROR
+TIPO_ERROR_OTRO = 'otro'
+
+
+def tipo_error(mensaje):
+    """Clasifica el mensaje de una línea rechazada en uno de TIPOS_ERROR (u 'otro')"""
+    for tipo, fragmentos in TIPOS_ERROR:
+        if any(fragmento in (mensaje or '') for fragmento in fragmentos):
+            return tipo
+    return TIPO_ERROR_OTRO
+
+
+# Los encabezados de un archivo son pocos: huella_fila() los normaliza en cada línea
+@lru_cache(maxsize=4096)
+def normalize_header(header):
+    header = unicodedata.normalize('NFKD', header or '')
+    header = ''.join(ch for ch in header if not unicodedata.combining(ch))
+    return ''.join(ch for ch in header.lower() if ch.isalnum())
+
+
+def parse_bool(value, default=False):
+    if value is None or value == '':
+        return default
+    value = str(value).strip().lower()
+    if value in ['true', '1', 'si', 'sí', 'yes', 'y']:
+        return True
+    if value in ['false', '0', 'no', 'n']:
+        return False
+    return default
+
+
+def calcular_factores_desde_montos(montos_dict, factor_map):
+    """
+    Calcular factores (F08-F37) desde montos (M08-M37) de una fila
+    Fórmula: Factor = Monto / Suma Total de Montos (proporcional), a 8 decimales
+    Solo considera factores que tienen aplica_en_suma = True para validar suma <= 1
+    Para varias filas usar MotorFactores.calcular() con el bloque completo.
+    """
+    fila = [montos_dict.get(codigo) for codigo in CODIGOS_MONTO]
+    factores, _, suma_factores = MotorFactores(factor_map).calcular([fila])[0]
+    factores_calculados = {
+        codigo: factor for codigo, factor in zip(CODIGOS_FACTOR, factores) if factor is not None
+    }
+    return factores_calculados, suma_factores
+
+
+def decimal_de_celda(valor):
+    """
+    Decimal de una celda: desde su texto (CSV/Excel) o, si la celda ya es numérica
+    (columnas tipadas de Parquet), sin pasar por texto. Lanza InvalidOperation si no es un número.
+    """
+    if isinstance(valor, str):
+        return Decimal(valor)
+    if isinstance(valor, Decimal):
+        return valor
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return Decimal(valor)
+    if isinstance(valor, float):
+        return Decimal(repr(valor))
+    raise InvalidOperation(valor)
+
+
+def _decimal_canonico(valor):
+    """Representación estable de un Decimal (0.10 y 0.1 generan el mismo texto)"""
+    if valor is None:
+        return ''
+    return format(valor.normalize(), 'f')
+
+
+def huella_linea(formato, registro):
+    """
+    Huella canónica (sha256) de una línea válida, construida con los campos de
+    negocio ya normalizados (IDs de catálogos, fecha, decimales). No depende del
+    orden ni de la forma de escribir los encabezados, ni del número de línea.
+    """
+    datos = registro['datos']
+    partes = [
+        formato,
+        datos['id_corredora'], datos['id_instrumento'], datos['id_fuente'], datos['id_moneda'],
+        datos['ejercicio'], datos['fecha_pago'].isoformat(), datos['secuencia_evento'],
+        datos['estado'], datos['descripcion'], datos['acogido_sfut'],
+        _decimal_canonico(datos['valor_historico']),
+    ]
+    partes.extend(f'{codigo}={_decimal_canonico(valor)}' for codigo, valor in sorted(registro['factores']))
+    partes.extend(f'{codigo}={_decimal_canonico(valor)}' for codigo, valor in sorted(registro['montos']))
+    return hashlib.sha256('|'.join(str(parte) for parte in partes).encode('utf-8')).hexdigest()
+
+
+def huella_fila(row):
+    """
+    Huella de una línea rechazada (no se pudo normalizar): encabezados normalizados
+    y valores sin espacios, ordenados, sin la columna de número de línea.
+    """
+    partes = sorted(
+        (normalize_header(header), str(valor or '').strip())
+        for header, valor in row.items()
+        if normalize_header(header) not in ('linea', 'fila')
+    )
+    return hashlib.sha256(repr(partes).encode('utf-8')).hexdigest()
+
+
+def hash_repetido(hash_linea, linea):
+    """Hash con que se registra una línea idéntica a otra ya registrada (unique (id_carga, hash_linea))"""
+    return hashlib.sha256(f'{hash_linea}:{linea}'.encode('utf-8')).hexdigest()
+
+
+def aplicar_perfil(columnas, row, linea_referencia):
+    """
+    Traduce una fila del archivo al formato NUAM con las columnas resueltas por
+    PerfilImportacion.resolver(). Lanza ValueError si un campo obligatorio viene vacío
+    o una transformación falla.
+    """
+    mapeadas = {}
+    for columna, campo_destino, transformaciones, obligatorio, campo_origen in columnas:
+        valor = row.get(columna)
+        valor = '' if valor is None else str(valor).strip()
+        try:
+            for transformacion in transformaciones:
+                valor = transformacion(valor)
+        except ValueError as e:
+            raise ValueError(f'Campo {campo_origen}: {e} (línea {linea_referencia})')
+        if obligatorio and not valor:
+            raise ValueError(f'Campo {campo_origen} es obligatorio (línea {linea_referencia})')
+        mapeadas[campo_destino] = valor
+
+    traducida = {header: valor for header, valor in row.items() if header not in mapeadas}
+    for columna, *_ in columnas:
+        traducida.pop(columna, None)
+    traducida.update(mapeadas)
+    return traducida
+
+
+class MapeoColumnas:
+    """
+    Mapeo de encabezados de un archivo a sus columnas, compilado una vez por archivo.
+
+    columnas(*aliases) normaliza los alias una sola vez y retorna las columnas
+    candidatas (en orden); valor(row, columnas) extrae el valor sin volver a
+    normalizar nada, con la misma regla que get_cell: se usa la primera columna
+    presente cuyo valor no sea None.
+    """
+
+    def __init__(self, raw_headers):
+        self.header_map = {normalize_header(h): h for h in raw_headers}
+        self._cache = {}
+
+    def tiene(self, alias):
+        return normalize_header(alias) in self.header_map
+
+    def columnas(self, *aliases):
+        columnas = self._cache.get(aliases)
+        if columnas is None:
+            encontradas = []
+            for alias in aliases:
+                original = self.header_map.get(normalize_header(alias))
+                if original and original not in encontradas:
+                    encontradas.append(original)
+            columnas = self._cache[aliases] = tuple(encontradas)
+        return columnas
+
+    @staticmethod
+    def valor(row, columnas, default=''):
+        for columna in columnas:
+            value = row.get(columna)
+            if value is not None:
+                return str(value).strip()
+        return default
+
+    @staticmethod
+    def dato(row, columnas, default=''):
+        """
+        Como valor(), pero conserva el tipo de las celdas tipadas (Parquet: int,
+        Decimal, date); solo los textos se recortan.
+        """
+        for columna in columnas:
+            value = row.get(columna)
+            if value is not None:
+                return value.strip() if isinstance(value, str) else value
+        return default
+
+    def get_cell(self, row, *aliases, default=''):
+        return self.valor(row, self.columnas(*aliases), default)
+
+
+class ValidadorLineas:
+    """
+    Valida las filas de un archivo de carga. `formato` es 'factores' o 'montos'.
+    Solo guarda datos en memoria (catálogos, factores y encabezados), por lo que
+    puede copiarse a otros procesos.
+    """
+
+    def __init__(self, formato, factor_codigos, factor_map, catalogos, perfil=None):
+        self.formato = formato
+        self.factor_codigos = factor_codigos
+        self.factor_map = factor_map
+        self.motor = MotorFactores(factor_map)
+        self.catalogos = catalogos
+        # Perfil de homologación (cargas.perfiles.PerfilImportacion) para archivos con otro formato
+        self.perfil = perfil
+        self.columnas_perfil = []
+        self.mapeo = MapeoColumnas([])
+        self.col = {}
+        self.columnas_factores = []
+
+    def validar_encabezados(self, raw_headers):
+        """
+        Valida los encabezados obligatorios (lanza CargaError si falta alguno) y
+        compila las columnas de cada campo para este archivo.
+        """
+        if self.perfil is not None:
+            # Los encabezados del corredor se traducen a los del formato NUAM
+            raw_headers, self.columnas_perfil = self.perfil.resolver(raw_headers)
+        mapeo = self.mapeo = MapeoColumnas(raw_headers)
+        missing_headers = []
+        for group in REQUIRED_ALIAS_GROUPS:
+            if not any(mapeo.tiene(alias) for alias in group):
+                missing_headers.append(group[0])
+        if missing_headers:
+            raise CargaError(f'Encabezados faltantes: {", ".join(missing_headers)}')
+
+        self.col = {
+            'linea': mapeo.columnas('linea', 'fila'),
+            'id_corredora': mapeo.columnas('id_corredora'),
+            'corredora': mapeo.columnas('corredora'),
+            'id_instrumento': mapeo.columnas('id_instrumento'),
+            'instrumento_codigo': mapeo.columnas('instrumento_codigo'),
+            'instrumento': mapeo.columnas('instrumento'),
+            'id_fuente': mapeo.columnas('id_fuente'),
+            'fuente_codigo': mapeo.columnas('fuente_codigo'),
+            'fuente': mapeo.columnas('fuente'),
+            'id_moneda': mapeo.columnas('id_moneda'),
+            'moneda': mapeo.columnas('moneda_codigo', 'moneda'),
+            'ejercicio': mapeo.columnas('ejercicio'),
+            'fecha_pago': mapeo.columnas('fecha_pago', 'fecha'),
+            'ingreso_por_montos': mapeo.columnas('ingreso_por_montos', 'ingreso'),
+            'acogido_sfut': mapeo.columnas('acogido_sfut', 'sfut'),
+            'descripcion': mapeo.columnas('descripcion'),
+            'estado': mapeo.columnas('estado'),
+            'valor_historico': mapeo.columnas('valor_historico'),
+            'secuencia_evento': mapeo.columnas('secuencia_evento', 'secuencia'),
+        }
+
+        # Columnas de factores/montos presentes en el archivo (las ausentes no se recorren)
+        self.columnas_factores = []
+        for codigo in self.factor_codigos:
+            if self.formato == 'factores':
+                # F19 se llama 'F19A' en la BD; el archivo puede traer cualquiera de los dos
+                columnas = mapeo.columnas(codigo)
+                alternativas = mapeo.columnas('F19') if codigo == 'F19A' else ()
+            else:
+                # Montos M08-M37 (se permite también el nombre del factor)
+                columnas = mapeo.columnas(codigo.replace('F', 'M'), codigo)
+                alternativas = ()
+            if columnas or alternativas:
+                self.columnas_factores.append((codigo, columnas, alternativas))
+
+    def parsear_linea(self, linea, row):
+        """
+        Valida y normaliza una línea sin tocar la BD.
+        Retorna un registro (dict) con los datos tipados y su huella, o un
+        registro de error {'linea', 'error', 'huella'}.
+        """
+        return self.parsear_bloque([(linea, row)])[0]
+
+    def parsear_bloque(self, filas):
+        """
+        Valida un bloque [(linea, row), ...] y retorna los registros en el mismo orden.
+        En cargas por montos primero se leen los montos de cada línea y luego los
+        factores de todo el bloque se calculan en una sola pasada (MotorFactores).
+        """
+        if self.formato == 'factores':
+            return [self._parsear(linea, row, self._parsear_factores)[0] for linea, row in filas]
+
+        registros = []
+        pendientes = []  # (posición, fila homologada, vector de montos)
+        for linea, row in filas:
+            registro, row = self._parsear(linea, row, self._leer_montos)
+            if 'error' not in registro:
+                pendientes.append((len(registros), row, registro.pop('vector_montos')))
+            registros.append(registro)
+
+        calculos = self.motor.calcular([vector for _, _, vector in pendientes])
+        for (posicion, row, vector), calculo in zip(pendientes, calculos):
+            registro = registros[posicion]
+            try:
+                self._completar_montos(registro, vector, calculo)
+                registro['huella'] = huella_linea(self.formato, registro)
+            except Exception as e:
+                registros[posicion] = self._registro_error(registro['linea'], row, e)
+        return registros
+
+    def _parsear(self, linea, row, parsear):
+        """
+        Aplica el perfil y `parsear` a una línea. Retorna (registro, fila homologada);
+        los registros por montos quedan sin huella hasta completar sus factores.
+        """
+        try:
+            if self.columnas_perfil:
+                row = aplicar_perfil(self.columnas_perfil, row, linea)
+            linea_referencia = self.mapeo.valor(row, self.col['linea'], default=str(linea))
+            registro = parsear(row, linea_referencia)
+            registro['linea'] = linea
+            registro['linea_referencia'] = linea_referencia
+            if 'vector_montos' not in registro:
+                registro['huella'] = huella_linea(self.formato, registro)
+            return registro, row
+        except Exception as e:
+            return self._registro_error(linea, row, e), row
+
+    def _registro_error(self, linea, row, error):
+        return {
+            'linea': linea,
+            'linea_referencia': self.mapeo.valor(row, self.col.get('linea', ()), default=str(linea)),
+            'error': str(error),
+            'huella': huella_fila(row)
+        }
+
+    def _leer_datos_comunes(self, row, linea_referencia):
+        """Resuelve catálogos y valida los campos comunes a ambos formatos"""
+        valor = self.mapeo.valor
+        col = self.col
+        datos = {}
+
+        # Resolver catálogos en memoria (sin consultas por línea)
+        datos['id_corredora'] = self.catalogos.resolver_corredora(
+            valor(row, col['id_corredora']), valor(row, col['corredora']), linea_referencia
+        )
+        datos['id_instrumento'] = self.catalogos.resolver_instrumento(
+            valor(row, col['id_instrumento']), valor(row, col['instrumento_codigo']),
+            valor(row, col['instrumento']), linea_referencia
+        )
+        datos['id_fuente'] = self.catalogos.resolver_fuente(
+            valor(row, col['id_fuente']), valor(row, col['fuente_codigo']),
+            valor(row, col['fuente']), linea_referencia
+        )
+        datos['id_moneda'] = self.catalogos.resolver_moneda(
+            valor(row, col['id_moneda']), valor(row, col['moneda']), linea_referencia
+        )
+
+        # Validar ejercicio y fecha (las columnas tipadas de Parquet se usan sin convertir)
+        datos['ejercicio'] = self._leer_ejercicio(row, linea_referencia)
+        datos['fecha_pago'] = self._leer_fecha_pago(row, linea_referencia)
+
+        if self.formato == 'factores':
+            ingreso_por_montos = parse_bool(valor(row, col['ingreso_por_montos']), default=False)
+            if ingreso_por_montos:
+                raise ValueError(f'Ingreso por montos debe ser "No" para cargas por factor (línea {linea_referencia})')
+
+        datos['acogido_sfut'] = parse_bool(valor(row, col['acogido_sfut']))
+        datos['descripcion'] = valor(row, col['descripcion'])
+        estado_val = valor(row, col['estado']).lower() or 'borrador'
+        if estado_val not in ESTADOS_CALIFICACION:
+            raise ValueError(f'Estado "{estado_val}" inválido (línea {linea_referencia})')
+        datos['estado'] = estado_val
+
+        datos['valor_historico'] = self._leer_valor_historico(row, linea_referencia)
+        datos['secuencia_evento'] = valor(row, col['secuencia_evento'])
+        return datos
+
+    def _leer_ejercicio(self, row, linea_referencia):
+        ejercicio_raw = self.mapeo.dato(row, self.col['ejercicio'])
+        if type(ejercicio_raw) is int:
+            return ejercicio_raw
+        try:
+            ejercicio = int(ejercicio_raw)
+            # Celdas numéricas (Excel, Parquet): int() truncaría 2024.7 en vez de rechazarlo
+            if isinstance(ejercicio_raw, (float, Decimal)) and ejercicio != ejercicio_raw:
+                raise ValueError
+            return ejercicio
+        except (TypeError, ValueError, OverflowError, InvalidOperation):
+            raise ValueError(f'Ejercicio inválido "{ejercicio_raw}" (línea {linea_referencia})')
+
+    def _leer_fecha_pago(self, row, linea_referencia):
+        fecha_pago_raw = self.mapeo.dato(row, self.col['fecha_pago'])
+        if isinstance(fecha_pago_raw, date):
+            return fecha_pago_raw.date() if isinstance(fecha_pago_raw, datetime) else fecha_pago_raw
+        if isinstance(fecha_pago_raw, str):
+            for fmt in ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y'):
+                try:
+                    return datetime.strptime(fecha_pago_raw, fmt).date()
+                except ValueError:
+                    continue
+        raise ValueError(f'Fecha de pago inválida "{fecha_pago_raw}" (línea {linea_referencia})')
+
+    def _leer_valor_historico(self, row, linea_referencia):
+        valor_historico_val = self.mapeo.dato(row, self.col['valor_historico'])
+        # Celda vacía; un 0 numérico (Excel, Parquet) se guarda como 0
+        if valor_historico_val is None or valor_historico_val == '':
+            return None
+        try:
+            return decimal_de_celda(valor_historico_val)
+        except InvalidOperation:
+            raise ValueError(f'Valor histórico inválido "{valor_historico_val}" (línea {linea_referencia})')
+
+    def _parsear_factores(self, row, linea_referencia):
+        """Línea de carga por factores: datos comunes y factores (código en BD, valor)"""
+        datos = self._leer_datos_comunes(row, linea_referencia)
+        factor_map = self.factor_map
+        factores_detalle = self._leer_factores(row, linea_referencia)
+
+        # Calcular suma de factores que aplican en suma
+        suma_factores = Decimal('0')
+        for factor_key, valor in factores_detalle.items():
+            if factor_key in factor_map and factor_map[factor_key].aplica_en_suma:
+                suma_factores += valor
+
+        if suma_factores > Decimal('1'):
+            raise ValueError(f'Suma de factores excede 1: {suma_factores} (línea {linea_referencia})')
+
+        factores = []
+        for codigo, valor in factores_detalle.items():
+            # Buscar el factor en el mapa (puede ser F19 o F19A)
+            factor_obj = factor_map.get(codigo)
+            if not factor_obj and codigo == 'F19':
+                # Si no encontramos F19, buscar F19A
+                factor_obj = factor_map.get('F19A')
+            if not factor_obj:
+                raise ValueError(f'Factor {codigo} no encontrado en la base de datos (línea {linea_referencia})')
+            factores.append((factor_obj.codigo_factor, valor))
+
+        return {'datos': datos, 'suma_factores': suma_factores, 'factores': factores, 'montos': []}
+
+    def _leer_factores(self, row, linea_referencia):
+        """Factores positivos de la línea: {código del factor_map (F19 o F19A): valor}, en orden de columna"""
+        factor_map = self.factor_map
+        factores_detalle = {}
+        valor_celda = self.mapeo.dato
+        for codigo, columnas, alternativas in self.columnas_factores:
+            # Buscar el valor: primero con el código exacto, luego 'F19' si estamos en F19A
+            valor_str = valor_celda(row, columnas)
+            if not valor_str and alternativas:
+                # Si no encontramos con F19A, intentar con F19
+                valor_str = valor_celda(row, alternativas)
+
+            if valor_str:
+                try:
+                    valor = decimal_de_celda(valor_str)
+                    if valor > 0:
+                        # Usar el código del factor_map (puede ser F19A o F19)
+                        factor_key = codigo
+                        if codigo == 'F19A' and 'F19' in factor_map:
+                            factor_key = 'F19'  # Usar F19 para el mapeo interno
+                        factores_detalle[factor_key] = valor
+                except InvalidOperation:
+                    raise ValueError(f'Factor {codigo} no es un número válido (línea {linea_referencia})')
+        return factores_detalle
+
+    def _leer_montos(self, row, linea_referencia):
+        """Línea de carga por montos: datos comunes y vector de montos M08-M37 (orden de CODIGOS_MONTO)"""
+        datos = self._leer_datos_comunes(row, linea_referencia)
+        return {'datos': datos, 'vector_montos': self._leer_vector_montos(row, linea_referencia)}
+
+    def _leer_vector_montos(self, row, linea_referencia):
+        vector = [None] * len(CODIGOS_MONTO)
+        valor_celda = self.mapeo.dato
+        for codigo, columnas, _ in self.columnas_factores:
+            posicion = _POSICION_FACTOR.get(codigo)
+            valor_str = valor_celda(row, columnas)  # Permitir ambos nombres
+            if valor_str and posicion is not None:
+                try:
+                    monto = decimal_de_celda(valor_str)
+                    if not monto.is_finite():
+                        raise InvalidOperation(valor_str)
+                except InvalidOperation:
+                    raise ValueError(f'Monto {CODIGOS_MONTO[posicion]} no es un número válido (línea {linea_referencia})')
+                if monto > 0:
+                    vector[posicion] = monto
+        return vector
+
+    def _completar_montos(self, registro, vector, calculo):
+        """Agrega al registro los montos y los factores calculados por MotorFactores"""
+        factores_fila, _, suma_factores = calculo
+
+        # Validar suma de factores
+        if suma_factores > Decimal('1'):
+            raise ValueError(
+                f'Suma de factores calculados excede 1: {suma_factores} (línea {registro["linea_referencia"]})'
+            )
+
+        factor_map = self.factor_map
+        montos = []
+        factores = []
+        for codigo, monto, factor in zip(CODIGOS_FACTOR, vector, factores_fila):
+            if monto is None or codigo not in factor_map:
+                continue
+            montos.append((factor_map[codigo].codigo_factor, monto))
+            factores.append((factor_map[codigo].codigo_factor, factor))
+        registro.update({'suma_factores': suma_factores, 'factores': factores, 'montos': montos})
+
+    # ----- Validación en la BD (Carga.validacion_sql, ver cargas.staging) -----
+
+    def decodificar_linea(self, linea, row):
+        """
+        Decodifica una línea para carga_staging sin resolver catálogos ni aplicar
+        reglas: textos recortados (None si vienen vacíos), ejercicio, fecha y
+        decimales. Retorna (campos de CargaStaging, [(código del factor, valor), ...])
+        con los factores o montos positivos. Un error de decodificación queda en
+        error_formato con su etapa (ETAPA_*); la línea no se sigue decodificando.
+        """
+        try:
+            if self.columnas_perfil:
+                row = aplicar_perfil(self.columnas_perfil, row, linea)
+        except Exception as e:
+            error = self._registro_error(linea, row, e)
+            fila = self._fila_staging(linea, error['linea_referencia'], error['huella'], {})
+            fila.update(error_formato=error['error'], etapa_error=ETAPA_PERFIL)
+            return fila, []
+
+        valor = self.mapeo.valor
+        col = self.col
+        linea_referencia = valor(row, col['linea'], default=str(linea))
+        fila = self._fila_staging(linea, linea_referencia, huella_fila(row), {
+            campo: _texto_staging(valor(row, col[campo])) for campo in (
+                'corredora', 'instrumento_codigo', 'instrumento', 'fuente_codigo', 'fuente', 'moneda',
+                'estado', 'secuencia_evento',
+            )
+        })
+        for catalogo in ('corredora', 'instrumento', 'fuente', 'moneda'):
+            id_texto = _texto_staging(valor(row, col[f'id_{catalogo}']))
+            fila[f'id_{catalogo}_texto'] = id_texto
+            fila[f'id_{catalogo}'] = _id_staging(id_texto)
+        fila['descripcion'] = valor(row, col['descripcion']) or None
+        fila['ingreso_por_montos'] = (
+            self.formato == 'factores' and parse_bool(valor(row, col['ingreso_por_montos']), default=False)
+        )
+        fila['acogido_sfut'] = parse_bool(valor(row, col['acogido_sfut']))
+
+        etapa = ETAPA_FECHAS
+        valores = []
+        try:
+            fila['ejercicio'] = self._leer_ejercicio(row, linea_referencia)
+            fila['fecha_pago'] = self._leer_fecha_pago(row, linea_referencia)
+            etapa = ETAPA_VALORES
+            fila['valor_historico'] = _decimal_staging(
+                self._leer_valor_historico(row, linea_referencia), f'Valor histórico inválido (línea {linea_referencia})'
+            )
+            if self.formato == 'factores':
+                for factor_key, valor_factor in self._leer_factores(row, linea_referencia).items():
+                    factor_obj = self.factor_map.get(factor_key)
+                    codigo = factor_obj.codigo_factor if factor_obj else factor_key
+                    valores.append((codigo, _decimal_staging(
+                        valor_factor, f'Factor {codigo} no es un número válido (línea {linea_referencia})'
+                    )))
+            else:
+                vector = self._leer_vector_montos(row, linea_referencia)
+                for posicion, monto in enumerate(vector):
+                    if monto is not None:
+                        valores.append((CODIGOS_FACTOR[posicion], _decimal_staging(
+                            monto, f'Monto {CODIGOS_MONTO[posicion]} no es un número válido (línea {linea_referencia})'
+                        )))
+        except Exception as e:
+            fila.update(error_formato=str(e), etapa_error=etapa)
+            return fila, []
+        return fila, valores
+
+    @staticmethod
+    def _fila_staging(linea, linea_referencia, huella, campos):
+        fila = dict.fromkeys(CAMPOS_STAGING)
+        fila.update(campos)
+        fila.update(
+            linea=linea,
+            linea_referencia=str(linea_referencia)[:255],
+            huella=huella,
+            hash_linea=huella,
+            hash_repetida=hash_repetido(huella, linea),
+            ingreso_por_montos=False,
+            acogido_sfut=False,
+        )
+        return fila
+
+    def completar_staging(self, registros):
+        """
+        Completa los registros de las líneas que pasaron las reglas de la BD: en
+        cargas por montos calcula los factores del bloque con MotorFactores (y
+        valida su suma) y en ambas calcula la huella. Retorna los registros en el
+        mismo orden (las líneas con error quedan como registro de error).
+        """
+        if self.formato == 'montos':
+            calculos = self.motor.calcular([registro['vector_montos'] for registro in registros])
+            for posicion, (registro, calculo) in enumerate(zip(registros, calculos)):
+                try:
+                    self._completar_montos(registro, registro.pop('vector_montos'), calculo)
+                except Exception as e:
+                    registros[posicion] = {
+                        'linea': registro['linea'],
+                        'linea_referencia': registro['linea_referencia'],
+                        'error': str(e),
+                        'huella': registro['huella'],
+                    }
+        for registro in registros:
+            if 'error' not in registro:
+                registro['huella'] = huella_linea(self.formato, registro)
+        return registros
+
+
+# Campos de CargaStaging que llena ValidadorLineas.decodificar_linea()
+CAMPOS_STAGING = (
+    'linea', 'linea_referencia', 'huella', 'hash_repetida', 'hash_linea',
+    'id_corredora_texto', 'corredora', 'id_corredora',
+    'id_instrumento_texto', 'instrumento_codigo', 'instrumento', 'id_instrumento',
+    'id_fuente_texto', 'fuente_codigo', 'fuente', 'id_fuente',
+    'id_moneda_texto', 'moneda', 'id_moneda',
+    'ejercicio', 'fecha_pago', 'ingreso_por_montos', 'acogido_sfut', 'estado', 'descripcion',
+    'valor_historico', 'secuencia_evento', 'error_formato', 'etapa_error',
+)
+
+
+def _texto_staging(valor):
+    """Texto para una columna de 255 caracteres de carga_staging (None si viene vacío)"""
+    return valor[:255] if valor else None
+
+
+def _id_staging(texto):
+    """ID numérico leído del archivo (None si no es un entero o no cabe en la columna)"""
+    try:
+        id_valor = int(texto)
+    except (TypeError, ValueError):
+        return None
+    return id_valor if abs(id_valor) < 2 ** 63 else None
+
+
+def _decimal_staging(valor, mensaje):
+    """Decimal que cabe en carga_staging; los infinitos o fuera de rango son números inválidos"""
+    if valor is not None and not (valor.is_finite() and abs(valor) < _MAXIMO_STAGING):
+        raise ValueError(mensaje)
+    return valor
+
+
+# ========= LÍNEAS PREPARADAS (vista previa) =========
+
+def registro_a_json(registro):
+    """
+    Serializa un registro válido (datos, suma_factores, factores, montos) para
+    CargaLineaPreparada. Los Decimal se guardan como texto (sin pérdida) y la fecha en ISO.
+    """
+    datos = dict(registro['datos'])
+    datos['fecha_pago'] = datos['fecha_pago'].isoformat()
+    if datos['valor_historico'] is not None:
+        datos['valor_historico'] = str(datos['valor_historico'])
+    return json.dumps({
+        'datos': datos,
+        'suma_factores': str(registro['suma_factores']),
+        'factores': [[codigo, str(valor)] for codigo, valor in registro['factores']],
+        'montos': [[codigo, str(monto)] for codigo, monto in registro['montos']],
+    }, ensure_ascii=False, separators=(',', ':'))
+
+
+def registro_desde_json(texto, linea, linea_referencia, huella):
+    """Reconstruye el registro tipado guardado con registro_a_json()"""
+    contenido = json.loads(texto)
+    datos = contenido['datos']
+    datos['fecha_pago'] = date.fromisoformat(datos['fecha_pago'])
+    if datos['valor_historico'] is not None:
+        datos['valor_historico'] = Decimal(datos['valor_historico'])
+    return {
+        'datos': datos,
+        'suma_factores': Decimal(contenido['suma_factores']),
+        'factores': [(codigo, Decimal(valor)) for codigo, valor in contenido['factores']],
+        'montos': [(codigo, Decimal(monto)) for codigo, monto in contenido['montos']],
+        'linea': linea,
+        'linea_referencia': linea_referencia,
+        'huella': huella,
+    }
+
+
+# ========= VALIDACIÓN EN PARALELO =========
+
+# Validador del proceso hijo (se instala una vez por proceso en _iniciar_proceso)
+_validador_proceso = None
+# (ruta, mmap) del último CSV mapeado por el proceso hijo
+_mapa_proceso = (None, None)
+
+
+def _iniciar_proceso(validador_serializado):
+    """
+    Inicializador de cada proceso del pool. Los procesos se crean con 'spawn' (no
+    heredan la conexión a Oracle del padre), por lo que se configura Django antes
+    de reconstruir el validador.
+    """
+    global _validador_proceso
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _validador_proceso = pickle.loads(validador_serializado)
+
+
+def _validar_rango(filas):
+    """Valida un rango de filas [(linea, row), ...] en el proceso hijo"""
+    return _validador_proceso.parsear_bloque(filas)
+
+
+def _validar_rangos_mapeados(tarea):
+    """
+    Valida en el proceso hijo las filas de un CSV mapeado: la tarea trae solo la
+    ruta, el formato del CSV y los rangos (linea_inicial, inicio, fin) en bytes.
+    """
+    global _mapa_proceso
+    ruta, fieldnames, delimiter, rangos = tarea
+    if _mapa_proceso[0] != ruta:
+        if _mapa_proceso[1] is not None:
+            _mapa_proceso[1].close()
+        _mapa_proceso = (ruta, mapear_archivo(ruta))
+    return _validador_proceso.parsear_bloque(_filas_de_rangos(_mapa_proceso[1], fieldnames, delimiter, rangos))
+
+
+def _filas_de_rangos(mapa, fieldnames, delimiter, rangos):
+    filas = []
+    for linea_inicial, inicio, fin in rangos:
+        filas.extend(enumerate(filas_mapeadas(mapa, inicio, fin, fieldnames, delimiter), start=linea_inicial))
+    return filas
+
+
+def _rangos_de_lineas(indice, lineas):
+    """
+    Agrupa números de línea ascendentes en tramos consecutivos y los traduce a
+    desplazamientos del archivo: [(linea_inicial, inicio, fin), ...]
+    (la fila de datos i es la línea i + 2; la línea 1 son los encabezados).
+    """
+    rangos = []
+    primera = anterior = lineas[0]
+    for linea in lineas[1:]:
+        if linea != anterior + 1:
+            rangos.append((primera, indice[primera - 2], indice[anterior - 1]))
+            primera = linea
+        anterior = linea
+    rangos.append((primera, indice[primera - 2], indice[anterior - 1]))
+    return rangos
+
+
+def crear_pool(validador, procesos):
+    """Pool de procesos para validar bloques de líneas con validar_bloque()"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(
+        max_workers=procesos,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_iniciar_proceso,
+        initargs=(pickle.dumps(validador),)
+    )
+
+
+def validar_bloque(validador, filas, pool=None, procesos=1):
+    """
+    Valida las filas [(linea, row), ...] y retorna los registros en el mismo orden.
+    Con un pool, las filas se dividen en `procesos` rangos contiguos de líneas.
+    """
+    if pool is None or procesos <= 1 or len(filas) < procesos * 2:
+        return validador.parsear_bloque(filas)
+
+    tamano = -(-len(filas) // procesos)  # división hacia arriba
+    rangos = [filas[i:i + tamano] for i in range(0, len(filas), tamano)]
+    registros = []
+    for resultado in pool.map(_validar_rango, rangos):
+        registros.extend(resultado)
+    return registros
+
+
+def validar_lineas_mapeadas(validador, lector, lineas, pool=None, procesos=1):
+    """
+    Valida las líneas `lineas` (números ascendentes) de un LectorCSVMapeado ya
+    indexado y retorna los registros en el mismo orden. Con un pool, cada proceso
+    recibe solo desplazamientos y lee sus filas desde su propio mmap del archivo.
+    """
+    if not lineas:
+        return []
+    if pool is None or procesos <= 1 or len(lineas) < procesos * 2 or not lector.ruta:
+        filas = _filas_de_rangos(lector.mapa, lector.fieldnames, lector.delimiter, _rangos_de_lineas(lector.indice, lineas))
+        return validador.parsear_bloque(filas)
+
+    tamano = -(-len(lineas) // procesos)  # división hacia arriba
+    tareas = [
+        (lector.ruta, lector.fieldnames, lector.delimiter, _rangos_de_lineas(lector.indice, lineas[i:i + tamano]))
+        for i in range(0, len(lineas), tamano)
+    ]
+    registros = []
+    for resultado in pool.map(_validar_rangos_mapeados, tareas):
+        registros.extend(resultado)
+    return registros
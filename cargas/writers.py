@@ -0,0 +1,100 @@
+"""
+Escritura en bloque de las cargas masivas.
+
+CargaBatchWriter acumula en memoria el resultado de cada línea (detalles de
+factores/montos de la calificación y el registro de carga_detalle) y los
+escribe cada `batch_size` líneas: los detalles se sincronizan por diferencia
+(calificaciones.detalles.sincronizar_detalles) y carga_detalle con bulk_create,
+en lugar de varios INSERT/DELETE por línea.
+"""
+from django.conf import settings
+
+from calificaciones.detalles import sincronizar_detalles
+from calificaciones.models import CalificacionFactorDetalle, CalificacionMontoDetalle
+from .models import CargaDetalle
+from .validacion import hash_repetido
+
+
+class CargaBatchWriter:
+    """
+    Buffer de escritura para una Carga.
+
+    Garantías que se mantienen respecto a la escritura línea a línea:
+    - unique_together (id_calificacion, id_factor): si varias líneas del mismo bloque
+      apuntan a la misma calificación, gana la última (la calificación queda con
+      exactamente los detalles de esa línea).
+    - unique_together (id_carga, linea) y (id_carga, hash_linea): cada línea se
+      registra una sola vez y las líneas idénticas se detectan antes de escribir.
+    """
+
+    def __init__(self, carga, batch_size=None):
+        self.carga = carga
+        self.batch_size = batch_size or getattr(settings, 'CARGA_BATCH_SIZE', 500)
+        # id_calificacion -> (factores, montos); cada uno lista de (FactorDef, valor)
+        self._detalles_calificacion = {}
+        self._carga_detalles = []
+        # hash_linea -> línea, para todas las líneas registradas en esta carga
+        self._hashes = {}
+
+    def linea_con_hash(self, hash_linea):
+        """Retorna la línea ya registrada con ese hash en esta carga (o None)"""
+        return self._hashes.get(hash_linea)
+
+    def registrar_hash(self, hash_linea, linea):
+        """Registra el hash de una línea ya escrita en una ejecución anterior (reanudación)"""
+        if hash_linea:
+            self._hashes.setdefault(hash_linea, linea)
+
+    def registrar_detalles(self, id_calificacion, factores, montos=()):
+        """Reemplaza los detalles de factores y montos de una calificación"""
+        self._detalles_calificacion[id_calificacion] = (list(factores), list(montos))
+
+    def registrar_ok(self, linea, id_calificacion, hash_linea):
+        self._agregar_carga_detalle(linea, 'ok', None, id_calificacion, hash_linea)
+
+    def registrar_rechazo(self, linea, mensaje_error, hash_linea):
+        self._agregar_carga_detalle(linea, 'rechazo', mensaje_error, None, hash_linea)
+
+    def registrar_omitida(self, linea, id_calificacion, hash_linea, mensaje):
+        self._agregar_carga_detalle(linea, 'omitida', mensaje, id_calificacion, hash_linea)
+
+    def _agregar_carga_detalle(self, linea, estado_linea, mensaje_error, id_calificacion, hash_linea):
+        if hash_linea in self._hashes:
+            # Línea idéntica a otra ya registrada: se deriva un hash distinto para no
+            # violar unique (id_carga, hash_linea)
+            hash_linea = hash_repetido(hash_linea, linea)
+        self._hashes[hash_linea] = linea
+        self._carga_detalles.append(CargaDetalle(
+            id_carga=self.carga,
+            linea=linea,
+            estado_linea=estado_linea,
+            mensaje_error=mensaje_error,
+            id_calificacion_id=id_calificacion,
+            hash_linea=hash_linea
+        ))
+        if len(self._carga_detalles) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Escribe en la BD todo lo acumulado"""
+        if self._detalles_calificacion:
+            # Solo se escriben los detalles que cambiaron respecto de los guardados
+            factores = {}
+            montos = {}
+            for id_calificacion, (factores_linea, montos_linea) in self._detalles_calificacion.items():
+                factores[id_calificacion] = {factor.id_factor: valor for factor, valor in factores_linea}
+                montos[id_calificacion] = {factor.id_factor: monto for factor, monto in montos_linea}
+            # upsert_calificaciones ya dejó actualizado_en en cada calificación de la línea
+            sincronizar_detalles(
+                CalificacionMontoDetalle, 'valor_monto', montos,
+                batch_size=self.batch_size, actualizar_calificacion=False
+            )
+            sincronizar_detalles(
+                CalificacionFactorDetalle, 'valor_factor', factores,
+                batch_size=self.batch_size, actualizar_calificacion=False
+            )
+            self._detalles_calificacion = {}
+
+        if self._carga_detalles:
+            CargaDetalle.objects.bulk_create(self._carga_detalles, batch_size=self.batch_size)
+            self._carga_detalles = []
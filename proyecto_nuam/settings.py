@@ -183,3 +183,48 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100
 }
+
+# ============================================================
+# CARGAS MASIVAS
+# ============================================================
+# Cantidad de líneas que se acumulan antes de escribir en bloque (bulk_create)
+CARGA_BATCH_SIZE = config('CARGA_BATCH_SIZE', default=500, cast=int)
+# Cada cuántas líneas se confirma (COMMIT) una carga; 0 = toda la carga en una sola transacción
+CARGA_COMMIT_CADA = config('CARGA_COMMIT_CADA', default=5000, cast=int)
+# Procesos para validar las líneas en paralelo (1 = sin paralelismo; la escritura en BD es siempre un solo proceso)
+CARGA_PROCESOS = config('CARGA_PROCESOS', default=1, cast=int)
+# Valor por defecto de "omitir líneas ya cargadas" (se puede indicar por carga con omitir_duplicadas)
+CARGA_OMITIR_DUPLICADAS = config('CARGA_OMITIR_DUPLICADAS', default=False, cast=bool)
+# Validar las líneas en la BD con sentencias por conjunto sobre carga_staging en lugar de línea a línea
+# en Python (se puede indicar por carga con validacion_sql; no aplica a la vista previa)
+CARGA_VALIDACION_SQL = config('CARGA_VALIDACION_SQL', default=False, cast=bool)
+# Diferencia máxima aceptada por la reconciliación entre la suma de factores guardada y la de sus detalles
+CARGA_RECONCILIACION_TOLERANCIA = config('CARGA_RECONCILIACION_TOLERANCIA', default='0.000001')
+# Filas calculadas que devuelve /api/cargas/calculate_factores/ (el resto solo se cuenta en los totales)
+CARGA_PREVIEW_MAX_FILAS = config('CARGA_PREVIEW_MAX_FILAS', default=100, cast=int)
+# Calificaciones por bloque (y por transacción) del recálculo masivo de factores
+RECALCULO_BLOQUE = config('RECALCULO_BLOQUE', default=500, cast=int)
+# Archivos subidos: hasta CARGA_UPLOAD_MAX_MEMORIA bytes se reciben en memoria; los más
+# grandes se escriben por bloques en CARGA_UPLOAD_TEMP_DIR (vacío = temporal del sistema)
+# y se leen desde disco con mmap. Ambos handlers calculan el SHA-256 al recibir el archivo
+FILE_UPLOAD_MAX_MEMORY_SIZE = config('CARGA_UPLOAD_MAX_MEMORIA', default=2621440, cast=int)
+FILE_UPLOAD_TEMP_DIR = config('CARGA_UPLOAD_TEMP_DIR', default='') or None
+FILE_UPLOAD_HANDLERS = [
+    'cargas.uploads.MemorySha256UploadHandler',
+    'cargas.uploads.TemporarySha256UploadHandler',
+]
+# Cada cuántas líneas el worker publica el avance de una carga (CargaViewSet.progreso / progreso_stream)
+CARGA_PROGRESO_CADA = config('CARGA_PROGRESO_CADA', default=1000, cast=int)
+
+# Caché 'cargas': avance en vivo de las cargas. Lo escribe el worker procesar_cargas
+# y lo lee el servidor web, por lo que debe ser compartido entre ambos procesos
+# (por defecto en disco; puede apuntar a Redis o Memcached cambiando el backend)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'cargas': {
+        'BACKEND': config('CARGA_PROGRESO_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CARGA_PROGRESO_CACHE_LOCATION', default=str(BASE_DIR / 'cache' / 'cargas')),
+    },
+}
@@ -74,8 +74,9 @@ function mostrarPreviewFactores(data) {
     });
     
     html += '</tbody></table></div>';
-    if (data.preview.length > 5) {
-        html += `<p class="text-muted mt-2"><small>Mostrando 5 de ${data.preview.length} filas</small></p>`;
+    const totalValidas = data.validas || data.preview.length;
+    if (totalValidas > 5) {
+        html += `<p class="text-muted mt-2"><small>Mostrando 5 de ${totalValidas} filas</small></p>`;
     }
     html += '</div></div>';
     
@@ -180,9 +181,12 @@ export async function cargarFactor(event) {
     const file = fileInput.files[0];
     const isCsv = file.name.endsWith('.csv');
     const isExcel = file.name.endsWith('.xlsx') || file.name.endsWith('.xls');
+    const isParquet = file.name.endsWith('.parquet');
+    // CSV comprimido: un .zip puede traer varios CSV (se crea una carga por cada uno)
+    const isComprimido = file.name.endsWith('.csv.gz') || file.name.endsWith('.zip');
     
-    if (!isCsv && !isExcel) {
-        alert('El archivo debe ser CSV o Excel (.xlsx, .xls)');
+    if (!isCsv && !isExcel && !isParquet && !isComprimido) {
+        alert('El archivo debe ser CSV, Excel (.xlsx, .xls), Parquet o CSV comprimido (.csv.gz, .zip)');
         return;
     }
     
@@ -218,11 +222,24 @@ export async function cargarFactor(event) {
             return;
         }
         
-        if (res.ok) {
+        // La carga se procesa en segundo plano: esperar el resultado
+        let ok = res.ok;
+        if (res.status === 202) {
+            btn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Procesando en segundo plano...';
+            ({ ok, data } = await esperarCargas(data, progreso => {
+                btn.innerHTML = `<i class="fas fa-spinner fa-spin me-1"></i> ${textoProgreso(progreso)}`;
+            }));
+        }
+        
+        if (ok) {
             let mensaje = `Carga completada:\n\n` +
                            `Filas totales: ${data.filas_total}\n` +
                            `Insertadas: ${data.insertados}\n` +
+                           `Actualizadas: ${data.actualizados || 0}\n` +
                            `Rechazadas: ${data.rechazados}`;
+            if (data.omitidos) {
+                mensaje += `\nOmitidas (sin cambios): ${data.omitidos}`;
+            }
             
             // Si hay errores, agregar detalles al mensaje
             if (data.errores && data.errores.length > 0) {
@@ -271,16 +288,17 @@ export async function cargarMonto(event) {
     }
     
     const file = fileInput.files[0];
-    const isCsv = file.name.endsWith('.csv');
+    const isCsv = file.name.endsWith('.csv') || file.name.endsWith('.csv.gz');
     const isExcel = file.name.endsWith('.xlsx') || file.name.endsWith('.xls');
+    const isParquet = file.name.endsWith('.parquet');
     
-    if (!isCsv && !isExcel) {
-        alert('El archivo debe ser CSV o Excel (.xlsx, .xls)');
+    if (!isCsv && !isExcel && !isParquet) {
+        alert('El archivo debe ser CSV (.csv, .csv.gz), Excel (.xlsx, .xls) o Parquet');
         return;
     }
     
     // Verificar que se hayan calculado factores primero
-    if (!previewFactores || !previewFactores.preview || previewFactores.preview.length === 0) {
+    if (!previewFactores || !previewFactores.carga_id || !previewFactores.preview || previewFactores.preview.length === 0) {
         alert('Por favor calcule los factores primero haciendo clic en "Calcular Factores"');
         return;
     }
@@ -292,17 +310,13 @@ export async function cargarMonto(event) {
     btn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Grabando...';
     
     try {
-        // Enviar archivo al backend para grabar
-        const formData = new FormData();
-        formData.append('file', file);
-        
+        // Confirmar la carga preparada en "Calcular Factores" (el archivo no se vuelve a subir)
         const csrfToken = getCookie('csrftoken');
-        const res = await fetch(`${API_BASE_URL}/cargas/upload_montos/`, {
+        const res = await fetch(`${API_BASE_URL}/cargas/${previewFactores.carga_id}/confirmar/`, {
             method: 'POST',
             headers: {
                 'X-CSRFToken': csrfToken
-            },
-            body: formData
+            }
         });
         
         const text = await res.text();
@@ -315,11 +329,24 @@ export async function cargarMonto(event) {
             return;
         }
         
-        if (res.ok) {
+        // La carga se procesa en segundo plano: esperar el resultado
+        let ok = res.ok;
+        if (res.status === 202) {
+            btn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i> Procesando en segundo plano...';
+            ({ ok, data } = await esperarCarga(data.carga_id, progreso => {
+                btn.innerHTML = `<i class="fas fa-spinner fa-spin me-1"></i> ${textoProgreso(progreso)}`;
+            }));
+        }
+        
+        if (ok) {
             let mensaje = `Carga completada:\n\n` +
                          `Filas totales: ${data.filas_total}\n` +
                          `Insertadas: ${data.insertados}\n` +
+                         `Actualizadas: ${data.actualizados || 0}\n` +
                          `Rechazadas: ${data.rechazados}`;
+            if (data.omitidos) {
+                mensaje += `\nOmitidas (sin cambios): ${data.omitidos}`;
+            }
             
             if (data.errores && data.errores.length > 0) {
                 const erroresTexto = data.errores.map(e => `Línea ${e.linea}: ${e.error}`).join('\n');
@@ -391,11 +418,12 @@ export async function calcularFactores() {
     }
     
     const file = fileInput.files[0];
-    const isCsv = file.name.endsWith('.csv');
+    const isCsv = file.name.endsWith('.csv') || file.name.endsWith('.csv.gz');
     const isExcel = file.name.endsWith('.xlsx') || file.name.endsWith('.xls');
+    const isParquet = file.name.endsWith('.parquet');
     
-    if (!isCsv && !isExcel) {
-        alert('El archivo debe ser CSV o Excel (.xlsx, .xls)');
+    if (!isCsv && !isExcel && !isParquet) {
+        alert('El archivo debe ser CSV (.csv, .csv.gz), Excel (.xlsx, .xls) o Parquet');
         return;
     }
     
@@ -411,12 +439,13 @@ export async function calcularFactores() {
     }
     
     try {
-        // Enviar archivo al backend para calcular factores
+        // Enviar archivo al backend: el worker lo valida una sola vez y deja la carga preparada
         const formData = new FormData();
         formData.append('file', file);
+        formData.append('formato', 'montos');
         
         const csrfToken = getCookie('csrftoken');
-        const res = await fetch(`${API_BASE_URL}/cargas/calculate_factores/`, {
+        const res = await fetch(`${API_BASE_URL}/cargas/preparar/`, {
             method: 'POST',
             headers: {
                 'X-CSRFToken': csrfToken
@@ -434,7 +463,20 @@ export async function calcularFactores() {
             return;
         }
         
-        if (res.ok) {
+        let ok = res.ok;
+        if (ok) {
+            ({ ok, data } = await esperarCarga(data.carga_id, progreso => {
+                const bar = progress ? progress.querySelector('.progress-bar') : null;
+                if (bar) {
+                    bar.textContent = textoProgreso(progreso);
+                }
+            }));
+        }
+        if (ok) {
+            data = await obtenerVistaPrevia(data);
+        }
+        
+        if (ok) {
             // Guardar preview para usar en cargarMonto
             previewFactores = data;
             
@@ -490,6 +532,120 @@ export async function calcularFactores() {
     }
 }
 
+/**
+ * Esperar a que el worker termine de procesar una carga (upload responde 202).
+ * Sigue el avance por /cargas/{id}/progreso/stream/ (server-sent events) y, al
+ * terminar, lee /cargas/{id}/resultado/ una vez. Si el navegador no soporta
+ * EventSource o la conexión se corta, consulta /resultado/ cada intervaloMs.
+ * onProgreso(progreso) recibe cada evento (estado, lineas_procesadas, lineas_por_segundo, ...).
+ */
+async function esperarCarga(cargaId, onProgreso = null, intervaloMs = 1500) {
+    if (window.EventSource) {
+        await esperarEventosCarga(cargaId, onProgreso);
+    }
+    while (true) {
+        const res = await fetch(`${API_BASE_URL}/cargas/${cargaId}/resultado/`);
+        const data = await res.json();
+        if (!res.ok) {
+            return { ok: false, data };
+        }
+        if (data.estado === 'done' || data.estado === 'preparada') {
+            return { ok: true, data };
+        }
+        if (data.estado === 'failed') {
+            return { ok: false, data: { error: data.mensaje_error || 'La carga falló' } };
+        }
+        if (data.estado === 'pausada' || data.estado === 'cancelada') {
+            return { ok: false, data: { error: `La carga fue ${data.estado}` } };
+        }
+        await new Promise(resolve => setTimeout(resolve, intervaloMs));
+    }
+}
+
+/**
+ * Esperar todas las cargas creadas por un upload (un .zip crea una carga por CSV)
+ * y sumar sus resultados. Se detiene en la primera carga que falle.
+ */
+async function esperarCargas(respuesta, onProgreso = null) {
+    const ids = respuesta.cargas ? respuesta.cargas.map(carga => carga.carga_id) : [respuesta.carga_id];
+    const total = { filas_total: 0, insertados: 0, actualizados: 0, rechazados: 0, omitidos: 0, errores: [] };
+    for (const cargaId of ids) {
+        const { ok, data } = await esperarCarga(cargaId, onProgreso);
+        if (!ok) {
+            return { ok, data };
+        }
+        if (ids.length === 1) {
+            return { ok, data };
+        }
+        for (const campo of ['filas_total', 'insertados', 'actualizados', 'rechazados', 'omitidos']) {
+            total[campo] += data[campo] || 0;
+        }
+        const archivo = respuesta.cargas.find(carga => carga.carga_id === cargaId).archivo;
+        total.errores.push(...(data.errores || []).map(e => ({ ...e, linea: `${e.linea} (${archivo})` })));
+    }
+    total.errores = total.errores.slice(0, 10);
+    return { ok: true, data: total };
+}
+
+/**
+ * Escuchar los eventos 'progreso' de una carga hasta que quede en un estado final.
+ * Resuelve con el último progreso recibido, o null si la conexión falla.
+ */
+function esperarEventosCarga(cargaId, onProgreso) {
+    return new Promise(resolve => {
+        const fuente = new EventSource(`${API_BASE_URL}/cargas/${cargaId}/progreso/stream/`);
+        fuente.addEventListener('progreso', evento => {
+            const progreso = JSON.parse(evento.data);
+            if (onProgreso) {
+                onProgreso(progreso);
+            }
+            if (['done', 'failed', 'preparada', 'pausada', 'cancelada'].includes(progreso.estado)) {
+                fuente.close();
+                resolve(progreso);
+            }
+        });
+        fuente.onerror = () => {
+            // Sin reconexión automática: se sigue con la consulta a /resultado/
+            fuente.close();
+            resolve(null);
+        };
+    });
+}
+
+/**
+ * Texto breve con el avance de una carga en curso
+ */
+function textoProgreso(progreso) {
+    const etapas = {
+        validando: 'Validando',
+        importando: 'Importando',
+        reconciliando: 'Reconciliando'
+    };
+    const etapa = etapas[progreso.estado] || 'Procesando';
+    const velocidad = progreso.lineas_por_segundo ? ` (${progreso.lineas_por_segundo} líneas/s)` : '';
+    return `${etapa}: ${progreso.lineas_procesadas} líneas${velocidad}...`;
+}
+
+/**
+ * Primera página de líneas válidas y de errores de una carga preparada,
+ * con el mismo formato que entregaba calculate_factores.
+ */
+async function obtenerVistaPrevia(resultado) {
+    const cargaId = resultado.carga_id;
+    const [validas, errores] = await Promise.all([
+        fetch(`${API_BASE_URL}/cargas/${cargaId}/vista_previa/?validas=true`).then(r => r.json()),
+        fetch(`${API_BASE_URL}/cargas/${cargaId}/vista_previa/?validas=false`).then(r => r.json())
+    ]);
+    return {
+        carga_id: cargaId,
+        preview: validas.results || [],
+        errores: (errores.results || []).slice(0, 10),
+        total_filas: resultado.filas_total,
+        validas: validas.count || 0,
+        rechazadas: errores.count || 0
+    };
+}
+
 /**
  * Función helper para recargar calificaciones después de carga masiva
  */